@@ -0,0 +1,157 @@
+"""
+Activation checkpointing (`--activation_checkpointing`) for contrastive training. First checks that
+with dropout on, the loss and gradients equal those of training without checkpointing (the recompute
+must reproduce the dropout masks). Then, with checkpointing off and on, doubles the batch size until
+a step no longer fits and reports the memory and step time of every batch size that did.
+
+A step is `cl_forward` on SumCSE-style triples (sentence, summary, hard negative) plus backward. The
+memory reported is the size of the activations autograd saves for backward (what checkpointing trades
+for recomputation) and, on GPU, the peak allocated memory. On GPU a batch fits if it does not run out
+of memory; on CPU, whose peak RSS is too noisy to compare, if the saved activations stay within
+`--memory_budget_mb`. Each batch size runs in a fresh subprocess. The encoder is randomly initialized
+with the shape of `--model_name_or_path` (or BERT-base), since memory and time do not depend on weights.
+
+    python benchmarks/bench_checkpointing.py --model_name_or_path roberta-large --seq_len 32
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from types import SimpleNamespace
+
+import torch
+from transformers import AutoConfig, BertConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import BertForCL, RobertaForCL
+
+
+def make_model(args, checkpointing, dropout=None):
+    config = AutoConfig.from_pretrained(args.model_name_or_path) if args.model_name_or_path else BertConfig()
+    if args.num_hidden_layers is not None:
+        config.num_hidden_layers = args.num_hidden_layers
+    if dropout is not None:
+        config.hidden_dropout_prob = config.attention_probs_dropout_prob = dropout
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False, activation_checkpointing=checkpointing)
+    torch.manual_seed(args.seed)
+    model_class = RobertaForCL if config.model_type == "roberta" else BertForCL
+    model = model_class(config, model_args=model_args)
+    model.train()
+    return model
+
+
+def make_batch(batch_size, seq_len, vocab_size, device, seed):
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(5, vocab_size, (batch_size, 3, seq_len), generator=generator)
+    return {"input_ids": input_ids.to(device), "attention_mask": torch.ones_like(input_ids).to(device)}
+
+
+def step(model, batch, saved=None):
+    model.zero_grad()
+    if saved is None:
+        loss = model(**batch).loss
+    else:
+        # Record the storages autograd saves for backward, except the parameters
+        params = set(p.storage().data_ptr() for p in model.parameters())
+
+        def pack(t):
+            if t.storage().data_ptr() not in params:
+                saved[t.storage().data_ptr()] = t.storage().size() * t.element_size()
+            return t
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            loss = model(**batch).loss
+    loss.backward()
+    return loss
+
+
+def check_dropout(args):
+    batch = make_batch(8, 16, 1000, "cpu", args.seed)
+    results = []
+    for checkpointing in [False, True]:
+        model = make_model(args, checkpointing, dropout=0.1)
+        torch.manual_seed(args.seed + 1)
+        loss = step(model, batch)
+        results.append((loss.item(), {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}))
+    (loss_off, grads_off), (loss_on, grads_on) = results
+    max_diff = max((grads_off[n] - grads_on[n]).abs().max().item() for n in grads_off)
+    ok = abs(loss_off - loss_on) <= 1e-6 * abs(loss_off) and set(grads_off) == set(grads_on) and max_diff <= 1e-5
+    print("dropout 0.1: loss %.6f (off) vs %.6f (on), max |grad diff| %.2e   %s" % (loss_off, loss_on, max_diff, "OK" if ok else "MISMATCH"))
+    return ok
+
+
+def run(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = make_model(args, args.mode == "on").to(device)
+    vocab_size = model.config.vocab_size
+    step(model, make_batch(2, args.seq_len, vocab_size, device, args.seed))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    batch = make_batch(args.batch_size, args.seq_len, vocab_size, device, args.seed)
+    try:
+        saved = {}
+        step(model, batch, saved)
+        times = []
+        for _ in range(args.steps):
+            start = time.perf_counter()
+            step(model, batch)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+    except RuntimeError as e:
+        if "out of memory" in str(e):
+            print("oom")
+            return
+        raise
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == "cuda" else float("nan")
+    print("%.1f %.1f %.3f" % (sum(saved.values()) / 2 ** 20, peak, sorted(times)[len(times) // 2]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", type=str, default=None)
+    parser.add_argument("--num_hidden_layers", type=int, default=None, help="Override the number of layers (e.g., to run faster)")
+    parser.add_argument("--seq_len", type=int, default=32)
+    parser.add_argument("--start_batch_size", type=int, default=8)
+    parser.add_argument("--max_batch_size", type=int, default=1024)
+    parser.add_argument("--memory_budget_mb", type=float, default=2048, help="CPU only: allowed size of the saved activations")
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--batch_size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run(args)
+        return
+
+    all_ok = check_dropout(args)
+    on_gpu = torch.cuda.is_available()
+    print("seq_len %d, 3 sentences per example, %s" % (args.seq_len, "GPU" if on_gpu else "CPU budget %d MB" % args.memory_budget_mb))
+    print("%-14s %8s %15s %10s %10s %14s" % ("checkpointing", "batch", "activations MB", "peak MB", "step s", "ms / example"))
+    for mode in ["off", "on"]:
+        batch_size, max_fit = args.start_batch_size, None
+        while batch_size <= args.max_batch_size:
+            cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--batch_size", str(batch_size),
+                   "--seq_len", str(args.seq_len), "--steps", str(args.steps), "--seed", str(args.seed)]
+            if args.model_name_or_path is not None:
+                cmd += ["--model_name_or_path", args.model_name_or_path]
+            if args.num_hidden_layers is not None:
+                cmd += ["--num_hidden_layers", str(args.num_hidden_layers)]
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+            fields = result.stdout.split()
+            if result.returncode != 0 or fields == ["oom"] or (not on_gpu and float(fields[0]) > args.memory_budget_mb):
+                break
+            activations, peak, step_time = float(fields[0]), float(fields[1]), float(fields[2])
+            print("%-14s %8d %15.1f %10.1f %10.3f %14.2f" % (mode, batch_size, activations, peak, step_time, 1000 * step_time / batch_size))
+            max_fit = batch_size
+            batch_size *= 2
+        print("%-14s max batch size: %s" % (mode, max_fit))
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Collation of contrastive batches: the previous `OurDataCollatorWithPadding` path (one dict per view,
+`tokenizer.pad`, reshape) against `simcse.data.collate_views` (one vectorized fill per input). Checks
+that both produce the same tensors, with and without token type ids, with left padding,
+`pad_to_multiple_of`, `max_length` padding and a per-example `sent_ids` column. Then times a batch of
+each size (sentence, summary, hard negative triples of random length).
+
+    python benchmarks/bench_collator.py --batch_sizes 64 128 512
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import torch
+from transformers import BertTokenizerFast
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.data import collate_views
+
+SPECIAL_KEYS = ['input_ids', 'attention_mask', 'token_type_ids', 'mlm_input_ids', 'mlm_labels']
+
+
+def make_tokenizer():
+    path = os.path.join(tempfile.mkdtemp(), "vocab.txt")
+    with open(path, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + ["w%d" % i for i in range(1000)]))
+    return BertTokenizerFast(path)
+
+
+def make_features(batch_size, max_len, rng, token_type_ids=True, sent_ids=False):
+    features = []
+    for i in range(batch_size):
+        views = [[2] + [rng.randrange(5, 1005) for _ in range(rng.randint(1, max_len - 2))] + [3] for _ in range(3)]
+        feature = {"input_ids": views, "attention_mask": [[1] * len(v) for v in views]}
+        if token_type_ids:
+            feature["token_type_ids"] = [[0] * len(v) for v in views]
+        if sent_ids:
+            feature["sent_ids"] = [3 * i, 3 * i + 1, 3 * i + 2]
+        features.append(feature)
+    return features
+
+
+def previous_collate(tokenizer, features, padding=True, max_length=None, pad_to_multiple_of=None):
+    bs = len(features)
+    num_sent = len(features[0]['input_ids'])
+    flat_features = []
+    for feature in features:
+        for i in range(num_sent):
+            flat_features.append({k: feature[k][i] if k in SPECIAL_KEYS else feature[k] for k in feature})
+    batch = tokenizer.pad(flat_features, padding=padding, max_length=max_length, pad_to_multiple_of=pad_to_multiple_of, return_tensors="pt")
+    return {k: batch[k].view(bs, num_sent, -1) if k in SPECIAL_KEYS else batch[k].view(bs, num_sent, -1)[:, 0] for k in batch}
+
+
+def current_collate(tokenizer, features, padding=True, max_length=None, pad_to_multiple_of=None):
+    bs = len(features)
+    num_sent = len(features[0]['input_ids'])
+    batch = collate_views(features, pad_token_id=tokenizer.pad_token_id, pad_token_type_id=tokenizer.pad_token_type_id,
+                          padding_side=tokenizer.padding_side, max_length=max_length if padding == "max_length" else None,
+                          pad_to_multiple_of=pad_to_multiple_of)
+    return {k: batch[k].view(bs, num_sent, -1) if k in SPECIAL_KEYS else batch[k] for k in batch}
+
+
+def check(tokenizer, rng):
+    cases = [
+        ("BERT inputs", {}, {}),
+        ("no token type ids", {"token_type_ids": False}, {}),
+        ("sent_ids column", {"sent_ids": True}, {}),
+        ("pad_to_multiple_of 8", {}, {"pad_to_multiple_of": 8}),
+        ("max_length 40", {}, {"padding": "max_length", "max_length": 40}),
+        ("left padding", {}, {}),
+    ]
+    all_ok = True
+    for name, feature_kwargs, collate_kwargs in cases:
+        tokenizer.padding_side = "left" if name == "left padding" else "right"
+        features = make_features(16, 32, rng, **feature_kwargs)
+        expected = previous_collate(tokenizer, features, **collate_kwargs)
+        got = current_collate(tokenizer, features, **collate_kwargs)
+        ok = expected.keys() == got.keys() and all(expected[k].shape == got[k].shape and torch.equal(expected[k], got[k]) for k in expected)
+        print("%-22s %s   %s" % (name, {k: tuple(v.shape) for k, v in got.items()}, "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+    tokenizer.padding_side = "right"
+    return all_ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[64, 128, 512])
+    parser.add_argument("--max_len", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tokenizer = make_tokenizer()
+    all_ok = check(tokenizer, rng)
+
+    print("%-8s %14s %14s %8s" % ("batch", "previous ms", "vectorized ms", "speedup"))
+    for batch_size in args.batch_sizes:
+        batches = [make_features(batch_size, args.max_len, rng) for _ in range(args.repeats)]
+        times = {}
+        for name, collate in [("previous", previous_collate), ("current", current_collate)]:
+            start = time.perf_counter()
+            for features in batches:
+                collate(tokenizer, features)
+            times[name] = 1000 * (time.perf_counter() - start) / args.repeats
+        print("%-8d %14.2f %14.2f %7.1fx" % (batch_size, times["previous"], times["current"], times["previous"] / times["current"]))
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
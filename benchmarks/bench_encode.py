@@ -0,0 +1,93 @@
+"""
+Throughput of `SimCSE.encode` on a corpus with skewed sentence lengths: most sentences are short
+queries and a few are multi-sentence passages. Compares arrival-order batching (the default)
+with length-sorted batching and token-budget batching.
+
+    python benchmarks/bench_encode.py --model_name_or_path princeton-nlp/sup-simcse-bert-base-uncased
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse import SimCSE
+
+WORDS = ("a man woman child dog cat is are was playing reading eating riding walking slicing "
+         "the a guitar piano violin book horse bike street park kitchen meat picture music "
+         "quickly slowly happily while near under over with and or").split()
+
+
+def skewed_corpus(num_sentences, long_ratio, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(num_sentences):
+        if rng.random() < long_ratio:
+            num_words = rng.randint(80, 120)
+        else:
+            num_words = rng.randint(4, 12)
+        corpus.append(" ".join(rng.choice(WORDS) for _ in range(num_words)))
+    return corpus
+
+
+def padding_ratio(model, corpus, batches, max_length):
+    lengths = [len(ids) for ids in model.tokenizer(corpus, truncation=True, max_length=max_length)["input_ids"]]
+    real, padded = 0, 0
+    for batch in batches:
+        batch_lengths = [lengths[i] for i in batch]
+        real += sum(batch_lengths)
+        padded += max(batch_lengths) * len(batch_lengths)
+    return 1.0 - real / padded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", type=str, default="princeton-nlp/sup-simcse-bert-base-uncased")
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--num_sentences", type=int, default=4096)
+    parser.add_argument("--long_ratio", type=float, default=0.05, help="Fraction of long passages in the corpus")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--max_tokens", type=int, default=64 * 32, help="Padded-token budget per batch")
+    parser.add_argument("--max_length", type=int, default=128)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    model = SimCSE(args.model_name_or_path, device=args.device)
+    corpus = skewed_corpus(args.num_sentences, args.long_ratio, args.seed)
+
+    # Warm up
+    model.encode(corpus[:args.batch_size], batch_size=args.batch_size, max_length=args.max_length)
+
+    settings = [
+        ("arrival order", {}),
+        ("sort_by_length", {"sort_by_length": True}),
+        ("max_tokens=%d" % args.max_tokens, {"max_tokens": args.max_tokens}),
+    ]
+    reference = None
+    print("%-20s %10s %12s %10s %12s" % ("mode", "seconds", "sents/sec", "padding", "max |diff|"))
+    for name, kwargs in settings:
+        if kwargs.get("sort_by_length") or kwargs.get("max_tokens") is not None:
+            lengths = [len(ids) for ids in model.tokenizer(corpus, truncation=True, max_length=args.max_length)["input_ids"]]
+            order = sorted(range(len(corpus)), key=lambda i: lengths[i], reverse=True)
+            batches = SimCSE._length_sorted_batches(order, lengths, args.batch_size, kwargs.get("max_tokens"))
+        else:
+            batches = [range(s, min(s + args.batch_size, len(corpus))) for s in range(0, len(corpus), args.batch_size)]
+
+        start = time.time()
+        embeddings = model.encode(corpus, batch_size=args.batch_size, max_length=args.max_length, **kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        elapsed = time.time() - start
+
+        if reference is None:
+            reference = embeddings
+        diff = (embeddings - reference).abs().max().item()
+        print("%-20s %10.2f %12.1f %9.1f%% %12.2e" % (
+            name, elapsed, len(corpus) / elapsed, 100 * padding_ratio(model, corpus, batches, args.max_length), diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Partial fine-tuning with frozen bottom layers (`--freeze_layers`) and the cache of their outputs
+(`simcse.frozen`). First checks, with dropout off, that the loss and the gradients of the trainable
+parameters equal those of the unfrozen model, in the first epoch (frozen outputs computed) and the
+second (read from the cache). Then times a few epochs of training steps on synthetic SumCSE-style
+triples (sentence, summary, hard negative) in three modes: full fine-tuning, frozen layers recomputed
+every step, and frozen layers cached.
+
+The encoder is randomly initialized with the shape of `--model_name_or_path` (or BERT-base), since
+time does not depend on the weights.
+
+    python benchmarks/bench_frozen_cache.py --freeze_layers 6 --num_examples 256 --epochs 3
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import AutoConfig, BertConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import BertForCL, RobertaForCL
+from simcse.frozen import FrozenLayerCache, assign_sentence_ids
+
+
+def make_model(config, freeze_layers, seed):
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False, freeze_layers=freeze_layers)
+    torch.manual_seed(seed)
+    model_class = RobertaForCL if config.model_type == "roberta" else BertForCL
+    return model_class(config, model_args=model_args).train()
+
+
+def make_dataset(num_examples, max_len, vocab_size, pad_token_id, seed):
+    """
+    Triples with random lengths; every fourth hard negative repeats another example's sentence.
+    """
+    rng = np.random.RandomState(seed)
+    input_ids, attention_mask = [], []
+    for i in range(num_examples):
+        lengths = [rng.randint(max_len // 2, max_len + 1), rng.randint(max_len // 4, max_len // 2 + 1), rng.randint(max_len // 2, max_len + 1)]
+        example = [list(rng.randint(5, vocab_size, size=n)) for n in lengths]
+        if i % 4 == 3:
+            example[2] = input_ids[i - 1][0]
+        input_ids.append(example)
+        attention_mask.append([[1] * len(s) for s in example])
+    sent_ids, lengths = assign_sentence_ids(input_ids, attention_mask)
+    return input_ids, sent_ids, lengths, pad_token_id
+
+
+def collate(dataset, indices):
+    input_ids, sent_ids, _, pad_token_id = dataset
+    max_len = max(len(s) for i in indices for s in input_ids[i])
+    ids = torch.full((len(indices), 3, max_len), pad_token_id, dtype=torch.long)
+    mask = torch.zeros_like(ids)
+    for row, i in enumerate(indices):
+        for j, s in enumerate(input_ids[i]):
+            ids[row, j, :len(s)] = torch.tensor(s)
+            mask[row, j, :len(s)] = 1
+    return {"input_ids": ids, "attention_mask": mask, "sent_ids": torch.tensor([sent_ids[i] for i in indices])}
+
+
+def grads(model):
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+def check_equal(args, config):
+    config = copy.deepcopy(config)
+    config.hidden_dropout_prob = config.attention_probs_dropout_prob = 0.0
+    dataset = make_dataset(16, 16, config.vocab_size, config.pad_token_id or 0, args.seed)
+    batch = collate(dataset, list(range(16)))
+    full = make_model(config, 0, args.seed)
+    full(**{k: v for k, v in batch.items() if k != "sent_ids"}).loss.backward()
+    frozen = make_model(config, args.freeze_layers, args.seed)
+    frozen.frozen_cache = FrozenLayerCache(os.path.join(tempfile.mkdtemp(), "cache.bin"), dataset[2], config.hidden_size)
+    all_ok = True
+    for epoch in range(2):
+        frozen.zero_grad()
+        loss = frozen(**batch).loss
+        loss.backward()
+        frozen_grads, full_grads = grads(frozen), grads(full)
+        max_diff = max((frozen_grads[n] - full_grads[n]).abs().max().item() for n in frozen_grads)
+        ok = abs(loss.item() - full(**{k: v for k, v in batch.items() if k != "sent_ids"}).loss.item()) <= 1e-5 and max_diff <= 1e-5
+        print("epoch %d: %d of %d parameters trained, max |grad diff| %.2e   %s" % (
+            epoch + 1, len(frozen_grads), len(full_grads), max_diff, "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+    frozen.frozen_cache.close()
+    return all_ok
+
+
+def time_epochs(args, config, mode):
+    freeze_layers = 0 if mode == "full" else args.freeze_layers
+    model = make_model(config, freeze_layers, args.seed)
+    dataset = make_dataset(args.num_examples, args.seq_len, config.vocab_size, config.pad_token_id or 0, args.seed)
+    if mode == "cached":
+        model.frozen_cache = FrozenLayerCache(os.path.join(tempfile.mkdtemp(), "cache.bin"), dataset[2], config.hidden_size)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    rng = np.random.RandomState(args.seed)
+    times = []
+    for _ in range(args.epochs):
+        order = rng.permutation(args.num_examples)
+        start = time.perf_counter()
+        for i in range(0, args.num_examples, args.batch_size):
+            batch = collate(dataset, order[i:i + args.batch_size])
+            if mode != "cached":
+                del batch["sent_ids"]
+            optimizer.zero_grad()
+            model(**batch).loss.backward()
+            optimizer.step()
+        times.append(time.perf_counter() - start)
+    if mode == "cached":
+        size = os.path.getsize(model.frozen_cache.path)
+        model.frozen_cache.close()
+        return times, size
+    return times, 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", type=str, default=None)
+    parser.add_argument("--num_hidden_layers", type=int, default=None, help="Override the number of layers (e.g., to run faster)")
+    parser.add_argument("--freeze_layers", type=int, default=6)
+    parser.add_argument("--num_examples", type=int, default=256)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--seq_len", type=int, default=32, help="Longest sentence")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = AutoConfig.from_pretrained(args.model_name_or_path) if args.model_name_or_path else BertConfig()
+    if args.num_hidden_layers is not None:
+        config.num_hidden_layers = args.num_hidden_layers
+
+    all_ok = check_equal(args, config)
+    print("%d layers, %d frozen, %d examples, batch %d, sentences up to %d tokens" % (
+        config.num_hidden_layers, args.freeze_layers, args.num_examples, args.batch_size, args.seq_len))
+    print("%-10s %s" % ("mode", "  ".join("epoch %d s" % (e + 1) for e in range(args.epochs))))
+    for mode in ["full", "frozen", "cached"]:
+        times, size = time_epochs(args, config, mode)
+        print("%-10s %s%s" % (mode, "  ".join("%9.2f" % t for t in times), "   (cache file %.1f MB)" % (size / 2 ** 20) if size else ""))
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
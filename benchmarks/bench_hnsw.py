@@ -0,0 +1,90 @@
+"""
+Single-query latency (p50/p99) and recall@k of the HNSW index (`simcse.hnsw.HNSWIndex`) against
+the brute-force and IVF (`simcse.ivf.IVFIndex`) paths on the same corpus. Uses synthetic clustered
+unit vectors by default, or the `embeddings.npy` of an index saved with `SimCSE.save_index`.
+With `--faiss`, faiss's `IndexHNSWFlat` and `IndexIVFFlat` are measured as well.
+
+    python benchmarks/bench_hnsw.py --num_vectors 50000 --dim 768
+    python benchmarks/bench_hnsw.py --embeddings my_index/embeddings.npy --ef_search 32 64 128
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.index import topk_inner_product
+from simcse.ivf import IVFIndex
+from simcse.hnsw import HNSWIndex
+from bench_ivf import clustered_vectors, normalize, timed_search, recall_at_k
+
+
+def report(name, knob, ids, ms, true_ids):
+    print("%-12s %10s %10.3f %10.2f %10.2f" % (name, knob, recall_at_k(ids, true_ids), np.percentile(ms, 50), np.percentile(ms, 99)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", type=str, default=None, help="A .npy matrix of unit-normalized vectors")
+    parser.add_argument("--num_vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--num_cells", type=int, default=100)
+    parser.add_argument("--nprobe", type=int, default=10)
+    parser.add_argument("--num_neighbors", type=int, default=32)
+    parser.add_argument("--ef_search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--faiss", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.embeddings is not None:
+        corpus = np.load(args.embeddings)
+    else:
+        corpus = clustered_vectors(args.num_vectors, args.dim, num_clusters=args.num_cells, seed=args.seed)
+    rng = np.random.RandomState(args.seed + 1)
+    queries = corpus[rng.choice(len(corpus), args.num_queries, replace=False)]
+    queries = normalize(queries + 0.1 * rng.randn(*queries.shape).astype(np.float32))
+
+    true_ids, flat_ms = timed_search(lambda q: topk_inner_product(q, corpus, args.top_k), queries)
+
+    start = time.time()
+    ivf = IVFIndex(corpus.shape[1], num_cells=args.num_cells, nprobe=args.nprobe)
+    ivf.train(corpus)
+    ivf.add(corpus)
+    print("IVF build: %.1fs" % (time.time() - start))
+    start = time.time()
+    hnsw = HNSWIndex(corpus.shape[1], num_neighbors=args.num_neighbors)
+    hnsw.add(corpus)
+    print("HNSW build: %.1fs" % (time.time() - start))
+
+    print("%-12s %10s %10s %10s %10s" % ("backend", "knob", "recall@%d" % args.top_k, "p50 ms", "p99 ms"))
+    report("brute force", "-", true_ids, flat_ms, true_ids)
+    ids, ms = timed_search(lambda q: ivf.search(q, args.top_k), queries)
+    report("ivf", "nprobe=%d" % args.nprobe, ids, ms, true_ids)
+    for ef_search in args.ef_search:
+        hnsw.ef_search = ef_search
+        ids, ms = timed_search(lambda q: hnsw.search(q, args.top_k), queries)
+        report("hnsw", "ef=%d" % ef_search, ids, ms, true_ids)
+
+    if args.faiss:
+        import faiss
+        quantizer = faiss.IndexFlatIP(corpus.shape[1])
+        faiss_ivf = faiss.IndexIVFFlat(quantizer, corpus.shape[1], args.num_cells, faiss.METRIC_INNER_PRODUCT)
+        faiss_ivf.train(corpus)
+        faiss_ivf.add(corpus)
+        faiss_ivf.nprobe = args.nprobe
+        ids, ms = timed_search(lambda q: faiss_ivf.search(q, args.top_k), queries)
+        report("faiss ivf", "nprobe=%d" % args.nprobe, ids, ms, true_ids)
+        faiss_hnsw = faiss.IndexHNSWFlat(corpus.shape[1], args.num_neighbors, faiss.METRIC_INNER_PRODUCT)
+        faiss_hnsw.add(corpus)
+        for ef_search in args.ef_search:
+            faiss_hnsw.hnsw.efSearch = ef_search
+            ids, ms = timed_search(lambda q: faiss_hnsw.search(q, args.top_k), queries)
+            report("faiss hnsw", "ef=%d" % ef_search, ids, ms, true_ids)
+
+
+if __name__ == "__main__":
+    main()
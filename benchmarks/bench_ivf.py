@@ -0,0 +1,85 @@
+"""
+Recall@k versus per-query latency of the NumPy IVF index (`simcse.ivf.IVFIndex`) against exact
+brute-force search. Uses synthetic clustered unit vectors by default, or the `embeddings.npy` of an
+index saved with `SimCSE.save_index`.
+
+    python benchmarks/bench_ivf.py --num_vectors 200000 --dim 768 --num_cells 1000
+    python benchmarks/bench_ivf.py --embeddings my_index/embeddings.npy
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.index import topk_inner_product
+from simcse.ivf import IVFIndex
+
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def clustered_vectors(num_vectors, dim, num_clusters, seed):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(num_clusters, dim).astype(np.float32)
+    assignment = rng.randint(num_clusters, size=num_vectors)
+    return normalize(centers[assignment] + 0.5 * rng.randn(num_vectors, dim).astype(np.float32))
+
+
+def timed_search(search_fn, queries):
+    # One query at a time, as in single-request serving
+    latencies = []
+    ids = []
+    for query in queries:
+        start = time.perf_counter()
+        _, idx = search_fn(query[None])
+        latencies.append(time.perf_counter() - start)
+        ids.append(idx[0])
+    return np.array(ids), 1000 * np.array(latencies)
+
+
+def recall_at_k(ids, true_ids):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids, true_ids)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", type=str, default=None, help="A .npy matrix of unit-normalized vectors")
+    parser.add_argument("--num_vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("--num_cells", type=int, default=1000)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50])
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.embeddings is not None:
+        corpus = np.load(args.embeddings, mmap_mode="r")
+    else:
+        corpus = clustered_vectors(args.num_vectors, args.dim, num_clusters=args.num_cells, seed=args.seed)
+    rng = np.random.RandomState(args.seed + 1)
+    queries = corpus[rng.choice(len(corpus), args.num_queries, replace=False)]
+    queries = normalize(queries + 0.1 * rng.randn(*queries.shape).astype(np.float32))
+
+    true_ids, flat_ms = timed_search(lambda q: topk_inner_product(q, corpus, args.top_k), queries)
+
+    start = time.time()
+    index = IVFIndex(corpus.shape[1], num_cells=args.num_cells)
+    index.train(corpus)
+    index.add(corpus)
+    print("IVF build: %.1fs for %d vectors, %d cells" % (time.time() - start, len(corpus), index.num_cells))
+
+    print("%-12s %8s %10s %10s %10s" % ("backend", "nprobe", "recall@%d" % args.top_k, "p50 ms", "p99 ms"))
+    print("%-12s %8s %10.3f %10.2f %10.2f" % ("brute force", "-", 1.0, np.percentile(flat_ms, 50), np.percentile(flat_ms, 99)))
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        ids, ms = timed_search(lambda q: index.search(q, args.top_k), queries)
+        print("%-12s %8d %10.3f %10.2f %10.2f" % ("ivf", nprobe, recall_at_k(ids, true_ids), np.percentile(ms, 50), np.percentile(ms, 99)))
+
+
+if __name__ == "__main__":
+    main()
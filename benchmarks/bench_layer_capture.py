@@ -0,0 +1,108 @@
+"""
+Peak memory of sentence encoding for each pooler, before and after capturing only the layers the
+pooler averages (`simcse.capture.LayerCapture`):
+
+- eval: no-grad encoding as in the SentEval batchers, which used to request `output_hidden_states` for
+  every pooler;
+- train: forward and backward of the contrastive representations, which used to request
+  `output_hidden_states` for `avg_top2` / `avg_first_last`.
+
+Each case runs in a fresh subprocess so its peak RSS can be measured on CPU; the numbers are the
+growth of the peak over a warm-up run with a single sentence. The encoder is a randomly initialized
+BERT with the given shape, since memory does not depend on the weights.
+
+    python benchmarks/bench_layer_capture.py --num_hidden_layers 24 --hidden_size 1024
+"""
+import os
+import sys
+import argparse
+import resource
+import subprocess
+from types import SimpleNamespace
+
+import torch
+from transformers import BertConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import BertForCL
+
+POOLERS = ["cls", "cls_before_pooler", "avg", "avg_top2", "avg_first_last"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def encode(model, inputs, mode, capture):
+    if mode == "eval":
+        with torch.no_grad():
+            if capture:
+                return model(**inputs, sent_emb=True, return_dict=True).pooler_output
+            outputs = model.bert(**inputs, output_hidden_states=True, return_dict=True)
+            reps = model.pooler(inputs["attention_mask"], outputs)
+            return model.mlp(reps) if model.pooler_type == "cls" else reps
+    inputs = {k: v.unsqueeze(1) for k, v in inputs.items()}
+    if capture:
+        reps = model(**inputs, embed_only=True)
+    else:
+        flat = {k: v.view(-1, v.size(-1)) for k, v in inputs.items()}
+        outputs = model.bert(**flat, output_hidden_states=model.pooler_type in ["avg_top2", "avg_first_last"], return_dict=True)
+        reps = model.pooler(flat["attention_mask"], outputs)
+        reps = model.mlp(reps) if model.pooler_type == "cls" else reps
+    reps.pow(2).sum().backward()
+    return reps.detach()
+
+
+def run(args):
+    torch.manual_seed(0)
+    config = BertConfig(hidden_size=args.hidden_size, num_hidden_layers=args.num_hidden_layers,
+                        num_attention_heads=args.hidden_size // 64, intermediate_size=4 * args.hidden_size)
+    model_args = SimpleNamespace(pooler_type=args.pooler, temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1, mlp_only_train=False)
+    model = BertForCL(config, model_args=model_args)
+    model.train(args.mode == "train")
+    batch_size = args.eval_batch_size if args.mode == "eval" else args.train_batch_size
+    input_ids = torch.randint(1000, config.vocab_size, (batch_size, args.seq_len))
+    inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    encode(model, {k: v[:1, :8] for k, v in inputs.items()}, args.mode, args.capture)
+    baseline = peak_rss_mb()
+    reps = encode(model, inputs, args.mode, args.capture)
+    print("%.1f %.6e" % (peak_rss_mb() - baseline, reps.double().sum().item()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden_size", type=int, default=768)
+    parser.add_argument("--num_hidden_layers", type=int, default=12)
+    parser.add_argument("--seq_len", type=int, default=64)
+    parser.add_argument("--eval_batch_size", type=int, default=128)
+    parser.add_argument("--train_batch_size", type=int, default=32)
+    parser.add_argument("--pooler", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--capture", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run(args)
+        return
+
+    print("%d layers, hidden %d, seq_len %d, eval batch %d, train batch %d" % (
+        args.num_hidden_layers, args.hidden_size, args.seq_len, args.eval_batch_size, args.train_batch_size))
+    print("%-18s %-6s %18s %14s %6s" % ("pooler", "mode", "hidden_states MB", "capture MB", "same"))
+    for mode in ["eval", "train"]:
+        for pooler in POOLERS:
+            results = []
+            for capture in [False, True]:
+                cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--pooler", pooler,
+                       "--hidden_size", str(args.hidden_size), "--num_hidden_layers", str(args.num_hidden_layers),
+                       "--seq_len", str(args.seq_len), "--eval_batch_size", str(args.eval_batch_size),
+                       "--train_batch_size", str(args.train_batch_size)] + (["--capture"] if capture else [])
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+                results.append(result.stdout.split() if result.returncode == 0 else ["failed", "nan"])
+            same = results[0][1] == results[1][1]
+            print("%-18s %-6s %18s %14s %6s" % (pooler, mode, results[0][0], results[1][0], "yes" if same else "NO"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Length-grouped batches (`--length_group_size`, `simcse.data.LengthGroupedSampler`) against the random
+sampler. First checks the `DistributedSampler` semantics: on 1, 2 and 4 processes every example is
+drawn every epoch, all processes draw the same number of examples, each process's batch i comes from
+the same global batch, and the order depends only on the seed and the epoch. Then, on a training set
+tokenized with `python -m simcse.data` (by default, a synthetic CSV of (sentence, summary, hard
+negative) triples with a long-tailed length distribution and a toy tokenizer), reports the share of
+padding in the collated views for several group sizes, and the throughput of training steps of a small
+BERT on those batches.
+
+    python benchmarks/bench_length_grouping.py --group_sizes 1 10 50
+    python benchmarks/bench_length_grouping.py --train_file ../Data/SumCSE.csv --model_name_or_path roberta-large
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from torch.utils.data import RandomSampler
+from transformers import AutoTokenizer, BertConfig, BertTokenizerFast
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.data import LengthGroupedSampler, PretokenizedDataset, collate_views, example_lengths, pretokenize
+from simcse.models import BertForCL
+
+WORDS = ["the", "a", "man", "woman", "dog", "cat", "is", "was", "playing", "reading", "guitar", "book", "in", "on",
+         "park", "street", "house", "with", "and", "summary", "of", "news", "report", "says", "city", "new", "old"]
+
+
+def make_inputs(work_dir, num_examples, seed):
+    vocab_path = os.path.join(work_dir, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set(WORDS))))
+    tokenizer = BertTokenizerFast(vocab_path)
+    rng = random.Random(seed)
+    csv_path = os.path.join(work_dir, "train.csv")
+    with open(csv_path, "w") as f:
+        f.write("sent0,sent1,hard_neg\n")
+        for _ in range(num_examples):
+            # Sentence lengths vary a lot (news sentences), summaries are short
+            lengths = [int(rng.lognormvariate(2.8, 0.5)), int(rng.lognormvariate(2.0, 0.4)), int(rng.lognormvariate(2.8, 0.5))]
+            f.write(",".join(" ".join(rng.choice(WORDS) for _ in range(max(n, 1))) for n in lengths) + "\n")
+    return tokenizer, csv_path
+
+
+def check_distributed(lengths, batch_size):
+    all_ok = True
+    for num_replicas in [1, 2, 4]:
+        samplers = [LengthGroupedSampler(lengths, batch_size, group_size=8, num_replicas=num_replicas, rank=rank, seed=1)
+                    for rank in range(num_replicas)]
+        orders = []
+        ok = True
+        for epoch in range(2):
+            for sampler in samplers:
+                sampler.set_epoch(epoch)
+            per_rank = [list(sampler) for sampler in samplers]
+            ok &= len(set(len(indices) for indices in per_rank)) == 1 and len(per_rank[0]) == len(samplers[0])
+            ok &= set(i for indices in per_rank for i in indices) == set(range(len(lengths)))
+            global_batches = samplers[0].global_batches()
+            for step, batch in enumerate(global_batches):
+                ok &= all(sorted(per_rank[rank][step * batch_size:(step + 1) * batch_size]) == sorted(batch[rank::num_replicas].tolist())
+                          for rank in range(num_replicas))
+            ok &= list(samplers[0]) == per_rank[0]
+            orders.append(per_rank[0])
+        ok &= orders[0] != orders[1]
+        print("%d process(es): all examples drawn, equal shares, aligned batches, seeded by epoch   %s" % (
+            num_replicas, "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+    return all_ok
+
+
+def batches(dataset, sampler, batch_size, max_batches):
+    indices = list(sampler)
+    for start in range(0, min(len(indices), max_batches * batch_size), batch_size):
+        yield [dataset[i] for i in indices[start:start + batch_size]]
+
+
+def padding_share(dataset, sampler, batch_size, pad_token_id):
+    real, padded = 0, 0
+    for features in batches(dataset, sampler, batch_size, sys.maxsize):
+        batch = collate_views(features, pad_token_id=pad_token_id)
+        real += int(batch["attention_mask"].sum())
+        padded += batch["attention_mask"].numel()
+    return 1 - real / padded
+
+
+def throughput(dataset, sampler, batch_size, pad_token_id, num_batches, seed):
+    config = BertConfig(vocab_size=max(dataset.meta["vocab_size"], 100), hidden_size=128, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=512)
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False)
+    torch.manual_seed(seed)
+    model = BertForCL(config, model_args=model_args).train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    examples, elapsed = 0, 0.0
+    for features in batches(dataset, sampler, batch_size, num_batches):
+        batch = collate_views(features, pad_token_id=pad_token_id)
+        batch = {k: v.view(len(features), dataset.num_sent, -1) for k, v in batch.items()}
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        model(**batch).loss.backward()
+        optimizer.step()
+        elapsed += time.perf_counter() - start
+        examples += len(features)
+    return examples / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train_file", type=str, default=None, help="Training CSV (default: synthetic)")
+    parser.add_argument("--model_name_or_path", type=str, default=None, help="Tokenizer for --train_file")
+    parser.add_argument("--num_examples", type=int, default=20000, help="Synthetic examples")
+    parser.add_argument("--max_seq_length", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--group_sizes", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--num_batches", type=int, default=30, help="Training steps timed per sampler")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="simcse_length_grouping_")
+    if args.train_file is not None:
+        tokenizer, csv_path = AutoTokenizer.from_pretrained(args.model_name_or_path, use_fast=True), args.train_file
+    else:
+        tokenizer, csv_path = make_inputs(work_dir, args.num_examples, args.seed)
+    pretokenize(csv_path, tokenizer, args.max_seq_length, os.path.join(work_dir, "pretokenized"))
+    dataset = PretokenizedDataset(os.path.join(work_dir, "pretokenized"))
+    lengths = example_lengths(dataset)
+    print("%d examples, longest view per example: mean %.1f, median %d, max %d tokens" % (
+        len(dataset), lengths.mean(), np.median(lengths), lengths.max()))
+
+    all_ok = check_distributed(lengths[:1000], 16)
+
+    samplers = [("random", RandomSampler(dataset, generator=torch.Generator().manual_seed(args.seed)))]
+    samplers += [("grouped, group %d" % g, LengthGroupedSampler(lengths, args.batch_size, group_size=g, seed=args.seed))
+                 for g in args.group_sizes]
+    print("%-20s %10s %16s" % ("sampler", "padding", "examples / s"))
+    for name, sampler in samplers:
+        share = padding_share(dataset, sampler, args.batch_size, tokenizer.pad_token_id)
+        speed = throughput(dataset, sampler, args.batch_size, tokenizer.pad_token_id, args.num_batches, args.seed)
+        print("%-20s %9.1f%% %16.1f" % (name, 100 * share, speed))
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+MLM masking of the training collator (`--do_mlm`): the previous `mask_tokens`, which asks the
+tokenizer for the special-token mask of every row through `labels.tolist()`, against
+`simcse.data.mask_tokens`, which tests membership in `special_token_ids(tokenizer)` with `torch.isin`.
+Checks that both give identical inputs and labels under the same seed, for slow and fast BERT and
+RoBERTa tokenizers (whose special-token masks differ between versions), and times both on padded batches of
+(sentence, summary, hard negative) triples.
+
+    python benchmarks/bench_mask_tokens.py --batch_sizes 64 128 512
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import torch
+from transformers import BertTokenizer, BertTokenizerFast, RobertaTokenizer, RobertaTokenizerFast
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.data import mask_tokens, special_token_ids
+
+WORDS = ["w%d" % i for i in range(1000)]
+
+
+def make_tokenizers():
+    work_dir = tempfile.mkdtemp()
+    vocab_path = os.path.join(work_dir, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    json_path, merges_path = os.path.join(work_dir, "vocab.json"), os.path.join(work_dir, "merges.txt")
+    with open(json_path, "w") as f:
+        json.dump({token: i for i, token in enumerate(["<s>", "<pad>", "</s>", "<unk>", "<mask>"] + WORDS)}, f)
+    with open(merges_path, "w") as f:
+        f.write("#version: 0.2\n")
+    return [("BERT slow", BertTokenizer(vocab_path)), ("BERT fast", BertTokenizerFast(vocab_path)),
+            ("RoBERTa slow", RobertaTokenizer(json_path, merges_path)), ("RoBERTa fast", RobertaTokenizerFast(json_path, merges_path))]
+
+
+def previous_mask_tokens(tokenizer, inputs, mlm_probability=0.15):
+    inputs = inputs.clone()
+    labels = inputs.clone()
+    probability_matrix = torch.full(labels.shape, mlm_probability)
+    special_tokens_mask = [tokenizer.get_special_tokens_mask(val, already_has_special_tokens=True) for val in labels.tolist()]
+    special_tokens_mask = torch.tensor(special_tokens_mask, dtype=torch.bool)
+    probability_matrix.masked_fill_(special_tokens_mask, value=0.0)
+    masked_indices = torch.bernoulli(probability_matrix).bool()
+    labels[~masked_indices] = -100
+    indices_replaced = torch.bernoulli(torch.full(labels.shape, 0.8)).bool() & masked_indices
+    inputs[indices_replaced] = tokenizer.convert_tokens_to_ids(tokenizer.mask_token)
+    indices_random = torch.bernoulli(torch.full(labels.shape, 0.5)).bool() & masked_indices & ~indices_replaced
+    random_words = torch.randint(len(tokenizer), labels.shape, dtype=torch.long)
+    inputs[indices_random] = random_words[indices_random]
+    return inputs, labels
+
+
+def make_batch(tokenizer, num_views, max_len, generator):
+    """
+    Right-padded views with a leading [CLS] and a trailing [SEP]; a few body tokens are [UNK].
+    """
+    offset = len(tokenizer) - len(WORDS)
+    inputs = torch.full((num_views, max_len), tokenizer.pad_token_id, dtype=torch.long)
+    lengths = torch.randint(3, max_len + 1, (num_views,), generator=generator)
+    for row, length in enumerate(lengths.tolist()):
+        body = torch.randint(offset, len(tokenizer), (length - 2,), generator=generator)
+        body[torch.rand(length - 2, generator=generator) < 0.02] = tokenizer.unk_token_id
+        inputs[row, :length] = torch.cat([torch.tensor([tokenizer.cls_token_id]), body, torch.tensor([tokenizer.sep_token_id])])
+    return inputs
+
+
+def new_mask_tokens(tokenizer, special_ids, inputs):
+    return mask_tokens(inputs, tokenizer.mask_token_id, len(tokenizer), special_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[64, 128, 512])
+    parser.add_argument("--max_len", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(args.seed)
+    all_ok = True
+    for name, tokenizer in make_tokenizers():
+        special_ids = special_token_ids(tokenizer)
+        inputs = make_batch(tokenizer, 3 * 64, args.max_len, generator)
+        ok = True
+        for seed in range(5):
+            torch.manual_seed(seed)
+            expected = previous_mask_tokens(tokenizer, inputs)
+            torch.manual_seed(seed)
+            got = new_mask_tokens(tokenizer, special_ids, inputs)
+            ok &= all(torch.equal(a, b) for a, b in zip(expected, got))
+        print("%-13s special ids %-22s same inputs and labels for 5 seeds   %s" % (
+            name, special_ids.tolist(), "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+
+    print("%-13s %-8s %14s %14s %8s" % ("tokenizer", "batch", "previous ms", "vectorized ms", "speedup"))
+    for name, tokenizer in make_tokenizers()[1::2]:
+        special_ids = special_token_ids(tokenizer)
+        for batch_size in args.batch_sizes:
+            batches = [make_batch(tokenizer, 3 * batch_size, args.max_len, generator) for _ in range(args.repeats)]
+            times = {}
+            for mode, fn in [("previous", lambda x: previous_mask_tokens(tokenizer, x)),
+                             ("current", lambda x: new_mask_tokens(tokenizer, special_ids, x))]:
+                start = time.perf_counter()
+                for inputs in batches:
+                    fn(inputs)
+                times[mode] = 1000 * (time.perf_counter() - start) / args.repeats
+            print("%-13s %-8d %14.2f %14.2f %7.1fx" % (name, batch_size, times["previous"], times["current"],
+                                                       times["previous"] / times["current"]))
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
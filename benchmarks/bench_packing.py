@@ -0,0 +1,119 @@
+"""
+Encoder time per training batch (forward + backward of the contrastive representations) with padded
+and packed (`--pack_sequences`) execution, on SumCSE-style triples: a source sentence, its summary
+and a hard negative, padded together to the longest of the batch as `OurDataCollatorWithPadding` does.
+Also checks that both modes give the same representations with dropout off.
+
+With the training CSV (columns sent0, sent1, hard_neg) and the tokenizer of the model:
+
+    python benchmarks/bench_packing.py --train_file ../Data/SumCSE.csv --model_name_or_path bert-base-uncased
+
+Without `--train_file`, token lengths are drawn at random (sources 10-64 tokens, summaries and hard
+negatives 6-24), which only approximates the real length distribution. The encoder is randomly
+initialized with the shape of `--model_name_or_path` (or BERT-base), since timing does not depend on
+the weights.
+"""
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+import torch
+from transformers import AutoConfig, AutoTokenizer, BertConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import BertForCL, RobertaForCL
+from simcse.packing import plan_packing
+
+
+def csv_batches(args, tokenizer):
+    with open(args.train_file) as f:
+        rows = [[r["sent0"], r["sent1"], r["hard_neg"]] for r in csv.DictReader(f)]
+    random.Random(args.seed).shuffle(rows)
+    for start in range(0, args.num_batches * args.batch_size, args.batch_size):
+        sentences = [s for row in rows[start:start + args.batch_size] for s in row]
+        features = tokenizer(sentences, padding=True, truncation=True, max_length=args.max_seq_length, return_tensors="pt")
+        yield {k: v.view(-1, 3, v.size(-1)) for k, v in features.items()}
+
+
+def synthetic_batches(args, vocab_size):
+    rng = random.Random(args.seed)
+    ranges = [(10, 64), (6, 24), (6, 24)]
+    for _ in range(args.num_batches):
+        lengths = [min(rng.randint(*r), args.max_seq_length) for _ in range(args.batch_size) for r in ranges]
+        seq_len = max(lengths)
+        input_ids = torch.randint(5, vocab_size, (len(lengths), seq_len))
+        attention_mask = (torch.arange(seq_len)[None, :] < torch.tensor(lengths)[:, None]).long()
+        yield {"input_ids": (input_ids * attention_mask).view(-1, 3, seq_len),
+               "attention_mask": attention_mask.view(-1, 3, seq_len),
+               "token_type_ids": torch.zeros_like(input_ids).view(-1, 3, seq_len)}
+
+
+def run(model, batch, packed):
+    model.model_args.pack_sequences = packed
+    model.zero_grad()
+    start = time.time()
+    reps = model(**batch, embed_only=True)
+    reps.pow(2).sum().backward()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train_file", type=str, default=None)
+    parser.add_argument("--model_name_or_path", type=str, default=None)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--max_seq_length", type=int, default=32)
+    parser.add_argument("--num_batches", type=int, default=5)
+    parser.add_argument("--num_hidden_layers", type=int, default=None, help="Override the number of layers (e.g., to run faster)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = AutoConfig.from_pretrained(args.model_name_or_path) if args.model_name_or_path else BertConfig()
+    if args.num_hidden_layers is not None:
+        config.num_hidden_layers = args.num_hidden_layers
+    config.hidden_dropout_prob = config.attention_probs_dropout_prob = 0.0
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False, pack_sequences=False)
+    torch.manual_seed(args.seed)
+    model_class = RobertaForCL if config.model_type == "roberta" else BertForCL
+    model = model_class(config, model_args=model_args)
+    model.train()
+
+    if args.train_file is not None:
+        batches = list(csv_batches(args, AutoTokenizer.from_pretrained(args.model_name_or_path)))
+    else:
+        batches = list(synthetic_batches(args, config.vocab_size))
+
+    # Same representations in both modes
+    with torch.no_grad():
+        model.model_args.pack_sequences = False
+        padded = model(**batches[0], embed_only=True)
+        model.model_args.pack_sequences = True
+        packed = model(**batches[0], embed_only=True)
+    print("max |padded - packed| representation diff: %.2e" % (padded - packed).abs().max().item())
+
+    run(model, batches[0], False)
+    run(model, batches[0], True)
+    padded_time, packed_time, real_tokens, padded_tokens, packed_tokens = 0.0, 0.0, 0, 0, 0
+    for batch in batches:
+        mask = batch["attention_mask"].view(-1, batch["attention_mask"].size(-1))
+        _, _, num_rows = plan_packing(mask.sum(1).tolist(), mask.size(1))
+        real_tokens += mask.sum().item()
+        padded_tokens += mask.numel()
+        packed_tokens += num_rows * mask.size(1)
+        padded_time += run(model, batch, False)
+        packed_time += run(model, batch, True)
+
+    print("%d batches of %d triples, max_seq_length %d" % (len(batches), args.batch_size, args.max_seq_length))
+    print("%-8s  %10s  %12s  %14s" % ("mode", "tokens", "real tokens", "s / batch"))
+    print("%-8s  %10d  %11.1f%%  %14.3f" % ("padded", padded_tokens, 100.0 * real_tokens / padded_tokens, padded_time / len(batches)))
+    print("%-8s  %10d  %11.1f%%  %14.3f" % ("packed", packed_tokens, 100.0 * real_tokens / packed_tokens, packed_time / len(batches)))
+    print("speedup: %.2fx" % (padded_time / packed_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Throughput of multi-process CPU encoding (`SimCSE.encode(..., num_workers=N)`) against a single
+process using all cores, and a bitwise check against a single process running with the same
+per-worker thread count.
+
+    python benchmarks/bench_pool.py --num_workers 1 4 8 16 --threads 64
+"""
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse import SimCSE
+from bench_encode import skewed_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", type=str, default="princeton-nlp/sup-simcse-bert-base-uncased")
+    parser.add_argument("--num_sentences", type=int, default=8192)
+    parser.add_argument("--long_ratio", type=float, default=0.05, help="Fraction of long passages in the corpus")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Total threads shared by the workers")
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    model = SimCSE(args.model_name_or_path, device="cpu")
+    corpus = skewed_corpus(args.num_sentences, args.long_ratio, args.seed)
+    encode_kwargs = {"batch_size": args.batch_size, "sort_by_length": True}
+
+    print("%-10s %10s %10s %12s %10s" % ("workers", "threads", "seconds", "sents/sec", "bitwise"))
+    for num_workers in args.num_workers:
+        threads_per_worker = max(1, args.threads // num_workers)
+        # Reference: one process with the per-worker thread count
+        torch.set_num_threads(threads_per_worker)
+        reference = model.encode(corpus, **encode_kwargs)
+
+        torch.set_num_threads(args.threads)
+        start = time.time()
+        if num_workers == 1:
+            embeddings = model.encode(corpus, **encode_kwargs)
+        else:
+            embeddings = model.encode(corpus, num_workers=num_workers, threads_per_worker=threads_per_worker, **encode_kwargs)
+        elapsed = time.time() - start
+        print("%-10d %10s %10.2f %12.1f %10s" % (num_workers, "%dx%d" % (num_workers, threads_per_worker), elapsed,
+                                                 len(corpus) / elapsed, torch.equal(embeddings, reference)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Pre-tokenized memory-mapped training data (`python -m simcse.data`, `--pretokenized_dir`) against the
+`datasets` path of `train.py` (load the CSV, shuffle, map `prepare_features`), on a synthetic CSV of
+(sentence, summary, hard negative) rows and a toy word-level BERT tokenizer:
+
+- checks that both give the same examples in the same order, as collated batches;
+- startup: time until the training set is ready, with a cold and a warm `datasets` cache, against
+  opening the pre-tokenized arrays (the one-time pre-tokenization is reported separately);
+- reading: time per example of a full pass, and the growth of the process's anonymous RSS (memory
+  not backed by the mapped files) over that pass, as a DataLoader worker would see it.
+
+Each measurement runs in a fresh subprocess.
+
+    python benchmarks/bench_pretokenized.py --num_examples 100000 200000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ["the", "a", "man", "woman", "dog", "cat", "is", "was", "playing", "reading", "a", "guitar", "book", "in", "on",
+         "park", "street", "house", "with", "and", "summary", "of", "news", "report", "says", "city", "new", "old"]
+
+
+def rss_anon_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def make_inputs(work_dir, num_examples, seed):
+    from transformers import BertTokenizerFast
+    tokenizer_dir = os.path.join(work_dir, "tokenizer")
+    if not os.path.exists(tokenizer_dir):
+        os.makedirs(tokenizer_dir)
+        with open(os.path.join(tokenizer_dir, "vocab.txt"), "w") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set(WORDS))))
+        BertTokenizerFast(os.path.join(tokenizer_dir, "vocab.txt")).save_pretrained(tokenizer_dir)
+    csv_path = os.path.join(work_dir, "train_%d.csv" % num_examples)
+    rng = random.Random(seed)
+    with open(csv_path, "w") as f:
+        f.write("sent0,sent1,hard_neg\n")
+        for _ in range(num_examples):
+            f.write(",".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+                             for low, high in [(8, 40), (4, 16), (8, 40)]) + "\n")
+    return tokenizer_dir, csv_path
+
+
+def load_csv_path(args, tokenizer):
+    from simcse.data import feature_columns, load_train_dataset, tokenize_examples
+    datasets = load_train_dataset(args.csv_path, cache_dir=os.path.join(args.work_dir, "cache_%d" % args.num_examples))
+    column_names = datasets["train"].column_names
+    columns = feature_columns(column_names)
+    return datasets["train"].map(lambda examples: tokenize_examples(examples, tokenizer, columns, args.max_seq_length),
+                                 batched=True, remove_columns=column_names)
+
+
+def run(args):
+    import torch
+    from transformers import BertTokenizerFast
+    from simcse.data import PretokenizedDataset, collate_views, pretokenize
+    # The fixture has no config.json, which AutoTokenizer needs to pick the tokenizer class
+    tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer_dir)
+    pretokenized_dir = os.path.join(args.work_dir, "pretokenized_%d" % args.num_examples)
+    result = {}
+    if args.mode == "pretokenize":
+        start = time.perf_counter()
+        pretokenize(args.csv_path, tokenizer, args.max_seq_length, pretokenized_dir)
+        result["startup"] = time.perf_counter() - start
+        print(json.dumps(result))
+        return
+    if args.mode == "check":
+        reference = load_csv_path(args, tokenizer)
+        dataset = PretokenizedDataset(pretokenized_dir)
+        same = len(reference) == len(dataset)
+        return_token_type_ids = "token_type_ids" in tokenizer.model_input_names
+        for start in range(0, len(dataset), 64):
+            expected = collate_views([reference[i] for i in range(start, min(start + 64, len(dataset)))], tokenizer.pad_token_id)
+            got = collate_views([dataset[i] for i in range(start, min(start + 64, len(dataset)))], tokenizer.pad_token_id,
+                                return_token_type_ids=return_token_type_ids)
+            same &= expected.keys() == got.keys() and all(torch.equal(expected[k], got[k]) for k in expected)
+        print(json.dumps({"same": same}))
+        return
+
+    start = time.perf_counter()
+    dataset = load_csv_path(args, tokenizer) if args.mode.startswith("csv") else PretokenizedDataset(pretokenized_dir)
+    result["startup"] = time.perf_counter() - start
+    rss = rss_anon_mb()
+    start = time.perf_counter()
+    for i in range(len(dataset)):
+        dataset[i]
+    result["read_us"] = 1e6 * (time.perf_counter() - start) / len(dataset)
+    result["rss_growth"] = rss_anon_mb() - rss
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_examples", type=int, nargs="+", default=[50000, 200000])
+    parser.add_argument("--max_seq_length", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", type=str, default=None)
+    parser.add_argument("--mode", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--csv_path", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--tokenizer_dir", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        args.num_examples = args.num_examples[0]
+        run(args)
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="simcse_pretokenized_")
+    all_ok = True
+    print("%-10s %-24s %10s %12s %18s" % ("examples", "mode", "startup s", "read us/ex", "anon RSS growth MB"))
+    for num_examples in args.num_examples:
+        tokenizer_dir, csv_path = make_inputs(work_dir, num_examples, args.seed)
+
+        def sub(mode):
+            cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--num_examples", str(num_examples),
+                   "--max_seq_length", str(args.max_seq_length), "--work_dir", work_dir, "--csv_path", csv_path,
+                   "--tokenizer_dir", tokenizer_dir]
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if result.returncode != 0:
+                sys.stderr.write(result.stderr)
+                sys.exit("%s run failed with exit code %d" % (mode, result.returncode))
+            return json.loads(result.stdout.strip().splitlines()[-1])
+
+        for mode, label in [("csv", "datasets (cold cache)"), ("csv", "datasets (warm cache)"),
+                            ("pretokenize", "pre-tokenize (once)"), ("pretokenized", "pre-tokenized")]:
+            result = sub(mode)
+            print("%-10d %-24s %10.2f %12s %18s" % (num_examples, label, result["startup"],
+                                                    "%.1f" % result["read_us"] if "read_us" in result else "",
+                                                    "%.1f" % result["rss_growth"] if "rss_growth" in result else ""))
+        same = sub("check")["same"]
+        print("%-10d same examples in the same order: %s" % (num_examples, "OK" if same else "MISMATCH"))
+        all_ok &= same
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
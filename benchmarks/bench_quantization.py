@@ -0,0 +1,80 @@
+"""
+Index memory, recall@k and latency of the quantized brute-force index (`simcse.quantization.QuantizedIndex`)
+against the float32 brute-force path. Uses synthetic clustered unit vectors by default, or the
+`embeddings.npy` of an index saved with `SimCSE.save_index`.
+
+    python benchmarks/bench_quantization.py --num_vectors 200000 --dim 1024
+    python benchmarks/bench_quantization.py --embeddings my_index/embeddings.npy
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.index import topk_inner_product
+from simcse.quantization import QuantizedIndex
+
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def clustered_vectors(num_vectors, dim, num_clusters, seed):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(num_clusters, dim).astype(np.float32)
+    assignment = rng.randint(num_clusters, size=num_vectors)
+    return normalize(centers[assignment] + 0.5 * rng.randn(num_vectors, dim).astype(np.float32))
+
+
+def recall_at_k(ids, true_ids):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids, true_ids)])
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, 1000 * (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", type=str, default=None, help="A .npy matrix of unit-normalized vectors")
+    parser.add_argument("--num_vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--num_queries", type=int, default=100)
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--rescore_factor", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.embeddings is not None:
+        corpus = np.load(args.embeddings)
+    else:
+        corpus = clustered_vectors(args.num_vectors, args.dim, num_clusters=1000, seed=args.seed)
+    rng = np.random.RandomState(args.seed + 1)
+    queries = corpus[rng.choice(len(corpus), args.num_queries, replace=False)]
+    queries = normalize(queries + 0.1 * rng.randn(*queries.shape).astype(np.float32))
+
+    (_, true_ids), flat_ms = timed(lambda: topk_inner_product(queries, corpus, args.top_k))
+    print("%-10s %8s %12s %10s %14s" % ("storage", "rescore", "index MB", "recall@%d" % args.top_k, "ms / %d queries" % args.num_queries))
+    print("%-10s %8s %12.1f %10.3f %14.1f" % ("float32", "-", corpus.nbytes / 2 ** 20, 1.0, flat_ms))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for quantization in ["float16", "int8"]:
+            index = QuantizedIndex(os.path.join(tmp_dir, "%s.npy" % quantization), corpus.shape[1], quantization=quantization)
+            index.train(corpus)
+            index.add(corpus)
+            # Only the codes (and int8 scales) stay in memory; full vectors are read from the side file
+            index_mb = (index.codes.nbytes + (index.scales.nbytes if index.scales is not None else 0)) / 2 ** 20
+            for rescore_factor in args.rescore_factor:
+                index.rescore_factor = rescore_factor
+                (_, ids), ms = timed(lambda: index.search(queries, args.top_k))
+                print("%-10s %8d %12.1f %10.3f %14.1f" % (quantization, rescore_factor, index_mb, recall_at_k(ids, true_ids), ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Peak memory and step time of the contrastive logits in `cl_forward`: the broadcast path
+(`Similarity.forward(z1.unsqueeze(1), z2.unsqueeze(0))`, which builds a (batch, batch, hidden)
+tensor) against `Similarity.pairwise` (normalize once, one matmul). Each path runs forward and
+backward of the cross-entropy loss in a fresh subprocess so its peak RSS can be measured on CPU.
+
+    python benchmarks/bench_similarity.py --batch_size 2048 --hidden 1024
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import Similarity
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode, batch_size, hidden, hard_negative, steps):
+    torch.manual_seed(0)
+    sim = Similarity(temp=0.05)
+    z1 = torch.randn(batch_size, hidden, requires_grad=True)
+    z2 = torch.randn(batch_size, hidden, requires_grad=True)
+    z3 = torch.randn(batch_size, hidden, requires_grad=True)
+    labels = torch.arange(batch_size)
+    loss_fct = nn.CrossEntropyLoss()
+    baseline = peak_rss_mb()
+
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        if mode == "broadcast":
+            cos_sim = sim(z1.unsqueeze(1), z2.unsqueeze(0))
+            if hard_negative:
+                cos_sim = torch.cat([cos_sim, sim(z1.unsqueeze(1), z3.unsqueeze(0))], 1)
+        else:
+            cos_sim = sim.pairwise(z1, torch.cat([z2, z3], 0) if hard_negative else z2)
+        loss = loss_fct(cos_sim, labels)
+        loss.backward()
+        times.append(time.perf_counter() - start)
+    print("%.1f %.2f %.6e" % (peak_rss_mb() - baseline, 1000 * sorted(times)[len(times) // 2], loss.item()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=512, help="Global batch size (per-device batch x GPUs)")
+    parser.add_argument("--hidden", type=int, default=768)
+    parser.add_argument("--hard_negative", action="store_true")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--mode", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run(args.mode, args.batch_size, args.hidden, args.hard_negative, args.steps)
+        return
+
+    print("batch %d, hidden %d%s" % (args.batch_size, args.hidden, ", with hard negatives" if args.hard_negative else ""))
+    print("%-10s %14s %14s %14s" % ("path", "peak MB", "step ms", "loss"))
+    for mode in ["broadcast", "matmul"]:
+        cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--batch_size", str(args.batch_size),
+               "--hidden", str(args.hidden), "--steps", str(args.steps)] + (["--hard_negative"] if args.hard_negative else [])
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            # Typically killed by the OOM killer
+            print("%-10s %14s" % (mode, "failed (exit code %d)" % result.returncode))
+            continue
+        peak, step_ms, loss = result.stdout.split()
+        print("%-10s %14s %14s %14s" % (mode, peak, step_ms, loss))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Times the MLM auxiliary head at the vocabulary size of RoBERTa, run over every token (dense) against
+only the positions with a label (what `cl_forward` does), and reports the size of the logits both
+ways. `tests/test_sparse_mlm.py` checks that every model variant gives the dense loss and gradients.
+
+    python benchmarks/bench_sparse_mlm.py --batch_size 16 --seq_len 32
+"""
+import time
+import argparse
+
+import torch
+import torch.nn as nn
+
+
+def time_head(args):
+    torch.manual_seed(args.seed)
+    hidden_size, vocab_size = 768, 50265
+    decoder = nn.Linear(hidden_size, vocab_size)
+    num_tokens = args.batch_size * 2 * args.seq_len
+    hidden = torch.randn(num_tokens, hidden_size)
+    labels = torch.where(torch.rand(num_tokens) < args.mlm_probability, torch.randint(0, vocab_size, (num_tokens,)),
+                         torch.full((num_tokens,), -100))
+    loss_fct = nn.CrossEntropyLoss()
+    with torch.no_grad():
+        start = time.time()
+        dense = loss_fct(decoder(hidden), labels)
+        dense_time = time.time() - start
+        start = time.time()
+        masked = labels != -100
+        sparse = loss_fct(decoder(hidden[masked]), labels[masked])
+        sparse_time = time.time() - start
+    print("LM head over %d tokens (hidden %d, vocab %d): dense %d rows %.3fs (%.0f MB logits), sparse %d rows %.3fs (%.0f MB logits), "
+          "loss %.6f vs %.6f" % (num_tokens, hidden_size, vocab_size, num_tokens, dense_time, num_tokens * vocab_size * 4 / 2 ** 20,
+                                 masked.sum().item(), sparse_time, masked.sum().item() * vocab_size * 4 / 2 ** 20, dense.item(), sparse.item()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--seq_len", type=int, default=32)
+    parser.add_argument("--mlm_probability", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    time_head(args)
+
+
+if __name__ == "__main__":
+    main()
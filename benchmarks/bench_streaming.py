@@ -0,0 +1,227 @@
+"""
+Streaming training data (`--streaming`, `simcse.data.StreamingTrainDataset`) against the `datasets` path
+of `train.py` (load the CSV, shuffle, map `prepare_features`), on a synthetic CSV of (sentence,
+summary, hard negative) rows with unique sentences and a toy word-level BERT tokenizer:
+
+- checks that one pass over all shards (processes x DataLoader workers) yields every example of the
+  `datasets` path exactly once, also with the CSV split into parts (a glob `--train_file`), that a
+  process's DataLoader only yields examples of its own shards, and that the shuffled stream is the same
+  on every run;
+- sharding: time for one worker to read and tokenize its shard once, for 1 to 8 shards. Each shard only
+  reads its byte range, so this drops with the number of shards, and the aggregate rate (what that many
+  cores would reach) grows with it;
+- startup: time until the first batch of 128 is collated, the growth of the process's anonymous RSS
+  until then, and the size of the `datasets` cache written to disk;
+- throughput: examples per second through the DataLoader with 0, 2 and 4 workers.
+
+Each measurement runs in a fresh subprocess.
+
+    python benchmarks/bench_streaming.py --num_examples 200000 1000000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ["the", "a", "man", "woman", "dog", "cat", "is", "was", "playing", "reading", "guitar", "book", "in", "on",
+         "park", "street", "house", "with", "and", "summary", "of", "news", "report", "says", "city", "new", "old"]
+
+
+def rss_anon_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def make_inputs(work_dir, num_examples, seed):
+    from transformers import BertTokenizerFast
+    tokenizer_dir = os.path.join(work_dir, "tokenizer")
+    if not os.path.exists(tokenizer_dir):
+        os.makedirs(tokenizer_dir)
+        words = sorted(set(WORDS))
+        with open(os.path.join(tokenizer_dir, "vocab.txt"), "w") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words + ["%d" % i for i in range(10)]))
+        BertTokenizerFast(os.path.join(tokenizer_dir, "vocab.txt")).save_pretrained(tokenizer_dir)
+    csv_path = os.path.join(work_dir, "train_%d.csv" % num_examples)
+    rng = random.Random(seed)
+    with open(csv_path, "w") as f:
+        f.write("sent0,sent1,hard_neg\n")
+        for i in range(num_examples):
+            # The row number (as digits) makes every sentence unique
+            f.write(",".join(" ".join(list(str(i)) + [rng.choice(WORDS) for _ in range(rng.randint(low, high))])
+                             for low, high in [(8, 24), (4, 12), (8, 24)]) + "\n")
+    return tokenizer_dir, csv_path
+
+
+def key(feature):
+    return json.dumps(feature["input_ids"])
+
+
+def check(args, tokenizer):
+    import torch
+    from simcse.data import StreamingTrainDataset, feature_columns, load_train_dataset, tokenize_examples
+    datasets = load_train_dataset(args.csv_path, cache_dir=os.path.join(args.work_dir, "cache_check"))
+    column_names = datasets["train"].column_names
+    columns = feature_columns(column_names)
+    reference = datasets["train"].map(lambda examples: tokenize_examples(examples, tokenizer, columns, args.max_seq_length),
+                                      batched=True, remove_columns=column_names)
+    reference = sorted(key(reference[i]) for i in range(len(reference)))
+    # Row of every example, from the digits that open its first sentence
+    digits = {tokenizer.convert_tokens_to_ids(str(d)): str(d) for d in range(10)}
+
+    def row(feature):
+        return int("".join(itertools.takewhile(lambda d: d is not None, (digits.get(t) for t in feature["input_ids"][0][1:]))))
+
+    # The same rows split into three CSV files
+    with open(args.csv_path) as f:
+        header, *rows = f.readlines()
+    parts_pattern = os.path.join(args.work_dir, "parts_%d_*.csv" % args.num_examples)
+    for part in range(3):
+        with open(parts_pattern.replace("*", str(part)), "w") as f:
+            f.writelines([header] + rows[part::3])
+
+    all_ok = True
+    for num_shards in [1, 3, 5, 16]:
+        dataset = StreamingTrainDataset(parts_pattern, tokenizer, args.max_seq_length, chunk_size=100)
+        ok = sorted(key(feature) for shard_id in range(num_shards) for feature in dataset.examples(num_shards, shard_id)) == reference
+        print("3 CSV parts, %2d shards: one pass = datasets examples   %s" % (num_shards, "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+
+    for num_replicas, num_workers in [(1, 1), (2, 1), (2, 2), (4, 3)]:
+        num_shards = num_replicas * num_workers
+        dataset = StreamingTrainDataset(args.csv_path, tokenizer, args.max_seq_length, buffer_size=64, chunk_size=100)
+        shards = [[row(feature) for feature in dataset.examples(num_shards, shard_id)] for shard_id in range(num_shards)]
+        ok = sorted(key(feature) for shard_id in range(num_shards) for feature in dataset.examples(num_shards, shard_id)) == reference
+        for rank in range(num_replicas):
+            own_rows = set(i for shard in shards[rank * num_workers:(rank + 1) * num_workers] for i in shard)
+            streams = []
+            for _ in range(2):
+                dataset = StreamingTrainDataset(args.csv_path, tokenizer, args.max_seq_length, buffer_size=64,
+                                                chunk_size=100, num_replicas=num_replicas, rank=rank)
+                loader = torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=num_workers if num_workers > 1 else 0)
+                streams.append([row(feature) for feature in itertools.islice(loader, 500)])
+            ok &= streams[0] == streams[1]
+            ok &= all(i in own_rows for i in streams[0])
+            ok &= streams[0] != sorted(streams[0])
+        print("%d process(es) x %d worker(s): one pass = datasets examples, own shards only, same stream on rerun   %s" % (
+            num_replicas, num_workers, "OK" if ok else "MISMATCH"))
+        all_ok &= ok
+    return all_ok
+
+
+def run(args):
+    import torch
+    from transformers import BertTokenizerFast
+    from simcse.data import StreamingTrainDataset, collate_views, feature_columns, load_train_dataset, tokenize_examples
+    # The fixture has no config.json, which AutoTokenizer needs to pick the tokenizer class
+    tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer_dir)
+    if args.mode == "check":
+        print(json.dumps({"ok": check(args, tokenizer)}))
+        return
+    if args.mode == "shard":
+        dataset = StreamingTrainDataset(args.csv_path, tokenizer, args.max_seq_length)
+        start = time.perf_counter()
+        num_read = sum(1 for _ in dataset.examples(args.num_shards, 0))
+        print(json.dumps({"examples": num_read, "seconds": time.perf_counter() - start}))
+        return
+
+    def collate(features):
+        return collate_views(features, pad_token_id=tokenizer.pad_token_id)
+
+    result = {"cache": 0.0}
+    rss = rss_anon_mb()
+    start = time.perf_counter()
+    if args.mode == "datasets":
+        cache_dir = os.path.join(args.work_dir, "cache_%d" % args.num_examples)
+        datasets = load_train_dataset(args.csv_path, cache_dir=cache_dir)
+        column_names = datasets["train"].column_names
+        columns = feature_columns(column_names)
+        dataset = datasets["train"].map(lambda examples: tokenize_examples(examples, tokenizer, columns, args.max_seq_length),
+                                        batched=True, remove_columns=column_names)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=128, shuffle=True, collate_fn=collate)
+    else:
+        dataset = StreamingTrainDataset(args.csv_path, tokenizer, args.max_seq_length)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=128, collate_fn=collate, num_workers=args.num_workers)
+    batches = iter(loader)
+    next(batches)
+    result["startup"] = time.perf_counter() - start
+    result["rss_growth"] = rss_anon_mb() - rss
+    if args.mode == "datasets":
+        result["cache"] = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache_dir) for name in names) / 2 ** 20
+    start = time.perf_counter()
+    # Stay within one epoch (the first batch is already taken)
+    num_batches = min(200, args.num_examples // 128 - 1)
+    for _ in range(num_batches):
+        next(batches)
+    result["throughput"] = 128 * num_batches / (time.perf_counter() - start)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_examples", type=int, nargs="+", default=[200000])
+    parser.add_argument("--max_seq_length", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", type=str, default=None)
+    parser.add_argument("--mode", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--num_workers", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--num_shards", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--csv_path", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--tokenizer_dir", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        args.num_examples = args.num_examples[0]
+        run(args)
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="simcse_streaming_")
+
+    def sub(mode, num_examples, tokenizer_dir, csv_path, num_workers=0, num_shards=1):
+        cmd = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--num_examples", str(num_examples),
+               "--max_seq_length", str(args.max_seq_length), "--work_dir", work_dir, "--csv_path", csv_path,
+               "--tokenizer_dir", tokenizer_dir, "--num_workers", str(num_workers), "--num_shards", str(num_shards)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            sys.stderr.write(result.stderr)
+            sys.exit("%s run failed with exit code %d" % (mode, result.returncode))
+        lines = result.stdout.strip().splitlines()
+        for line in lines[:-1]:
+            print(line)
+        return json.loads(lines[-1])
+
+    tokenizer_dir, csv_path = make_inputs(work_dir, 3000, args.seed)
+    all_ok = sub("check", 3000, tokenizer_dir, csv_path)["ok"]
+
+    print("%-10s %-8s %22s %16s %24s" % ("examples", "shards", "examples read by one", "one pass s", "aggregate examples / s"))
+    for num_examples in args.num_examples:
+        tokenizer_dir, csv_path = make_inputs(work_dir, num_examples, args.seed)
+        for num_shards in [1, 2, 4, 8]:
+            result = sub("shard", num_examples, tokenizer_dir, csv_path, num_shards=num_shards)
+            print("%-10d %-8d %22d %16.2f %24.0f" % (num_examples, num_shards, result["examples"], result["seconds"],
+                                                      num_shards * result["examples"] / result["seconds"]))
+
+    print("DataLoader on %d CPU(s):" % os.cpu_count())
+    print("%-10s %-22s %14s %20s %14s %14s" % ("examples", "mode", "first batch s", "anon RSS growth MB", "disk cache MB", "examples / s"))
+    for num_examples in args.num_examples:
+        tokenizer_dir, csv_path = make_inputs(work_dir, num_examples, args.seed)
+        for mode, num_workers, label in [("datasets", 0, "datasets (cold cache)"), ("streaming", 0, "streaming, 0 workers"),
+                                         ("streaming", 2, "streaming, 2 workers"), ("streaming", 4, "streaming, 4 workers")]:
+            result = sub(mode, num_examples, tokenizer_dir, csv_path, num_workers)
+            print("%-10d %-22s %14.2f %20.1f %14.1f %14.0f" % (num_examples, label, result["startup"], result["rss_growth"],
+                                                               result["cache"], result["throughput"]))
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Checks the nested-dimension (Matryoshka) contrastive loss (`--matryoshka_dims`): the loss of
+`cl_forward` must equal the weighted sum of the contrastive losses recomputed on each embedding
+prefix, with hard negatives, and its gradients must match. Then checks that `SimCSE.encode(dim=...)`
+equals normalizing the truncated unnormalized embeddings, with and without the embedding cache, and
+times a training step with and without the extra losses.
+
+    python benchmarks/check_matryoshka.py --dims 8,16,32 --weights 1,1,2
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers import BertConfig, BertModel, BertTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simcse.models import BertForCL
+from simcse.tool import SimCSE
+
+
+def make_model(config, dims, weights, seed):
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=1.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False, matryoshka_dims=dims, matryoshka_weights=weights)
+    torch.manual_seed(seed)
+    return BertForCL(config, model_args=model_args).train()
+
+
+def reference_loss(model, reps, dims, weights):
+    z1, z2, z3 = reps[:, 0], reps[:, 1], reps[:, 2]
+    hard = torch.zeros(z1.size(0), 2 * z1.size(0))
+    hard[:, z1.size(0):] = torch.eye(z1.size(0)) * model.model_args.hard_negative_weight
+    loss = 0.0
+    for dim, weight in list(zip(dims, weights)) + [(reps.size(-1), 1.0)]:
+        a, b = F.normalize(z1[:, :dim], dim=-1), F.normalize(torch.cat([z2, z3])[:, :dim], dim=-1)
+        logits = a @ b.t() / model.model_args.temp + hard
+        loss = loss + weight * nn.CrossEntropyLoss()(logits, torch.arange(z1.size(0)))
+    return loss
+
+
+def grads(model):
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+def check_loss(args, config):
+    dims = [int(d) for d in args.dims.split(",")]
+    weights = [float(w) for w in args.weights.split(",")]
+    model = make_model(config, args.dims, args.weights, args.seed)
+    input_ids = torch.randint(5, config.vocab_size, (args.batch_size, 3, args.seq_len), generator=torch.Generator().manual_seed(args.seed))
+    batch = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    torch.manual_seed(args.seed + 1)
+    loss = model(**batch).loss
+    loss.backward()
+    model_grads = grads(model)
+    model.zero_grad()
+    torch.manual_seed(args.seed + 1)
+    ref_loss = reference_loss(model, model(**batch, embed_only=True), dims, weights)
+    ref_loss.backward()
+    ref_grads = grads(model)
+
+    max_diff = max((model_grads[n] - ref_grads[n]).abs().max().item() for n in ref_grads)
+    ok = torch.allclose(loss, ref_loss, rtol=1e-5) and max_diff <= 1e-5
+    print("prefixes %s weights %s: loss %.6f vs reference %.6f, max |grad diff| %.2e   %s" % (
+        dims, weights, loss.item(), ref_loss.item(), max_diff, "OK" if ok else "MISMATCH"))
+    return ok
+
+
+def check_encode(config):
+    # A randomly initialized BERT and a toy vocabulary saved as a checkpoint
+    model_dir = tempfile.mkdtemp()
+    words = ["the", "cat", "sat", "on", "a", "mat", "dog", "ran", "far", "away"]
+    with open(os.path.join(model_dir, "vocab.txt"), "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    BertTokenizer(os.path.join(model_dir, "vocab.txt")).save_pretrained(model_dir)
+    torch.manual_seed(0)
+    BertModel(config).save_pretrained(model_dir)
+    sentences = ["the cat sat on a mat", "a dog ran far away", "the dog sat", "cat"]
+
+    all_ok = True
+    for cache_dir in [None, tempfile.mkdtemp()]:
+        simcse = SimCSE(model_dir, device="cpu", cache_dir=cache_dir)
+        full = simcse.encode(sentences, normalize_to_unit=False)
+        for dim in [8, 16, config.hidden_size]:
+            expected = F.normalize(full[:, :dim], dim=-1)
+            got = simcse.encode(sentences, dim=dim)
+            ok = got.shape == expected.shape and torch.allclose(got, expected, atol=1e-6)
+            print("encode(dim=%d)%s: %s   %s" % (dim, " with cache" if cache_dir else "", tuple(got.shape), "OK" if ok else "MISMATCH"))
+            all_ok &= ok
+    return all_ok
+
+
+def time_step(args, config):
+    input_ids = torch.randint(5, config.vocab_size, (args.batch_size, 3, args.seq_len))
+    batch = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    for dims, weights in [(None, None), (args.dims, args.weights)]:
+        model = make_model(config, dims, weights, args.seed)
+        times = []
+        for _ in range(5):
+            model.zero_grad()
+            start = time.perf_counter()
+            model(**batch).loss.backward()
+            times.append(time.perf_counter() - start)
+        print("training step, %s: %.3fs" % ("full embedding only" if dims is None else "prefixes " + dims, sorted(times)[2]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dims", type=str, default="8,16,32")
+    parser.add_argument("--weights", type=str, default="1,1,2")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--seq_len", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = BertConfig(vocab_size=100, hidden_size=64, num_hidden_layers=2, num_attention_heads=4, intermediate_size=128)
+    all_ok = check_loss(args, config)
+    all_ok &= check_encode(config)
+    time_step(args, config)
+    print("all checks passed" if all_ok else "SOME CHECKS FAILED")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from prettytable import PrettyTable
 import torch
 import transformers
 from transformers import AutoModel, AutoTokenizer
+from simcse.capture import LayerCapture, POOLER_HIDDEN_STATES
 
 # Set up logger
 logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.DEBUG)
@@ -27,6 +28,14 @@ def print_table(task_names, scores):
     print(tb)
 
 
+def sts_score(results, task, mode):
+    if mode == 'dev':
+        return results[task]['dev']['spearman'][0] * 100
+    if task in ['STS12', 'STS13', 'STS14', 'STS15', 'STS16']:
+        return results[task]['all']['spearman']['all'] * 100
+    return results[task]['test']['spearman'].correlation * 100
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_name_or_path", type=str,
@@ -48,6 +57,9 @@ def main():
                                  'MR', 'CR', 'MPQA', 'SUBJ', 'SST2', 'TREC', 'MRPC',
                                  'SICKRelatedness', 'STSBenchmark'],
                         help="Tasks to evaluate on. If '--task_set' is specified, this will be overridden")
+    parser.add_argument("--dims", type=int, nargs='+', default=None,
+                        help="Also evaluate the STS tasks with the embeddings truncated to each of these sizes "
+                             "(e.g., for models trained with --matryoshka_dims) and report STS against the embedding size")
 
     args = parser.parse_args()
 
@@ -111,12 +123,11 @@ def main():
         for k in batch:
             batch[k] = batch[k].to(device)
 
-        # Get raw embeddings
-        with torch.no_grad():
-            outputs = model(**batch, output_hidden_states=True, return_dict=True)
+        # Get raw embeddings, keeping only the intermediate layers the pooler averages
+        with torch.no_grad(), LayerCapture(model, POOLER_HIDDEN_STATES.get(args.pooler, ())) as hidden_states:
+            outputs = model(**batch, return_dict=True)
             last_hidden = outputs.last_hidden_state
             pooler_output = outputs.pooler_output
-            hidden_states = outputs.hidden_states
 
         # Apply different poolers
         if args.pooler == 'cls':
@@ -149,6 +160,19 @@ def main():
         result = se.eval(task)
         results[task] = result
 
+    # The STS tasks again on embedding prefixes
+    sts_tasks = ['STSBenchmark', 'SICKRelatedness'] if args.mode == 'dev' else \
+        ['STS12', 'STS13', 'STS14', 'STS15', 'STS16', 'STSBenchmark', 'SICKRelatedness']
+    sts_tasks = [task for task in sts_tasks if task in args.tasks]
+    dim_results = {}
+    for dim in args.dims or []:
+        def dim_batcher(params, batch, dim=dim):
+            return batcher(params, batch)[:, :dim]
+        dim_results[dim] = {}
+        for task in sts_tasks:
+            se = senteval.engine.SE(params, dim_batcher, prepare)
+            dim_results[dim][task] = se.eval(task)
+
     # Print evaluation results
     if args.mode == 'dev':
         print("------ %s ------" % (args.mode))
@@ -205,6 +229,16 @@ def main():
         scores.append("%.2f" % (sum([float(score) for score in scores]) / len(scores)))
         print_table(task_names, scores)
 
+    if len(dim_results) > 0 and len(sts_tasks) > 0:
+        print("------ %s: STS by embedding size ------" % (args.mode))
+        tb = PrettyTable()
+        tb.field_names = ["Dim."] + sts_tasks + ["Avg."]
+        rows = sorted(dim_results.items()) + [("full (%d)" % model.config.hidden_size, results)]
+        for dim, dim_result in rows:
+            scores = [sts_score(dim_result, task, args.mode) for task in sts_tasks]
+            tb.add_row([dim] + ["%.2f" % score for score in scores] + ["%.2f" % (sum(scores) / len(scores))])
+        print(tb)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
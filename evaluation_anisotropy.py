@@ -7,6 +7,7 @@ from prettytable import PrettyTable
 import torch
 import transformers
 from transformers import AutoModel, AutoTokenizer
+from simcse.capture import LayerCapture, POOLER_HIDDEN_STATES
 import tqdm
 from functools import partialmethod
 import time
@@ -96,12 +97,11 @@ def main():
         for k in batch:
             batch[k] = batch[k].to(device)
 
-        # Get raw embeddings
-        with torch.no_grad():
-            outputs = model(**batch, output_hidden_states=True, return_dict=True)
+        # Get raw embeddings, keeping only the intermediate layers the pooler averages
+        with torch.no_grad(), LayerCapture(model, POOLER_HIDDEN_STATES.get(args.pooler, ())) as hidden_states:
+            outputs = model(**batch, return_dict=True)
             last_hidden = outputs.last_hidden_state
             pooler_output = outputs.pooler_output
-            hidden_states = outputs.hidden_states
 
         # Apply different poolers
         if args.pooler == 'cls':
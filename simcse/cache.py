@@ -0,0 +1,126 @@
+import os
+import json
+import atexit
+import pickle
+import hashlib
+import logging
+from collections import OrderedDict
+import numpy as np
+from numpy import ndarray
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache(object):
+    """
+    A persistent, content-addressed cache of sentence embeddings.
+    Vectors live in a memory-mapped matrix of `max_entries` rows under `cache_dir`; a key maps to
+    a row, and the least recently used key gives its row away once the matrix is full.
+    The key -> row map is only saved by `flush` (at exit), so every row also records, next to the
+    vector, the key it holds. A lookup whose row holds another key (the process died after the row
+    was reused but before the map was saved) is a miss.
+    """
+    KEY_SIZE = 20  # sha1 digest
+    def __init__(self, cache_dir: str,
+                dim: int,
+                max_entries: int = 1000000):
+
+        self.cache_dir = cache_dir
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        vectors_path = os.path.join(cache_dir, "vectors.npy")
+        row_keys_path = os.path.join(cache_dir, "row_keys.npy")
+        self.keys_path = os.path.join(cache_dir, "keys.pkl")
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != dim or meta["max_entries"] != max_entries:
+                raise ValueError("Cache at %s was created with dim=%d, max_entries=%d, which does not match dim=%d, max_entries=%d" % (
+                    cache_dir, meta["dim"], meta["max_entries"], dim, max_entries))
+            self.vectors = np.load(vectors_path, mmap_mode="r+")
+            with open(self.keys_path, "rb") as f:
+                self.slots = pickle.load(f)
+            if os.path.exists(row_keys_path):
+                self.row_keys = np.load(row_keys_path, mmap_mode="r+")
+            else:
+                # A cache written before rows recorded their keys: trust the saved map once
+                self.row_keys = np.lib.format.open_memmap(row_keys_path, mode="w+", dtype=np.uint8, shape=(max_entries, self.KEY_SIZE))
+                for key, slot in self.slots.items():
+                    self.row_keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            logger.info("Loaded embedding cache with %d entries from %s" % (len(self.slots), cache_dir))
+        else:
+            self.vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(max_entries, dim))
+            self.row_keys = np.lib.format.open_memmap(row_keys_path, mode="w+", dtype=np.uint8, shape=(max_entries, self.KEY_SIZE))
+            # key -> row in `self.vectors`, ordered from least to most recently used
+            self.slots = OrderedDict()
+            self.flush()
+            with open(meta_path, "w") as f:
+                json.dump({"dim": dim, "max_entries": max_entries}, f)
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(prefix: str, sentence: str) -> bytes:
+        return hashlib.sha1((prefix + "\x00" + sentence).encode("utf-8")).digest()
+
+    def lookup(self, keys: List[bytes]) -> Tuple[ndarray, List[int]]:
+        """
+        Returns an (N, dim) array holding the cached vectors and the positions of `keys` that missed.
+        """
+        vectors = np.zeros((len(keys), self.dim), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is None or self.row_keys[slot].tobytes() != key:
+                # A stale entry keeps its row, which `insert` refills for this key
+                missing.append(i)
+            else:
+                self.slots.move_to_end(key)
+                vectors[i] = self.vectors[slot]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return vectors, missing
+
+    def insert(self, keys: List[bytes], vectors: ndarray):
+        for key, vector in zip(keys, vectors):
+            slot = self.slots.get(key)
+            if slot is not None:
+                self.slots.move_to_end(key)
+            elif len(self.slots) < self.max_entries:
+                slot = len(self.slots)
+                self.slots[key] = slot
+            else:
+                # Evict the least recently used entry and reuse its row
+                _, slot = self.slots.popitem(last=False)
+                self.slots[key] = slot
+            # Clear the row's key before overwriting its vector, so a crash in between leaves a miss
+            self.row_keys[slot] = 0
+            self.vectors[slot] = vector
+            self.row_keys[slot] = np.frombuffer(key, dtype=np.uint8)
+
+    def flush(self):
+        self.vectors.flush()
+        self.row_keys.flush()
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.slots, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.keys_path)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "entries": len(self.slots),
+            "max_entries": self.max_entries,
+        }
+
+    def __len__(self):
+        return len(self.slots)
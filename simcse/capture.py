@@ -0,0 +1,76 @@
+"""
+Capture of selected hidden layers for the poolers that average intermediate layers.
+
+`output_hidden_states=True` makes BERT/RoBERTa return the embedding output and every layer's output
+(25 tensors for roberta-large), all alive until pooling, when `avg_top2` and `avg_first_last` only
+average two of them. `LayerCapture` instead registers forward hooks on just those layers.
+"""
+from torch import Tensor
+from typing import Callable, Iterable
+
+# Entries of `hidden_states` (0: embedding output, i: output of the i-th layer) each pooler averages
+POOLER_HIDDEN_STATES = {
+    "avg_top2": (-2, -1),
+    "avg_first_last": (1, -1),
+}
+
+
+class LayerCapture(object):
+    """
+    Context manager keeping the outputs of the given `hidden_states` entries of a BERT/RoBERTa
+    `encoder` (the base model) while it runs. Index it like `outputs.hidden_states`; negative indices
+    count from the last layer. With no indices, no hooks are registered.
+
+    Entry i < num_layers is taken as the input of layer i and the last entry as the output of the
+    layer stack, not as the output of a layer module: with activation checkpointing, a layer's own
+    output is computed under no_grad inside the checkpoint, while its input and the stack's output
+    carry the autograd history.
+    """
+    def __init__(self, encoder, indices: Iterable[int]):
+        self.layers = list(encoder.encoder.layer)
+        self.stack = encoder.encoder
+        self.num_hidden_states = len(self.layers) + 1
+        self.indices = sorted(set(i % self.num_hidden_states for i in indices))
+        self.hidden_states = {}
+        self.handles = []
+
+    def _input_hook(self, index: int):
+        def hook(module, inputs):
+            self.hidden_states[index] = inputs[0]
+        return hook
+
+    def _output_hook(self, index: int):
+        def hook(module, inputs, output):
+            self.hidden_states[index] = output[0]
+        return hook
+
+    def __enter__(self):
+        self.hidden_states = {}
+        for i in self.indices:
+            if i < len(self.layers):
+                self.handles.append(self.layers[i].register_forward_pre_hook(self._input_hook(i)))
+            else:
+                self.handles.append(self.stack.register_forward_hook(self._output_hook(i)))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def record(self, index: int, hidden: Tensor):
+        """
+        Store `hidden` as entry `index` if it is captured (for callers running the layers themselves).
+        """
+        index %= self.num_hidden_states
+        if index in self.indices:
+            self.hidden_states[index] = hidden
+
+    def __getitem__(self, index: int) -> Tensor:
+        return self.hidden_states[index % self.num_hidden_states]
+
+    def apply(self, fn: Callable[[Tensor], Tensor]):
+        """
+        Replace every captured tensor `h` with `fn(h)` (e.g., to unpack packed rows).
+        """
+        self.hidden_states = {i: fn(h) for i, h in self.hidden_states.items()}
@@ -0,0 +1,536 @@
+"""
+Loading and tokenization of the training set, and a pre-tokenized memory-mapped format for it.
+
+`train.py` reads the CSV with `datasets`, then tokenizes every example into nested lists of token ids.
+This happens again at every startup (or is looked up in the cache by hashing), and every DataLoader
+worker pulls the ragged lists through Arrow into Python objects. Instead, tokenize once:
+
+    python -m simcse.data --train_file ../Data/SumCSE.csv --model_name_or_path roberta-large \
+        --max_seq_length 32 --output_dir ../Data/SumCSE.roberta-large.32
+
+which writes, in the example order `train.py` would use,
+
+    input_ids.npy   every sentence's token ids back to back (int32)
+    offsets.npy     (num_examples * num_sent + 1,) start of every view of every example (int64)
+    meta.json       number of views, tokenizer, max_seq_length, and which inputs to build
+
+and train with `--pretokenized_dir` pointing at it. `PretokenizedDataset` memory-maps the two arrays,
+so opening it is instant and its pages are shared by all DataLoader workers.
+
+Corpora too large to tokenize up front can be streamed instead (`--streaming`, `StreamingTrainDataset`).
+"""
+import os
+import csv
+import glob
+import json
+import logging
+import argparse
+import random
+import itertools
+import numpy as np
+import torch
+from typing import Any, Dict, List, Optional, Tuple
+
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
+from datasets import load_dataset
+from transformers import AutoTokenizer
+
+from .index import AppendableNpy
+
+logger = logging.getLogger(__name__)
+
+INPUT_IDS_FILE = "input_ids.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+# Tokenizer outputs with one entry per view, and what their padding is filled with (`input_ids`: the pad token)
+VIEW_KEYS = ["input_ids", "attention_mask", "token_type_ids", "special_tokens_mask"]
+PAD_VALUES = {"attention_mask": 0, "special_tokens_mask": 1}
+
+
+def load_train_dataset(train_file: str, cache_dir: str = None):
+    """
+    Load a training CSV/TSV (or a dataset of the Hub) and shuffle it with the seed `train.py` uses.
+    """
+    data_files = {"train": train_file}
+    extension = train_file.split(".")[-1]
+    if extension == "csv":
+        datasets = load_dataset(extension, data_files=data_files, cache_dir=cache_dir, delimiter="\t" if "tsv" in train_file else ",")
+    else:
+        logger.info("Loading Hugging Face dataset %s" % train_file)
+        datasets = load_dataset(train_file, cache_dir=cache_dir)
+    return datasets.shuffle(seed=42)
+
+
+def feature_columns(column_names: List[str]) -> Tuple[str, str, Optional[str]]:
+    """
+    Columns of the first sentence, its positive, and its hard negative (None without one).
+    """
+    if len(column_names) == 2:
+        # Pair datasets
+        return column_names[0], column_names[1], None
+    elif len(column_names) == 3:
+        # Pair datasets with hard negatives
+        return column_names[0], column_names[1], column_names[2]
+    elif len(column_names) == 1:
+        # Unsupervised datasets
+        return column_names[0], column_names[0], None
+    else:
+        return column_names[0], column_names[1], column_names[3]
+
+
+def tokenize_examples(examples: Dict[str, List[str]],
+                      tokenizer,
+                      columns: Tuple[str, str, Optional[str]],
+                      max_length: int,
+                      pad_to_max_length: bool = False) -> Dict[str, List[List[List[int]]]]:
+    """
+    Tokenize a batch of examples into, for every tokenizer output, one list per example with one
+    entry per view (sentence, positive and, if any, hard negative).
+    """
+    # padding = longest (default)
+    #   If no sentence in the batch exceed the max length, then use
+    #   the max sentence length in the batch, otherwise use the
+    #   max sentence length in the argument and truncate those that
+    #   exceed the max length.
+    # padding = max_length (when pad_to_max_length, for pressure test)
+    #   All sentences are padded/truncated to data_args.max_seq_length.
+    sent0_cname, sent1_cname, sent2_cname = columns
+    total = len(examples[sent0_cname])
+    # Avoid "None" fields
+    for idx in range(total):
+        if examples[sent0_cname][idx] is None:
+            examples[sent0_cname][idx] = " "
+        if examples[sent1_cname][idx] is None:
+            examples[sent1_cname][idx] = " "
+    sentences = examples[sent0_cname] + examples[sent1_cname]
+    # If hard negative exists
+    if sent2_cname is not None:
+        for idx in range(total):
+            if examples[sent2_cname][idx] is None:
+                examples[sent2_cname][idx] = " "
+        sentences += examples[sent2_cname]
+
+    sent_features = tokenizer(
+        sentences,
+        max_length=max_length,
+        truncation=True,
+        padding="max_length" if pad_to_max_length else False,
+    )
+    num_sent = len(sentences) // total if total > 0 else 0
+    features = {}
+    for key in sent_features:
+        features[key] = [[sent_features[key][i + total * j] for j in range(num_sent)] for i in range(total)]
+    return features
+
+
+def collate_views(features: List[Dict[str, Any]],
+                  pad_token_id: int,
+                  pad_token_type_id: int = 0,
+                  padding_side: str = "right",
+                  max_length: int = None,
+                  pad_to_multiple_of: int = None,
+                  return_token_type_ids: bool = False) -> Dict[str, torch.Tensor]:
+    """
+    Pad the views of a batch of examples into (bs * num_sent, len) int64 tensors, as `tokenizer.pad`
+    does for the flattened views, without building a dict per view. Views are lists or 1-d arrays of
+    ids. `len` is the longest view, or `max_length` if given, rounded up to a multiple of
+    `pad_to_multiple_of`. A missing attention mask is built from the lengths, and so are missing
+    token type ids (zeros) with `return_token_type_ids`. Per-example features (e.g., `sent_ids`)
+    become (bs, -1) tensors.
+    """
+    views = [view for feature in features for view in feature["input_ids"]]
+    lengths = np.fromiter((len(view) for view in views), dtype=np.int64, count=len(views))
+    seq_len = max_length if max_length is not None else int(lengths.max())
+    if pad_to_multiple_of is not None and seq_len % pad_to_multiple_of != 0:
+        seq_len = (seq_len // pad_to_multiple_of + 1) * pad_to_multiple_of
+    if padding_side == "right":
+        mask = np.arange(seq_len)[None, :] < lengths[:, None]
+    else:
+        mask = np.arange(seq_len)[None, :] >= seq_len - lengths[:, None]
+    mask = torch.from_numpy(mask)
+    total = int(lengths.sum())
+
+    batch = {}
+    for key in VIEW_KEYS:
+        if key not in features[0]:
+            continue
+        pad_value = pad_token_id if key == "input_ids" else pad_token_type_id if key == "token_type_ids" else PAD_VALUES[key]
+        if isinstance(features[0][key][0], np.ndarray):
+            values = np.concatenate([view for feature in features for view in feature[key]]).astype(np.int64)
+        else:
+            values = np.fromiter(itertools.chain.from_iterable(view for feature in features for view in feature[key]), dtype=np.int64, count=total)
+        padded = torch.full((len(views), seq_len), pad_value, dtype=torch.long)
+        padded[mask] = torch.from_numpy(values)
+        batch[key] = padded
+    if "attention_mask" not in batch:
+        batch["attention_mask"] = mask.long()
+    if return_token_type_ids and "token_type_ids" not in batch:
+        batch["token_type_ids"] = torch.full((len(views), seq_len), pad_token_type_id, dtype=torch.long).masked_fill_(mask, 0)
+    for key in features[0]:
+        if key not in VIEW_KEYS:
+            batch[key] = torch.tensor([feature[key] for feature in features]).view(len(features), -1)
+    return batch
+
+
+def special_token_ids(tokenizer) -> torch.Tensor:
+    """
+    Ids that `tokenizer.get_special_tokens_mask(..., already_has_special_tokens=True)` flags. That mask
+    is decided token by token (slow BERT/RoBERTa tokenizers flag only [CLS]/[SEP], fast ones every
+    special token), so it is enough to ask once about each special token.
+    """
+    ids = tokenizer.all_special_ids
+    flags = tokenizer.get_special_tokens_mask(ids, already_has_special_tokens=True)
+    return torch.tensor(sorted(set(i for i, flag in zip(ids, flags) if flag)), dtype=torch.long)
+
+
+def mask_tokens(inputs: torch.Tensor,
+                mask_token_id: int,
+                vocab_size: int,
+                special_ids: torch.Tensor,
+                mlm_probability: float = 0.15,
+                special_tokens_mask: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Prepare masked tokens inputs/labels for masked language modeling: 80% MASK, 10% random, 10% original.
+    Special tokens (`special_ids`, see `special_token_ids`) are never masked. Draws the same random
+    numbers in the same order as the per-row `DataCollatorForLanguageModeling` recipe, so results
+    match it under a fixed seed. Runs on the device of `inputs`.
+    """
+    inputs = inputs.clone()
+    labels = inputs.clone()
+    # We sample a few tokens in each sequence for MLM training (with probability `mlm_probability`)
+    probability_matrix = torch.full(labels.shape, mlm_probability, device=inputs.device)
+    if special_tokens_mask is None:
+        special_tokens_mask = torch.isin(labels, special_ids.to(inputs.device))
+    else:
+        special_tokens_mask = special_tokens_mask.bool()
+
+    probability_matrix.masked_fill_(special_tokens_mask, value=0.0)
+    masked_indices = torch.bernoulli(probability_matrix).bool()
+    labels[~masked_indices] = -100  # We only compute loss on masked tokens
+
+    # 80% of the time, we replace masked input tokens with the mask token
+    indices_replaced = torch.bernoulli(torch.full(labels.shape, 0.8, device=inputs.device)).bool() & masked_indices
+    inputs[indices_replaced] = mask_token_id
+
+    # 10% of the time, we replace masked input tokens with random word
+    indices_random = torch.bernoulli(torch.full(labels.shape, 0.5, device=inputs.device)).bool() & masked_indices & ~indices_replaced
+    random_words = torch.randint(vocab_size, labels.shape, dtype=torch.long, device=inputs.device)
+    inputs[indices_random] = random_words[indices_random]
+
+    # The rest of the time (10% of the time) we keep the masked input tokens unchanged
+    return inputs, labels
+
+
+def pretokenize(train_file: str, tokenizer, max_length: int, output_dir: str, chunk_size: int = 10000):
+    """
+    Tokenize a training file into the memory-mapped layout read by `PretokenizedDataset`.
+    """
+    dataset = load_train_dataset(train_file)["train"]
+    columns = feature_columns(dataset.column_names)
+    num_sent = 2 if columns[2] is None else 3
+    os.makedirs(output_dir, exist_ok=True)
+
+    input_ids = AppendableNpy(os.path.join(output_dir, INPUT_IDS_FILE), np.int32)
+    offsets = [np.zeros(1, dtype=np.int64)]
+    model_input_names = None
+    for start in range(0, len(dataset), chunk_size):
+        features = tokenize_examples(dataset[start:start + chunk_size], tokenizer, columns, max_length)
+        model_input_names = sorted(features)
+        sentences = [sentence for example in features["input_ids"] for sentence in example]
+        lengths = np.array([len(sentence) for sentence in sentences], dtype=np.int64)
+        input_ids.append(np.fromiter((t for sentence in sentences for t in sentence), dtype=np.int32, count=int(lengths.sum())))
+        offsets.append(offsets[-1][-1] + np.cumsum(lengths))
+        logger.info("Tokenized %d of %d examples" % (min(start + chunk_size, len(dataset)), len(dataset)))
+    input_ids.close()
+    np.save(os.path.join(output_dir, OFFSETS_FILE), np.concatenate(offsets))
+
+    meta = {"source": os.path.abspath(train_file), "num_examples": len(dataset), "num_sent": num_sent,
+            "max_seq_length": max_length, "tokenizer": tokenizer.name_or_path, "vocab_size": len(tokenizer),
+            "model_input_names": model_input_names or ["attention_mask", "input_ids"]}
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+class PretokenizedDataset(Dataset):
+    """
+    Training examples in the layout written by `pretokenize`, read from memory-mapped arrays. Each
+    item holds the `input_ids` of its views as int32 array slices, plus any column added with
+    `add_column`. The attention masks and token type ids `prepare_features` in `train.py` would add
+    are rebuilt from the lengths by `collate_views` (see `return_token_type_ids`).
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.num_sent = self.meta["num_sent"]
+        self.input_ids = np.load(os.path.join(path, INPUT_IDS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        assert len(self.offsets) == self.meta["num_examples"] * self.num_sent + 1, "%s is incomplete" % path
+        self.columns = {}
+
+    def __len__(self) -> int:
+        return self.meta["num_examples"]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        bounds = self.offsets[i * self.num_sent:(i + 1) * self.num_sent + 1]
+        feature = {"input_ids": [self.input_ids[start:end] for start, end in zip(bounds[:-1], bounds[1:])]}
+        for name, column in self.columns.items():
+            feature[name] = column[i]
+        return feature
+
+    def add_column(self, name: str, column) -> "PretokenizedDataset":
+        """
+        Add a per-example feature (a sequence with one entry per example), as `datasets.Dataset.add_column`.
+        """
+        assert len(column) == len(self), "expected %d values, got %d" % (len(self), len(column))
+        self.columns[name] = column
+        return self
+
+    def example_lengths(self) -> np.ndarray:
+        """
+        Length of the longest view of every example, from the offsets alone.
+        """
+        lengths = np.diff(self.offsets).reshape(-1, self.num_sent)
+        return lengths.max(axis=1)
+
+    def sentence_ids(self) -> Tuple[List[List[int]], np.ndarray]:
+        """
+        Same as `simcse.frozen.assign_sentence_ids` over this dataset, without building the nested lists.
+        """
+        ids = {}
+        lengths = []
+        flat_ids = np.empty(len(self.offsets) - 1, dtype=np.int64)
+        for j, (start, end) in enumerate(zip(self.offsets[:-1], self.offsets[1:])):
+            key = self.input_ids[start:end].tobytes()
+            if key not in ids:
+                ids[key] = len(ids)
+                lengths.append(end - start)
+            flat_ids[j] = ids[key]
+        return flat_ids.reshape(-1, self.num_sent).tolist(), np.asarray(lengths, dtype=np.int64)
+
+    def check_compatible(self, tokenizer, max_length: int):
+        """
+        Raise if the dataset was tokenized differently than training would tokenize the source file.
+        """
+        if self.meta["vocab_size"] != len(tokenizer):
+            raise ValueError("The pre-tokenized dataset was built with a vocabulary of %d tokens (%s), the tokenizer has %d." % (
+                self.meta["vocab_size"], self.meta["tokenizer"], len(tokenizer)))
+        if self.meta["max_seq_length"] != max_length:
+            raise ValueError("The pre-tokenized dataset was truncated to %d tokens, but max_seq_length is %d." % (
+                self.meta["max_seq_length"], max_length))
+
+
+def example_lengths(dataset) -> np.ndarray:
+    """
+    Length of the longest view of every example of a tokenized training set, which is what the
+    collator pads the example's views to (together with the rest of the batch).
+    """
+    if isinstance(dataset, PretokenizedDataset):
+        return dataset.example_lengths()
+    return np.fromiter((max(len(view) for view in views) for views in dataset["input_ids"]), dtype=np.int64, count=len(dataset))
+
+
+class LengthGroupedSampler(Sampler):
+    """
+    Shuffled sampler that puts examples of similar length in the same batch, so that views are padded
+    less. Every epoch, a random permutation is cut into mega-batches of `group_size` global batches
+    (`batch_size` examples on each of `num_replicas` processes), each mega-batch is sorted by length and
+    cut into global batches, and the global batches are shuffled. `group_size=1` gives the batches of
+    a plain random sampler; larger groups pad less but make the in-batch negatives of a batch more
+    alike in length.
+
+    Like `DistributedSampler`, the permutation depends only on `seed` and the epoch (`set_epoch`), is
+    padded by repeating examples to a multiple of `num_replicas`, and process `rank` yields every
+    `num_replicas`-th example of each global batch. Only the last global batch can be incomplete, so
+    the DataLoader's batches of `batch_size` line up with the groups on every process.
+    """
+    def __init__(self, lengths: np.ndarray, batch_size: int, group_size: int = 50,
+                 num_replicas: int = 1, rank: int = 0, seed: int = 0):
+        assert group_size > 0, "group_size must be positive"
+        assert 0 <= rank < num_replicas, "invalid rank %d for %d replicas" % (rank, num_replicas)
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.group_size = group_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = (len(self.lengths) + num_replicas - 1) // num_replicas
+        self.total_size = self.num_samples * num_replicas
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def global_batches(self) -> List[np.ndarray]:
+        """
+        The global batches of the current epoch, in order.
+        """
+        rng = np.random.RandomState(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths))
+        indices = np.concatenate([indices, indices[:self.total_size - len(indices)]])
+        global_batch_size = self.batch_size * self.num_replicas
+        mega_batch_size = global_batch_size * self.group_size
+        batches = []
+        for start in range(0, self.total_size, mega_batch_size):
+            mega_batch = indices[start:start + mega_batch_size]
+            mega_batch = mega_batch[np.argsort(-self.lengths[mega_batch], kind="stable")]
+            batches.extend(mega_batch[i:i + global_batch_size] for i in range(0, len(mega_batch), global_batch_size))
+        # Keep the incomplete batch (if any) last
+        num_full = len(batches) - (len(batches[-1]) < global_batch_size)
+        order = rng.permutation(num_full).tolist() + list(range(num_full, len(batches)))
+        return [batches[i] for i in order]
+
+    def __iter__(self):
+        return iter(np.concatenate([batch[self.rank::self.num_replicas] for batch in self.global_batches()]).tolist())
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+class StreamingTrainDataset(IterableDataset):
+    """
+    Training examples read lazily from CSV/TSV (with a header) or JSON lines files, tokenized in chunks
+    of `chunk_size` by whichever DataLoader worker reads them, and shuffled through a buffer of
+    `buffer_size` examples. `train_file` is a file or a glob pattern matching the parts of a split
+    corpus (CSV parts all with the same header). The data are read over and over, so training length
+    is set by `max_steps`.
+
+    The data (after the headers) are split into `num_replicas * num_workers` contiguous byte ranges,
+    one per DataLoader worker of every process, and each worker only reads the records that start in
+    its range, so every record is read by exactly one of them in every pass. Records must be single
+    lines (no line breaks inside quoted CSV fields). The shuffle of each shard depends only on `seed`
+    and the shard. `num_replicas` and `rank` default to the `torch.distributed` process group, if any.
+    """
+    def __init__(self, train_file: str, tokenizer, max_length: int, pad_to_max_length: bool = False,
+                 buffer_size: int = 10000, chunk_size: int = 1000, seed: int = 42,
+                 num_replicas: Optional[int] = None, rank: Optional[int] = None):
+        assert buffer_size > 0 and chunk_size > 0, "buffer_size and chunk_size must be positive"
+        self.train_file = train_file
+        self.files = sorted(glob.glob(train_file)) or [train_file]
+        extensions = set(path.split(".")[-1] for path in self.files)
+        if len(extensions) > 1 or not extensions <= {"csv", "tsv", "json", "jsonl"}:
+            raise ValueError("Streaming reads .csv, .tsv, .json or .jsonl files of one kind, not %s" % train_file)
+        self.is_csv = extensions <= {"csv", "tsv"}
+        self.delimiter = "\t" if extensions == {"tsv"} else ","
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.pad_to_max_length = pad_to_max_length
+        self.buffer_size = buffer_size
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        # (path, offset of the first record, file size) of every part
+        self.spans = []
+        self.column_names = None
+        for path in self.files:
+            with open(path, "rb") as f:
+                first_line = f.readline()
+            if self.is_csv:
+                names = next(csv.reader([first_line.decode("utf-8")], delimiter=self.delimiter))
+                if self.column_names is not None and names != self.column_names:
+                    raise ValueError("%s has columns %s, %s has %s" % (self.files[0], self.column_names, path, names))
+                self.spans.append((path, len(first_line), os.path.getsize(path)))
+            else:
+                names = list(json.loads(first_line).keys())
+                self.spans.append((path, 0, os.path.getsize(path)))
+            self.column_names = self.column_names or names
+        self.columns = feature_columns(self.column_names)
+
+    def parse(self, line: bytes) -> Dict[str, Any]:
+        """
+        One record as a dict (empty CSV fields are None, as with `datasets`).
+        """
+        if self.is_csv:
+            row = next(csv.reader([line.decode("utf-8")], delimiter=self.delimiter))
+            return {name: value if value != "" else None for name, value in zip(self.column_names, row)}
+        return json.loads(line)
+
+    def records(self, num_shards: int = 1, shard_id: int = 0):
+        """
+        The records of one shard, in file order: those whose line starts in the shard's byte range.
+        """
+        total = sum(size - start for _, start, size in self.spans)
+        low, high = total * shard_id // num_shards, total * (shard_id + 1) // num_shards
+        offset = 0
+        for path, start, size in self.spans:
+            begin, end = max(low - offset, 0), min(high - offset, size - start)
+            offset += size - start
+            if begin >= end:
+                continue
+            with open(path, "rb") as f:
+                if begin > 0:
+                    # The line running through `begin` (if it started before it) belongs to the previous shard
+                    f.seek(start + begin - 1)
+                    f.readline()
+                else:
+                    f.seek(start)
+                while f.tell() < start + end:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        yield self.parse(line)
+
+    def examples(self, num_shards: int = 1, shard_id: int = 0):
+        """
+        The tokenized examples of one shard, in file order.
+        """
+        records = self.records(num_shards, shard_id)
+        while True:
+            chunk = list(itertools.islice(records, self.chunk_size))
+            if not chunk:
+                return
+            batch = {name: [record.get(name) for record in chunk] for name in self.column_names}
+            features = tokenize_examples(batch, self.tokenizer, self.columns, self.max_length, self.pad_to_max_length)
+            for i in range(len(chunk)):
+                yield {key: values[i] for key, values in features.items()}
+
+    def shard(self) -> Tuple[int, int]:
+        """
+        Number of shards and the shard of the calling process and DataLoader worker.
+        """
+        num_replicas, rank = self.num_replicas, self.rank
+        if num_replicas is None:
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            num_replicas = torch.distributed.get_world_size() if distributed else 1
+            rank = torch.distributed.get_rank() if distributed else 0
+        worker = get_worker_info()
+        num_workers, worker_id = (worker.num_workers, worker.id) if worker is not None else (1, 0)
+        return num_replicas * num_workers, rank * num_workers + worker_id
+
+    def __iter__(self):
+        num_shards, shard_id = self.shard()
+        rng = random.Random(self.seed * 100003 + shard_id)
+        buffer = []
+        for epoch in itertools.count():
+            num_examples = 0
+            for feature in self.examples(num_shards, shard_id):
+                num_examples += 1
+                if len(buffer) < self.buffer_size:
+                    buffer.append(feature)
+                    continue
+                i = rng.randrange(len(buffer))
+                yield buffer[i]
+                buffer[i] = feature
+            if num_examples == 0:
+                raise ValueError("%s has no examples for shard %d of %d" % (self.train_file, shard_id, num_shards))
+            # The buffer carries over into the next pass over the file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize a SimCSE training file into memory-mapped arrays.")
+    parser.add_argument("--train_file", type=str, required=True)
+    parser.add_argument("--model_name_or_path", type=str, required=True, help="Model (or tokenizer) whose tokenizer to use")
+    parser.add_argument("--max_seq_length", type=int, default=32)
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--chunk_size", type=int, default=10000, help="Examples tokenized at a time")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s -   %(message)s", level=logging.INFO)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path, use_fast=True)
+    pretokenize(args.train_file, tokenizer, args.max_seq_length, args.output_dir, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Partial fine-tuning with the bottom encoder layers frozen, and an on-disk cache of their outputs.
+
+With `freeze_layers` = k, the embeddings and the bottom k transformer layers get no gradients and run
+in eval mode (no dropout), so their output for a given sentence never changes during training.
+`frozen_encode` runs them without autograd and only the upper layers with it. Given a
+`FrozenLayerCache`, the frozen output of every unique training sentence is computed the first time the
+sentence is seen and read back from a memory-mapped file afterwards, so later epochs skip the bottom
+k layers altogether.
+"""
+import os
+import numpy as np
+import torch
+import torch.utils.checkpoint
+from torch import Tensor
+from typing import List, Tuple
+from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
+
+from .capture import LayerCapture
+
+
+def freeze_bottom_layers(encoder, num_layers: int):
+    """
+    Stop the gradients of the embeddings and the bottom `num_layers` layers of a BERT/RoBERTa `encoder`.
+    """
+    encoder.embeddings.requires_grad_(False)
+    for layer in encoder.encoder.layer[:num_layers]:
+        layer.requires_grad_(False)
+
+
+def assign_sentence_ids(input_ids: List[List[List[int]]], attention_mask: List[List[List[int]]]) -> Tuple[List[List[int]], np.ndarray]:
+    """
+    Number the unique sentences of a tokenized training set, given the token ids and attention mask
+    of every view of every example. Returns the sentence id of every view of every example and the
+    number of real tokens of every unique sentence.
+    """
+    ids = {}
+    lengths = []
+    sent_ids = []
+    for example_ids, example_mask in zip(input_ids, attention_mask):
+        row = []
+        for tokens, mask in zip(example_ids, example_mask):
+            key = tuple(tokens)
+            if key not in ids:
+                ids[key] = len(ids)
+                lengths.append(sum(mask))
+            row.append(ids[key])
+        sent_ids.append(row)
+    return sent_ids, np.asarray(lengths, dtype=np.int64)
+
+
+class FrozenLayerCache(object):
+    """
+    Memory-mapped (num_tokens, hidden) file with the frozen layers' output at the real tokens of every
+    unique sentence, back to back: sentence i takes rows offsets[i] to offsets[i] + lengths[i]. A
+    sentence's rows are written the first time it is encoded; `filled` records which ones are valid.
+    The file is only meaningful for the run that created it.
+    """
+    def __init__(self, path: str, lengths: np.ndarray, hidden_size: int, dtype=np.float32):
+        self.path = path
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.offsets = np.cumsum(self.lengths) - self.lengths
+        self.data = np.memmap(path, dtype=dtype, mode="w+", shape=(max(int(self.lengths.sum()), 1), hidden_size))
+        self.torch_dtype = torch.from_numpy(np.zeros(0, dtype=dtype)).dtype
+        self.filled = np.zeros(len(self.lengths), dtype=bool)
+
+    def _rows(self, sent_ids: np.ndarray) -> np.ndarray:
+        # Cache row of every real token of the given sentences, in order
+        lengths = self.lengths[sent_ids]
+        starts = self.offsets[sent_ids] - (np.cumsum(lengths) - lengths)
+        return np.repeat(starts, lengths) + np.arange(lengths.sum())
+
+    def contains(self, sent_ids: np.ndarray) -> np.ndarray:
+        return self.filled[sent_ids]
+
+    def read(self, sent_ids: np.ndarray, attention_mask: Tensor) -> Tensor:
+        """
+        (n, len, hidden) frozen outputs of the given sentences at the layout of `attention_mask`, zero at padding.
+        """
+        mask = attention_mask.bool()
+        hidden = torch.zeros(mask.shape + (self.data.shape[1],), dtype=self.torch_dtype, device=mask.device)
+        hidden[mask] = torch.from_numpy(self.data[self._rows(sent_ids)]).to(mask.device)
+        return hidden
+
+    def write(self, sent_ids: np.ndarray, hidden: Tensor, attention_mask: Tensor):
+        mask = attention_mask.bool()
+        assert (mask.sum(1).cpu().numpy() == self.lengths[sent_ids]).all(), "Sentence lengths differ from the ones the cache was built for"
+        self.data[self._rows(sent_ids)] = hidden[mask].to(self.torch_dtype).cpu().numpy()
+        self.filled[sent_ids] = True
+
+    def close(self):
+        """
+        Release and delete the cache file.
+        """
+        del self.data
+        os.remove(self.path)
+
+
+def frozen_encode(encoder,
+                  num_frozen: int,
+                  input_ids: Tensor,
+                  attention_mask: Tensor,
+                  token_type_ids: Tensor = None,
+                  sent_ids: Tensor = None,
+                  cache: FrozenLayerCache = None,
+                  capture: LayerCapture = None) -> BaseModelOutputWithPoolingAndCrossAttentions:
+    """
+    Run a BERT/RoBERTa `encoder` on (n, len) inputs with its embeddings and bottom `num_frozen` layers
+    in eval mode and without autograd, then the upper layers as usual. With a `cache` and the (n,)
+    `sent_ids` of the inputs, the frozen part runs only for the sentences not cached yet. The last
+    layer is recorded in an active `capture`; the other captured layers are taken by its hooks.
+    """
+    layers = encoder.encoder.layer
+    # Trainer puts the whole model back in train mode every step
+    encoder.embeddings.eval()
+    for layer in layers[:num_frozen]:
+        layer.eval()
+
+    # Additive attention mask, as built by BertModel
+    dtype = next(encoder.parameters()).dtype
+    extended_mask = (1.0 - attention_mask[:, None, None, :].to(dtype)) * -10000.0
+
+    use_cache = cache is not None and sent_ids is not None
+    with torch.no_grad():
+        hidden = torch.empty(input_ids.shape + (encoder.config.hidden_size,), dtype=dtype, device=input_ids.device)
+        if use_cache:
+            sent_ids = sent_ids.cpu().numpy()
+            hit = cache.contains(sent_ids)
+        else:
+            hit = np.zeros(input_ids.size(0), dtype=bool)
+
+        miss = torch.as_tensor(np.flatnonzero(~hit), device=input_ids.device)
+        if len(miss) > 0:
+            frozen = encoder.embeddings(input_ids=input_ids[miss],
+                                        token_type_ids=token_type_ids[miss] if token_type_ids is not None else None)
+            for layer in layers[:num_frozen]:
+                frozen = layer(frozen, extended_mask[miss])[0]
+            if use_cache:
+                cache.write(sent_ids[~hit], frozen, attention_mask[miss])
+                # Same precision as the cached copy read in later epochs
+                frozen = frozen.to(cache.torch_dtype)
+            hidden[miss] = frozen.to(dtype)
+        if hit.any():
+            hits = torch.as_tensor(np.flatnonzero(hit), device=input_ids.device)
+            hidden[hits] = cache.read(sent_ids[hit], attention_mask[hits]).to(dtype)
+
+    checkpointing = getattr(encoder.config, "gradient_checkpointing", False) and encoder.training
+    if checkpointing and torch.is_grad_enabled():
+        # A checkpointed layer only passes gradients to its parameters if one of its inputs requires them
+        hidden.requires_grad_(True)
+    for layer in layers[num_frozen:]:
+        if checkpointing:
+            hidden = torch.utils.checkpoint.checkpoint(layer, hidden, extended_mask)[0]
+        else:
+            hidden = layer(hidden, extended_mask)[0]
+
+    if capture is not None:
+        capture.record(len(layers), hidden)
+    return BaseModelOutputWithPoolingAndCrossAttentions(last_hidden_state=hidden)
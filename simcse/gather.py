@@ -0,0 +1,45 @@
+"""
+Differentiable all_gather of the sentence views used by the contrastive loss.
+
+All views of the local batch (z1, z2, hard negatives, ...) are packed into one
+(num_views, bs, hidden) buffer and gathered with a single collective, instead of one all_gather per
+view. The backward pass sums every rank's gradient with respect to the gathered buffer and hands each
+rank the slice it produced, so the in-batch negatives that a rank contributes to the other ranks'
+losses also receive gradient. Combined with DDP's gradient averaging, this gives the same parameter
+gradients as computing the loss over the global batch in a single process.
+"""
+import torch
+import torch.distributed as dist
+from torch import Tensor
+from typing import List
+
+
+class GatherLayer(torch.autograd.Function):
+    """
+    All-gather a (num_views, bs, hidden) tensor into (world_size, num_views, bs, hidden).
+    Every rank must pass a tensor of the same shape.
+    """
+    @staticmethod
+    def forward(ctx, packed: Tensor) -> Tensor:
+        packed = packed.contiguous()
+        gathered = packed.new_empty((dist.get_world_size(),) + tuple(packed.shape))
+        # The output slices are views of one buffer, so this is a single collective
+        dist.all_gather(list(gathered.unbind(0)), packed)
+        ctx.rank = dist.get_rank()
+        return gathered
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor) -> Tensor:
+        grad = grad_output.contiguous()
+        dist.all_reduce(grad, op=dist.ReduceOp.SUM)
+        return grad[ctx.rank]
+
+
+def gather_views(*views: Tensor) -> List[Tensor]:
+    """
+    Gather each (bs, hidden) view from all ranks with one collective and return the full-batch
+    (bs x world_size, hidden) views, ordered by rank as `torch.cat` over `dist.all_gather` would.
+    """
+    gathered = GatherLayer.apply(torch.stack(views, 0))
+    hidden = gathered.size(-1)
+    return [gathered[:, i].reshape(-1, hidden) for i in range(len(views))]
@@ -0,0 +1,95 @@
+"""
+Gradient caching for contrastive training (Gao et al., 2021, "Scaling Deep Contrastive Learning Batch
+Size under Memory Limited Setup").
+
+The contrastive loss couples every example of a batch through the in-batch negatives, so plain
+gradient accumulation changes the objective. Gradient caching keeps the objective and bounds memory
+by the chunk size instead of the batch size:
+
+1. encode the batch chunk by chunk without gradients, recording each chunk's RNG state;
+2. compute the loss over all representations and backpropagate it into the representations only;
+3. re-encode each chunk with gradients, replaying its RNG state so dropout masks are identical,
+   and backpropagate the cached representation gradients into the encoder.
+"""
+import contextlib
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import get_device_states, set_device_states
+from typing import Any, Callable, Dict, List
+
+
+class RandContext(object):
+    """
+    Captures the CPU and CUDA RNG states at creation; entering the context restores them (and the
+    current states are restored on exit), so a forward pass can be replayed with the same dropout.
+    """
+    def __init__(self, tensors: List[torch.Tensor]):
+        self.cpu_state = torch.get_rng_state()
+        self.devices, self.device_states = get_device_states(*tensors)
+
+    def __enter__(self):
+        self._fork = torch.random.fork_rng(devices=self.devices, enabled=True)
+        self._fork.__enter__()
+        torch.set_rng_state(self.cpu_state)
+        set_device_states(self.devices, self.device_states)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._fork.__exit__(exc_type, exc_val, exc_tb)
+        self._fork = None
+
+
+def split_inputs(inputs: Dict[str, Any], chunk_size: int) -> List[Dict[str, Any]]:
+    """
+    Split a batch dict along the first dimension of its tensors into chunks of `chunk_size` examples.
+    """
+    batch_size = inputs["input_ids"].size(0)
+    chunks = []
+    for start in range(0, batch_size, chunk_size):
+        chunks.append({k: v[start:start + chunk_size] if isinstance(v, torch.Tensor) and v.dim() > 0 and v.size(0) == batch_size else v
+                       for k, v in inputs.items()})
+    return chunks
+
+
+def grad_cache_step(model: nn.Module,
+                    inputs: Dict[str, Any],
+                    chunk_size: int,
+                    loss_fn: Callable[[torch.Tensor], torch.Tensor],
+                    backward: Callable[[torch.Tensor], None] = None,
+                    forward_context: Callable[[], Any] = contextlib.nullcontext) -> torch.Tensor:
+    """
+    Accumulate into the parameters' `.grad` the gradients of `loss_fn(model(**inputs, embed_only=True))`
+    while running the encoder on at most `chunk_size` examples at a time.
+    `model` may be wrapped in DistributedDataParallel; gradients are only all-reduced after the last
+    chunk. `backward` runs the backward pass of the loss (e.g., through an AMP grad scaler) and
+    `forward_context` wraps the forward passes (e.g., autocast). Returns the detached loss.
+    """
+    if backward is None:
+        def backward(loss):
+            loss.backward()
+    chunks = split_inputs(inputs, chunk_size)
+
+    # 1. Representations without activations
+    reps, rand_states = [], []
+    with torch.no_grad():
+        for chunk in chunks:
+            rand_states.append(RandContext([v for v in chunk.values() if isinstance(v, torch.Tensor)]))
+            with forward_context():
+                reps.append(model(**chunk, embed_only=True))
+
+    # 2. Full-batch loss, backpropagated into the representations
+    all_reps = torch.cat(reps).detach().requires_grad_()
+    with forward_context():
+        loss = loss_fn(all_reps)
+    backward(loss)
+    rep_grads = all_reps.grad.split([r.size(0) for r in reps])
+
+    # 3. Re-encode each chunk with the same dropout and push the cached gradients through it
+    for i, (chunk, rand_state, rep_grad) in enumerate(zip(chunks, rand_states, rep_grads)):
+        last = i == len(chunks) - 1
+        sync_context = model.no_sync if hasattr(model, "no_sync") and not last else contextlib.nullcontext
+        with sync_context():
+            with rand_state, forward_context():
+                chunk_reps = model(**chunk, embed_only=True)
+            surrogate = torch.dot(chunk_reps.flatten(), rep_grad.to(chunk_reps.dtype).flatten())
+            surrogate.backward()
+    return loss.detach()
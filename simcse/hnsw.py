@@ -0,0 +1,231 @@
+import os
+import json
+import heapq
+import logging
+import numpy as np
+from numpy import ndarray
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class HNSWIndex(object):
+    """
+    A hierarchical navigable small world graph written in NumPy, used for low-latency approximate
+    search when faiss is not installed. Every vector is a node of the bottom layer (with up to
+    `2 * num_neighbors` links) and of a geometrically decreasing number of upper layers (with up to
+    `num_neighbors` links); a query descends greedily from the top layer and runs a beam search of
+    width `ef_search` on the bottom layer, so it only scores the vectors along its path.
+    Vectors are expected to be unit-normalized and are compared by inner product.
+    It implements the part of the faiss index API that `SimCSE` uses (`add`, `search`).
+    """
+    def __init__(self, dim: int,
+                num_neighbors: int = 32,
+                ef_construction: int = 100,
+                ef_search: int = 64,
+                seed: int = 0):
+        self.dim = dim
+        self.num_neighbors = num_neighbors
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.level_mult = 1 / np.log(num_neighbors)
+        self.ntotal = 0
+        self.entry_point = -1
+        self.max_level = -1
+        # Bottom-layer links are a fixed-width matrix padded with -1; upper layers are sparse
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.levels = np.zeros(0, dtype=np.int32)
+        self.links = np.zeros((0, 2 * num_neighbors), dtype=np.int64)
+        self.upper_links = []
+
+    @property
+    def is_trained(self) -> bool:
+        return True
+
+    def train(self, x: ndarray):
+        pass
+
+    def _neighbors(self, node: int, level: int) -> ndarray:
+        if level == 0:
+            row = self.links[node]
+            return row[row >= 0]
+        return self.upper_links[level - 1][node]
+
+    def _set_neighbors(self, node: int, level: int, neighbors: ndarray):
+        if level == 0:
+            self.links[node] = -1
+            self.links[node, :len(neighbors)] = neighbors
+        else:
+            self.upper_links[level - 1][node] = np.asarray(neighbors, dtype=np.int64)
+
+    def _search_layer(self, query: ndarray, entry_points: List[int], ef: int, level: int) -> List[Tuple[float, int]]:
+        """
+        Beam search on one layer. Returns up to `ef` (score, node) pairs, best first.
+        """
+        visited = np.zeros(self.ntotal, dtype=bool)
+        visited[entry_points] = True
+        scores = (self.vectors[entry_points] @ query).tolist()
+        # `candidates` pops the best unexpanded node, `results` pops the worst kept node
+        candidates = [(-s, e) for s, e in zip(scores, entry_points)]
+        results = [(s, e) for s, e in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = self._neighbors(node, level)
+            neighbors = neighbors[~visited[neighbors]]
+            if len(neighbors) == 0:
+                continue
+            visited[neighbors] = True
+            for s, n in zip((self.vectors[neighbors] @ query).tolist(), neighbors.tolist()):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], max_neighbors: int) -> ndarray:
+        """
+        Keep a candidate (sorted best first) only if it is closer to the base node than to every
+        neighbor kept so far, which spreads the links over different directions.
+        """
+        ids = np.array([n for _, n in candidates], dtype=np.int64)
+        if len(ids) <= max_neighbors:
+            return ids
+        scores = np.array([s for s, _ in candidates], dtype=np.float32)
+        pairwise = self.vectors[ids] @ self.vectors[ids].T
+        selected = []
+        for i in range(len(ids)):
+            if len(selected) == 0 or pairwise[i, selected].max() < scores[i]:
+                selected.append(i)
+                if len(selected) == max_neighbors:
+                    break
+        return ids[selected]
+
+    def _grow(self, num_new: int):
+        # Capacity doubles so that adding one vector at a time stays amortized O(1)
+        needed = self.ntotal + num_new
+        if needed <= len(self.vectors) and not isinstance(self.vectors, np.memmap):
+            return
+        capacity = max(needed, 2 * self.ntotal, 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.ntotal] = self.vectors[:self.ntotal]
+        links = np.full((capacity, self.links.shape[1]), -1, dtype=np.int64)
+        links[:self.ntotal] = self.links[:self.ntotal]
+        levels = np.zeros(capacity, dtype=np.int32)
+        levels[:self.ntotal] = self.levels[:self.ntotal]
+        self.vectors, self.links, self.levels = vectors, links, levels
+
+    def add(self, x: ndarray):
+        x = np.asarray(x, dtype=np.float32)
+        self._grow(len(x))
+        rng = np.random.RandomState(self.seed + self.ntotal)
+        new_levels = (-np.log(1 - rng.random_sample(len(x))) * self.level_mult).astype(np.int32)
+        for vector, level in zip(x, new_levels):
+            self._insert(vector, int(level))
+
+    def _insert(self, vector: ndarray, node_level: int):
+        node = self.ntotal
+        self.vectors[node] = vector
+        self.levels[node] = node_level
+        self.ntotal += 1
+        while len(self.upper_links) < node_level:
+            self.upper_links.append({})
+        for level in range(1, node_level + 1):
+            self.upper_links[level - 1][node] = np.zeros(0, dtype=np.int64)
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, node_level
+            return
+
+        entry_points = [self.entry_point]
+        for level in range(self.max_level, node_level, -1):
+            entry_points = [self._search_layer(vector, entry_points, 1, level)[0][1]]
+        for level in range(min(node_level, self.max_level), -1, -1):
+            max_neighbors = 2 * self.num_neighbors if level == 0 else self.num_neighbors
+            found = self._search_layer(vector, entry_points, self.ef_construction, level)
+            neighbors = self._select_neighbors(found, self.num_neighbors)
+            self._set_neighbors(node, level, neighbors)
+            # Link back, pruning neighbor lists that overflow
+            for n in neighbors.tolist():
+                links = np.append(self._neighbors(n, level), node)
+                if len(links) > max_neighbors:
+                    scores = self.vectors[links] @ self.vectors[n]
+                    order = np.argsort(-scores, kind="stable")
+                    links = self._select_neighbors([(scores[i], links[i]) for i in order], max_neighbors)
+                self._set_neighbors(n, level, links)
+            entry_points = [n for _, n in found]
+
+        if node_level > self.max_level:
+            self.entry_point, self.max_level = node, node_level
+
+    def search(self, queries: ndarray, top_k: int) -> Tuple[ndarray, ndarray]:
+        """
+        Returns (scores, ids) of shape (num_queries, top_k), padded with -inf / -1 like faiss.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        if self.ntotal == 0:
+            return scores, ids
+        for i, query in enumerate(queries):
+            entry_points = [self.entry_point]
+            for level in range(self.max_level, 0, -1):
+                entry_points = [self._search_layer(query, entry_points, 1, level)[0][1]]
+            found = self._search_layer(query, entry_points, max(self.ef_search, top_k), 0)[:top_k]
+            scores[i, :len(found)] = [s for s, _ in found]
+            ids[i, :len(found)] = [n for _, n in found]
+        return scores, ids
+
+    def save(self, path: str):
+        """
+        Store the vectors and bottom-layer links as .npy files that `load` can memory-map, and the
+        upper layers as flat (node, level, offset) arrays.
+        """
+        np.save(os.path.join(path, "hnsw_vectors.npy"), self.vectors[:self.ntotal])
+        np.save(os.path.join(path, "hnsw_links.npy"), self.links[:self.ntotal])
+        np.save(os.path.join(path, "hnsw_levels.npy"), self.levels[:self.ntotal])
+        nodes, node_levels, upper_ids = [], [], []
+        for level, layer in enumerate(self.upper_links):
+            for node, neighbors in layer.items():
+                nodes.append(node)
+                node_levels.append(level + 1)
+                upper_ids.append(neighbors)
+        sizes = [len(neighbors) for neighbors in upper_ids]
+        np.save(os.path.join(path, "hnsw_upper_nodes.npy"), np.array(nodes, dtype=np.int64))
+        np.save(os.path.join(path, "hnsw_upper_levels.npy"), np.array(node_levels, dtype=np.int32))
+        np.save(os.path.join(path, "hnsw_upper_offsets.npy"), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+        np.save(os.path.join(path, "hnsw_upper_ids.npy"), np.concatenate(upper_ids) if upper_ids else np.zeros(0, dtype=np.int64))
+        with open(os.path.join(path, "hnsw.json"), "w") as f:
+            json.dump({"dim": self.dim, "num_neighbors": self.num_neighbors, "ef_construction": self.ef_construction,
+                       "ef_search": self.ef_search, "seed": self.seed, "ntotal": self.ntotal,
+                       "entry_point": self.entry_point, "max_level": self.max_level}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        with open(os.path.join(path, "hnsw.json")) as f:
+            config = json.load(f)
+        mmap_mode = "r" if mmap else None
+        index = cls(config["dim"], num_neighbors=config["num_neighbors"], ef_construction=config["ef_construction"],
+                    ef_search=config["ef_search"], seed=config["seed"])
+        # Vectors and links stay mapped until `add` copies them into growable arrays
+        index.vectors = np.load(os.path.join(path, "hnsw_vectors.npy"), mmap_mode=mmap_mode)
+        index.links = np.load(os.path.join(path, "hnsw_links.npy"), mmap_mode=mmap_mode)
+        index.levels = np.load(os.path.join(path, "hnsw_levels.npy"))
+        nodes = np.load(os.path.join(path, "hnsw_upper_nodes.npy"))
+        node_levels = np.load(os.path.join(path, "hnsw_upper_levels.npy"))
+        offsets = np.load(os.path.join(path, "hnsw_upper_offsets.npy"))
+        upper_ids = np.load(os.path.join(path, "hnsw_upper_ids.npy"))
+        index.upper_links = [{} for _ in range(max(config["max_level"], 0))]
+        for i, (node, level) in enumerate(zip(nodes.tolist(), node_levels.tolist())):
+            index.upper_links[level - 1][node] = upper_ids[offsets[i]:offsets[i + 1]]
+        index.ntotal = config["ntotal"]
+        index.entry_point = config["entry_point"]
+        index.max_level = config["max_level"]
+        return index
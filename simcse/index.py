@@ -0,0 +1,193 @@
+import os
+import struct
+import numpy as np
+from typing import Iterable, List, Tuple, Union
+
+SENTENCES_FILE = "sentences.bin"
+SENTENCE_OFFSETS_FILE = "sentence_offsets.npy"
+
+
+class SentenceStore(object):
+    """
+    A list-like, read-only view over sentences stored as one UTF-8 blob plus an offset array,
+    so that opening a large index only maps the files instead of building Python strings.
+    Sentences appended with `+=` (e.g., by `SimCSE.add_to_index`) are kept in memory.
+    """
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.extra = []
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        offsets = np.load(os.path.join(path, SENTENCE_OFFSETS_FILE), mmap_mode="r" if mmap else None)
+        blob_path = os.path.join(path, SENTENCES_FILE)
+        if os.path.getsize(blob_path) == 0:
+            blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            blob = np.fromfile(blob_path, dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.extra)
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("sentence index out of range")
+        num_stored = len(self.offsets) - 1
+        if idx >= num_stored:
+            return self.extra[idx - num_stored]
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __iadd__(self, sentences: List[str]):
+        self.extra.extend(sentences)
+        return self
+
+
+def save_sentences(sentences: Iterable[str], path: str):
+    """
+    Write sentences as a UTF-8 blob and an int64 offset array (sentence i is blob[offsets[i]:offsets[i+1]]).
+    """
+    offsets = [0]
+    with open(os.path.join(path, SENTENCES_FILE), "wb") as f:
+        for sentence in sentences:
+            data = sentence.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(path, SENTENCE_OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+
+
+class AppendableNpy(object):
+    """
+    A .npy file that grows along its first axis. The header is written with a fixed size, so the
+    row count can be updated in place after each append and the file stays loadable with
+    `np.load(..., mmap_mode="r")` at every checkpoint.
+    Opening an existing file with `rows` truncates it to that many rows, which drops anything
+    appended after the last checkpoint.
+    """
+    HEADER_SIZE = 128
+
+    def __init__(self, path: str, 
+                dtype: np.dtype, 
+                row_shape: Tuple[int, ...] = (),
+                rows: int = 0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        self.rows = rows
+
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        self.file = open(path, mode)
+        self.file.truncate(self.HEADER_SIZE + self.rows * self.row_bytes)
+        self._write_header()
+        self.file.seek(0, os.SEEK_END)
+
+    def _write_header(self):
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(self.dtype), (self.rows,) + self.row_shape)
+        # magic string (6 bytes) + version (2 bytes) + header length (2 bytes)
+        header = header.ljust(self.HEADER_SIZE - 10 - 1) + "\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+    def append(self, rows: np.ndarray):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        assert rows.shape[1:] == self.row_shape, "expected rows of shape %s, got %s" % (self.row_shape, rows.shape[1:])
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(rows.tobytes())
+        self.rows += rows.shape[0]
+
+    def flush(self):
+        self._write_header()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SentenceWriter(object):
+    """
+    Appends sentences to the blob + offsets layout read by `SentenceStore`, resumable from a
+    checkpointed sentence count.
+    """
+    def __init__(self, path: str, num_sentences: int = 0):
+        blob_path = os.path.join(path, SENTENCES_FILE)
+        # offsets[0] is always 0, which is also what a freshly created (zero-filled) row holds
+        self.offsets = AppendableNpy(os.path.join(path, SENTENCE_OFFSETS_FILE), np.int64, rows=num_sentences + 1)
+        self.offsets.flush()
+        self.end = int(np.load(self.offsets.path, mmap_mode="r")[-1])
+        self.blob = open(blob_path, "r+b" if os.path.exists(blob_path) else "w+b")
+        self.blob.truncate(self.end)
+        self.blob.seek(0, os.SEEK_END)
+
+    def append(self, sentences: List[str]):
+        offsets = []
+        for sentence in sentences:
+            data = sentence.encode("utf-8")
+            self.blob.write(data)
+            self.end += len(data)
+            offsets.append(self.end)
+        self.offsets.append(np.array(offsets, dtype=np.int64))
+
+    def flush(self):
+        self.blob.flush()
+        os.fsync(self.blob.fileno())
+        self.offsets.flush()
+
+    def close(self):
+        self.flush()
+        self.blob.close()
+        self.offsets.close()
+
+
+def topk_inner_product(queries: np.ndarray, 
+                        keys: np.ndarray, 
+                        top_k: int, 
+                        chunk_size: int = 65536):
+    """
+    Exact top-k search by inner product. `keys` is scanned in chunks of `chunk_size` rows, so
+    memory stays at O(num_queries x chunk_size) however large the corpus is (it can be a
+    memory-mapped array). Each chunk is scored with one matmul and reduced with `argpartition`
+    into a running top-k per query.
+    Returns (scores, ids), both of shape (num_queries, min(top_k, num_keys)) and sorted by
+    decreasing score.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    num_queries = queries.shape[0]
+    best_scores = np.zeros((num_queries, 0), dtype=np.float32)
+    best_ids = np.zeros((num_queries, 0), dtype=np.int64)
+
+    for start in range(0, len(keys), chunk_size):
+        chunk = np.asarray(keys[start:start + chunk_size], dtype=np.float32)
+        scores = queries @ chunk.T
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, ids, axis=1)
+        else:
+            ids = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_ids = np.concatenate([best_ids, ids + start], axis=1)
+        if best_scores.shape[1] > top_k:
+            keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
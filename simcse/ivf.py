@@ -0,0 +1,125 @@
+import os
+import json
+import logging
+import numpy as np
+from numpy import ndarray
+from typing import Tuple
+
+from .index import topk_inner_product
+
+logger = logging.getLogger(__name__)
+
+class IVFIndex(object):
+    """
+    An inverted-file index written in NumPy, used for approximate search when faiss is not installed.
+    Vectors are assigned to the closest of `num_cells` centroids found by spherical k-means, and a
+    query only scans the vectors of the `nprobe` cells whose centroids are closest to it.
+    It implements the part of the faiss index API that `SimCSE` uses (`train`, `add`, `search`).
+    """
+    def __init__(self, dim: int,
+                num_cells: int = 100,
+                nprobe: int = 10,
+                seed: int = 0):
+        self.dim = dim
+        self.num_cells = num_cells
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.list_vectors = []
+        self.list_ids = []
+        self.ntotal = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, x: ndarray) -> ndarray:
+        _, cells = topk_inner_product(x, self.centroids, 1)
+        return cells[:, 0]
+
+    def train(self, x: ndarray,
+                num_iters: int = 20,
+                max_points_per_cell: int = 256):
+        x = np.asarray(x, dtype=np.float32)
+        rng = np.random.RandomState(self.seed)
+        self.num_cells = min(self.num_cells, len(x))
+        if len(x) > self.num_cells * max_points_per_cell:
+            x = x[rng.choice(len(x), self.num_cells * max_points_per_cell, replace=False)]
+        logger.info("Training IVF index with %d cells on %d vectors" % (self.num_cells, len(x)))
+
+        centroids = x[rng.choice(len(x), self.num_cells, replace=False)].copy()
+        for _ in range(num_iters):
+            self.centroids = centroids
+            cells = self._assign(x)
+            counts = np.bincount(cells, minlength=self.num_cells)
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums[nonempty] = np.add.reduceat(x[np.argsort(cells, kind="stable")], starts[nonempty], axis=0)
+            # Re-seed empty cells with random points
+            empty = counts == 0
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        self.centroids = centroids.astype(np.float32)
+        self.list_vectors = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(self.num_cells)]
+        self.list_ids = [np.zeros(0, dtype=np.int64) for _ in range(self.num_cells)]
+
+    def add(self, x: ndarray):
+        assert self.is_trained, "train the index before adding vectors"
+        x = np.asarray(x, dtype=np.float32)
+        ids = np.arange(self.ntotal, self.ntotal + len(x), dtype=np.int64)
+        cells = self._assign(x)
+        for cell in np.unique(cells):
+            members = cells == cell
+            self.list_vectors[cell] = np.concatenate([self.list_vectors[cell], x[members]])
+            self.list_ids[cell] = np.concatenate([self.list_ids[cell], ids[members]])
+        self.ntotal += len(x)
+
+    def search(self, queries: ndarray, top_k: int) -> Tuple[ndarray, ndarray]:
+        """
+        Returns (scores, ids) of shape (num_queries, top_k), padded with -inf / -1 like faiss.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(self.nprobe, self.num_cells)
+        _, probes = topk_inner_product(queries, self.centroids, nprobe)
+
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            vectors = np.concatenate([self.list_vectors[cell] for cell in probes[i]])
+            if len(vectors) == 0:
+                continue
+            candidate_ids = np.concatenate([self.list_ids[cell] for cell in probes[i]])
+            top_scores, top = topk_inner_product(query[None], vectors, top_k)
+            scores[i, :top.shape[1]] = top_scores[0]
+            ids[i, :top.shape[1]] = candidate_ids[top[0]]
+        return scores, ids
+
+    def save(self, path: str):
+        """
+        Store the inverted lists back to back (`ivf_vectors.npy`, `ivf_ids.npy`) with per-cell offsets,
+        so that `load` can memory-map them.
+        """
+        sizes = [len(ids) for ids in self.list_ids]
+        np.save(os.path.join(path, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "ivf_vectors.npy"), np.concatenate(self.list_vectors) if self.ntotal > 0 else np.zeros((0, self.dim), dtype=np.float32))
+        np.save(os.path.join(path, "ivf_ids.npy"), np.concatenate(self.list_ids) if self.ntotal > 0 else np.zeros(0, dtype=np.int64))
+        np.save(os.path.join(path, "ivf_list_offsets.npy"), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+        with open(os.path.join(path, "ivf.json"), "w") as f:
+            json.dump({"dim": self.dim, "num_cells": self.num_cells, "nprobe": self.nprobe, "seed": self.seed, "ntotal": self.ntotal}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        with open(os.path.join(path, "ivf.json")) as f:
+            config = json.load(f)
+        mmap_mode = "r" if mmap else None
+        index = cls(config["dim"], num_cells=config["num_cells"], nprobe=config["nprobe"], seed=config["seed"])
+        index.centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+        vectors = np.load(os.path.join(path, "ivf_vectors.npy"), mmap_mode=mmap_mode)
+        ids = np.load(os.path.join(path, "ivf_ids.npy"), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(path, "ivf_list_offsets.npy"))
+        # Lists are views into the mapped files until `add` appends to them
+        index.list_vectors = [vectors[offsets[c]:offsets[c + 1]] for c in range(index.num_cells)]
+        index.list_ids = [ids[offsets[c]:offsets[c + 1]] for c in range(index.num_cells)]
+        index.ntotal = config["ntotal"]
+        return index
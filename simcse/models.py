@@ -1,4 +1,5 @@
 import pdb
+import copy
 
 import torch
 import torch.nn as nn
@@ -18,6 +19,11 @@ from transformers.file_utils import (
 )
 from transformers.modeling_outputs import SequenceClassifierOutput, BaseModelOutputWithPoolingAndCrossAttentions
 
+from .gather import gather_views
+from .packing import packed_encode
+from .capture import LayerCapture, POOLER_HIDDEN_STATES
+from .frozen import freeze_bottom_layers, frozen_encode
+
 class MLPLayer(nn.Module):
     """
     Head for getting sentence representations over RoBERTa/BERT's CLS representation.
@@ -47,6 +53,16 @@ class Similarity(nn.Module):
     def forward(self, x, y):
         return self.cos(x, y) / self.temp
 
+    def pairwise(self, x, y):
+        """
+        Similarity of every row of x (n, hidden) with every row of y (m, hidden), as an (n, m) matrix.
+        Same as forward(x.unsqueeze(1), y.unsqueeze(0)), but normalizes each row once and uses a single
+        matmul instead of materializing an (n, m, hidden) tensor.
+        """
+        x = F.normalize(x, dim=-1, eps=self.cos.eps)
+        y = F.normalize(y, dim=-1, eps=self.cos.eps)
+        return torch.matmul(x, y.t()) / self.temp
+
 
 class Pooler(nn.Module):
     """
@@ -56,16 +72,19 @@ class Pooler(nn.Module):
     'avg': average of the last layers' hidden states at each token.
     'avg_top2': average of the last two layers.
     'avg_first_last': average of the first and the last layers.
+    The layers the averaging poolers need are listed in `hidden_state_indices`; pass them as
+    `hidden_states` (e.g., a `LayerCapture`) instead of running the encoder with `output_hidden_states`.
     """
     def __init__(self, pooler_type):
         super().__init__()
         self.pooler_type = pooler_type
         assert self.pooler_type in ["cls", "cls_before_pooler", "avg", "avg_top2", "avg_first_last"], "unrecognized pooling type %s" % self.pooler_type
+        self.hidden_state_indices = POOLER_HIDDEN_STATES.get(pooler_type, ())
 
-    def forward(self, attention_mask, outputs):
+    def forward(self, attention_mask, outputs, hidden_states=None):
         last_hidden = outputs.last_hidden_state
         pooler_output = outputs.pooler_output
-        hidden_states = outputs.hidden_states
+        hidden_states = outputs.hidden_states if hidden_states is None else hidden_states
 
         if self.pooler_type in ['cls_before_pooler', 'cls']:
             return last_hidden[:, 0]
@@ -96,7 +115,88 @@ def cl_init(cls, config):
     cls.sim = Similarity(temp=cls.model_args.temp)
     cls.init_weights()
 
-def cl_forward(cls,
+    # (size, weight) of every embedding prefix the contrastive loss is computed on, the full size last
+    cls.matryoshka = [(config.hidden_size, 1.0)]
+    if getattr(cls.model_args, "matryoshka_dims", None):
+        dims = [int(d) for d in cls.model_args.matryoshka_dims.split(",")]
+        weights = [float(w) for w in cls.model_args.matryoshka_weights.split(",")] if getattr(cls.model_args, "matryoshka_weights", None) else [1.0] * len(dims)
+        if len(weights) != len(dims):
+            raise ValueError("matryoshka_weights needs one weight per entry of matryoshka_dims.")
+        if any(d <= 0 or d > config.hidden_size for d in dims):
+            raise ValueError(f"matryoshka_dims must be between 1 and the hidden size ({config.hidden_size}).")
+        prefixes = dict(cls.matryoshka)
+        prefixes.update(zip(dims, weights))
+        cls.matryoshka = sorted(prefixes.items())
+
+    queue_size = getattr(cls.model_args, "queue_size", 0)
+    if queue_size > 0:
+        # FIFO queue of detached embeddings from previous steps, used as extra negatives
+        cls.register_buffer("queue", torch.zeros(queue_size, config.hidden_size), persistent=False)
+        cls.queue_ptr = 0
+        cls.queue_len = 0
+        if getattr(cls.model_args, "momentum", 0.0) > 0:
+            # Momentum copy of the encoder (and MLP) producing the queued embeddings. Pretrained
+            # weights are loaded after __init__, so it is synced with the encoder at the first step.
+            cls.momentum_encoder = copy.deepcopy(cls.base_model).requires_grad_(False)
+            if cls.pooler_type == "cls":
+                cls.momentum_mlp = copy.deepcopy(cls.mlp).requires_grad_(False)
+            cls.momentum_synced = False
+            # Like the queue, the copy is training state only: keep it out of the state dict so that
+            # checkpoints hold one encoder and load into a plain model without unexpected keys
+            cls._register_state_dict_hook(drop_momentum_weights)
+
+    if getattr(cls.model_args, "activation_checkpointing", False):
+        # Recompute each encoder layer in backward instead of storing its activations. The checkpoint
+        # restores the RNG state for the recompute, so the dropout masks (the augmentation of
+        # unsupervised SimCSE) are the same as in the forward pass. Set after the momentum copy,
+        # which runs without gradients and has no use for it.
+        cls.config.gradient_checkpointing = True
+
+    num_frozen = getattr(cls.model_args, "freeze_layers", 0)
+    if num_frozen > 0:
+        num_layers = config.num_hidden_layers
+        if num_frozen >= num_layers:
+            raise ValueError(f"freeze_layers ({num_frozen}) must be smaller than the number of layers ({num_layers}).")
+        if getattr(cls.model_args, "pack_sequences", False):
+            raise NotImplementedError("Frozen layers are not supported with packed sequences.")
+        if any(i % (num_layers + 1) < num_frozen for i in cls.pooler.hidden_state_indices):
+            raise ValueError(f"The {cls.pooler_type} pooler averages the output of a frozen layer; freeze fewer layers.")
+        # The training script attaches a FrozenLayerCache of the frozen outputs as `frozen_cache`
+        freeze_bottom_layers(cls.base_model, num_frozen)
+
+
+def drop_momentum_weights(module, state_dict, prefix, local_metadata):
+    for key in [k for k in state_dict if k.startswith(prefix + "momentum_")]:
+        del state_dict[key]
+
+
+@torch.no_grad()
+def cl_momentum_update(cls):
+    """
+    Update the momentum encoder as m * momentum_encoder + (1 - m) * encoder (copy it on the first call).
+    """
+    m = 0.0 if not cls.momentum_synced else cls.model_args.momentum
+    pairs = list(zip(cls.momentum_encoder.parameters(), cls.base_model.parameters()))
+    if cls.pooler_type == "cls":
+        pairs += list(zip(cls.momentum_mlp.parameters(), cls.mlp.parameters()))
+    for key_param, param in pairs:
+        key_param.mul_(m).add_(param.detach(), alpha=1.0 - m)
+    cls.momentum_synced = True
+
+
+@torch.no_grad()
+def cl_enqueue(cls, keys):
+    """
+    Write (n, hidden) embeddings into the queue, overwriting the oldest entries.
+    """
+    queue_size = cls.queue.size(0)
+    keys = keys.detach()[-queue_size:]
+    idx = (cls.queue_ptr + torch.arange(keys.size(0), device=cls.queue.device)) % queue_size
+    cls.queue[idx] = keys.to(cls.queue.dtype)
+    cls.queue_ptr = (cls.queue_ptr + keys.size(0)) % queue_size
+    cls.queue_len = min(cls.queue_len + keys.size(0), queue_size)
+
+def cl_embed(cls,
     encoder,
     input_ids=None,
     attention_mask=None,
@@ -104,64 +204,79 @@ def cl_forward(cls,
     position_ids=None,
     head_mask=None,
     inputs_embeds=None,
-    labels=None,
     output_attentions=None,
-    output_hidden_states=None,
-    return_dict=None,
-    mlm_input_ids=None,
-    mlm_labels=None,
+    mlp=None,
+    sent_ids=None,
 ):
-
-    return_dict = return_dict if return_dict is not None else cls.config.use_return_dict
-    ori_input_ids = input_ids
+    """
+    Encode (bs, num_sent, len) inputs into (bs, num_sent, hidden) sentence representations for the
+    contrastive loss. Returns the representations and the raw encoder outputs. `mlp` replaces
+    `cls.mlp` (used for the momentum encoder). `sent_ids` (bs, num_sent) number the training
+    sentences for the cache of frozen layer outputs.
+    """
     batch_size = input_ids.size(0)
     # Number of sentences in one instance
     # 2: pair instance; 3: pair instance with a hard negative
     num_sent = input_ids.size(1)
 
-    mlm_outputs = None
     # Flatten input for encoding
     input_ids = input_ids.view((-1, input_ids.size(-1))) # (bs * num_sent, len)
     attention_mask = attention_mask.view((-1, attention_mask.size(-1))) # (bs * num_sent len)
     if token_type_ids is not None:
         token_type_ids = token_type_ids.view((-1, token_type_ids.size(-1))) # (bs * num_sent, len)
 
-    # Get raw embeddings
-    outputs = encoder(
-        input_ids,
-        attention_mask=attention_mask,
-        token_type_ids=token_type_ids,
-        position_ids=position_ids,
-        head_mask=head_mask,
-        inputs_embeds=inputs_embeds,
-        output_attentions=output_attentions,
-        output_hidden_states=True if cls.model_args.pooler_type in ['avg_top2', 'avg_first_last'] else False,
-        return_dict=True,
-    )
-
-    # MLM auxiliary objective
-    if mlm_input_ids is not None:
-        mlm_input_ids = mlm_input_ids.view((-1, mlm_input_ids.size(-1)))
-        mlm_outputs = encoder(
-            mlm_input_ids,
-            attention_mask=attention_mask,
-            token_type_ids=token_type_ids,
-            position_ids=position_ids,
-            head_mask=head_mask,
-            inputs_embeds=inputs_embeds,
-            output_attentions=output_attentions,
-            output_hidden_states=True if cls.model_args.pooler_type in ['avg_top2', 'avg_first_last'] else False,
-            return_dict=True,
-        )
+    # Get raw embeddings, keeping only the intermediate layers the pooler needs
+    num_frozen = getattr(cls.model_args, "freeze_layers", 0)
+    with LayerCapture(encoder, cls.pooler.hidden_state_indices) as hidden_states:
+        if num_frozen > 0 and encoder is cls.base_model and position_ids is None and inputs_embeds is None and not output_attentions:
+            # Bottom layers without autograd, or from the cache of their outputs
+            outputs = frozen_encode(encoder, num_frozen, input_ids, attention_mask,
+                token_type_ids=token_type_ids,
+                sent_ids=sent_ids.view(-1) if sent_ids is not None else None,
+                cache=getattr(cls, "frozen_cache", None) if cls.training else None,
+                capture=hidden_states,
+            )
+        elif getattr(cls.model_args, "pack_sequences", False) and position_ids is None and inputs_embeds is None and not output_attentions:
+            # Several sentences per row with block-diagonal attention, to skip the padding
+            outputs = packed_encode(encoder, input_ids, attention_mask,
+                token_type_ids=token_type_ids,
+                head_mask=head_mask,
+                capture=hidden_states,
+            )
+        else:
+            outputs = encoder(
+                input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+                position_ids=position_ids,
+                head_mask=head_mask,
+                inputs_embeds=inputs_embeds,
+                output_attentions=output_attentions,
+                return_dict=True,
+            )
 
     # Pooling
-    pooler_output = cls.pooler(attention_mask, outputs)
+    pooler_output = cls.pooler(attention_mask, outputs, hidden_states=hidden_states)
     pooler_output = pooler_output.view((batch_size, num_sent, pooler_output.size(-1))) # (bs, num_sent, hidden)
 
     # If using "cls", we add an extra MLP layer
     # (same as BERT's original implementation) over the representation.
     if cls.pooler_type == "cls":
-        pooler_output = cls.mlp(pooler_output)
+        pooler_output = (cls.mlp if mlp is None else mlp)(pooler_output)
+
+    return pooler_output, outputs
+
+
+def cl_loss(cls, pooler_output, keys=None):
+    """
+    Contrastive loss over (bs, num_sent, hidden) representations, with the in-batch negatives of all
+    processes in distributed training and, with `queue_size`, the queued negatives of previous steps.
+    With `matryoshka_dims`, the weighted sum of the losses on each embedding prefix and the full one.
+    Returns the loss and the (bs, num_negatives) logits of the full embeddings. The queue is then
+    filled with `keys` (the momentum encoder's (bs, hidden) embeddings of the positives) or the
+    positives themselves.
+    """
+    num_sent = pooler_output.size(1)
 
     # Separate representation
     z1, z2 = pooler_output[:,0], pooler_output[:,1]
@@ -172,54 +287,130 @@ def cl_forward(cls,
 
     # Gather all embeddings if using distributed training
     if dist.is_initialized() and cls.training:
-        # Gather hard negative
-        if num_sent >= 3:
-            z3_list = [torch.zeros_like(z3) for _ in range(dist.get_world_size())]
-            dist.all_gather(tensor_list=z3_list, tensor=z3.contiguous())
-            z3_list[dist.get_rank()] = z3
-            z3 = torch.cat(z3_list, 0)
-
-        # Dummy vectors for allgather
-        z1_list = [torch.zeros_like(z1) for _ in range(dist.get_world_size())]
-        z2_list = [torch.zeros_like(z2) for _ in range(dist.get_world_size())]
-        # Allgather
-        dist.all_gather(tensor_list=z1_list, tensor=z1.contiguous())
-        dist.all_gather(tensor_list=z2_list, tensor=z2.contiguous())
-
-        # Since allgather results do not have gradients, we replace the
-        # current process's corresponding embeddings with original tensors
-        z1_list[dist.get_rank()] = z1
-        z2_list[dist.get_rank()] = z2
+        # One collective for all views; gradients flow back to the rank that produced each slice.
         # Get full batch embeddings: (bs x N, hidden)
-        z1 = torch.cat(z1_list, 0)
-        z2 = torch.cat(z2_list, 0)
+        if num_sent >= 3:
+            z1, z2, z3 = gather_views(z1, z2, z3)
+        else:
+            z1, z2 = gather_views(z1, z2)
 
-    cos_sim = cls.sim(z1.unsqueeze(1), z2.unsqueeze(0))
     # Hard negative
-
     if num_sent >= 3:
-        z1_z3_cos = cls.sim(z1.unsqueeze(1), z3.unsqueeze(0))
-        cos_sim = torch.cat([cos_sim, z1_z3_cos], 1)
+        # In-batch and hard-negative logits side by side, from one matmul over [z2; z3]
+        candidates = torch.cat([z2, z3], 0)
+    else:
+        candidates = z2
 
-    labels = torch.arange(cos_sim.size(0)).long().to(cls.device)
+    labels = torch.arange(z1.size(0)).long().to(cls.device)
     loss_fct = nn.CrossEntropyLoss()
 
     # Calculate loss with hard negatives
+    weights = None
     if num_sent == 3:
         # Note that weights are actually logits of weights
         z3_weight = cls.model_args.hard_negative_weight
         weights = torch.tensor(
-            [[0.0] * (cos_sim.size(-1) - z1_z3_cos.size(-1)) + [0.0] * i + [z3_weight] + [0.0] * (z1_z3_cos.size(-1) - i - 1) for i in range(z1_z3_cos.size(-1))]
+            [[0.0] * z2.size(0) + [0.0] * i + [z3_weight] + [0.0] * (z3.size(0) - i - 1) for i in range(z3.size(0))]
         ).to(cls.device)
-        cos_sim = cos_sim + weights
 
-    loss = loss_fct(cos_sim, labels)
+    use_queue = getattr(cls.model_args, "queue_size", 0) > 0 and cls.training
+    queue = cls.queue[:cls.queue_len] if use_queue and cls.queue_len > 0 else None
+
+    loss = 0.0
+    for dim, dim_weight in getattr(cls, "matryoshka", [(None, 1.0)]):
+        # Cosine similarities of the first `dim` coordinates
+        cos_sim = cls.sim.pairwise(z1[:, :dim], candidates[:, :dim])
+        if weights is not None:
+            cos_sim = cos_sim + weights
+        if queue is not None:
+            # Queued negatives as extra columns
+            cos_sim = torch.cat([cos_sim, cls.sim.pairwise(z1[:, :dim], queue[:, :dim]).to(cos_sim.dtype)], 1)
+        loss = loss + dim_weight * loss_fct(cos_sim, labels)
+
+    if use_queue:
+        if keys is None:
+            keys = z2
+        elif dist.is_initialized():
+            keys = gather_views(keys)[0]
+        cl_enqueue(cls, keys)
+    return loss, cos_sim
+
+
+def cl_forward(cls,
+    encoder,
+    input_ids=None,
+    attention_mask=None,
+    token_type_ids=None,
+    position_ids=None,
+    head_mask=None,
+    inputs_embeds=None,
+    labels=None,
+    output_attentions=None,
+    output_hidden_states=None,
+    return_dict=None,
+    mlm_input_ids=None,
+    mlm_labels=None,
+    sent_ids=None,
+):
+
+    return_dict = return_dict if return_dict is not None else cls.config.use_return_dict
+
+    pooler_output, outputs = cl_embed(cls, encoder,
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        token_type_ids=token_type_ids,
+        position_ids=position_ids,
+        head_mask=head_mask,
+        inputs_embeds=inputs_embeds,
+        output_attentions=output_attentions,
+        sent_ids=sent_ids,
+    )
+
+    # MLM auxiliary objective
+    mlm_outputs = None
+    if mlm_input_ids is not None and getattr(cls.model_args, "freeze_layers", 0) > 0:
+        # Masked inputs differ every epoch, so the frozen part is recomputed (without autograd)
+        mlm_outputs = frozen_encode(encoder, cls.model_args.freeze_layers,
+            mlm_input_ids.view((-1, mlm_input_ids.size(-1))),
+            attention_mask.view((-1, attention_mask.size(-1))),
+            token_type_ids=token_type_ids.view((-1, token_type_ids.size(-1))) if token_type_ids is not None else None,
+        )
+    elif mlm_input_ids is not None:
+        mlm_input_ids = mlm_input_ids.view((-1, mlm_input_ids.size(-1)))
+        mlm_outputs = encoder(
+            mlm_input_ids,
+            attention_mask=attention_mask.view((-1, attention_mask.size(-1))),
+            token_type_ids=token_type_ids.view((-1, token_type_ids.size(-1))) if token_type_ids is not None else None,
+            position_ids=position_ids,
+            head_mask=head_mask,
+            inputs_embeds=inputs_embeds,
+            output_attentions=output_attentions,
+            return_dict=True,
+        )
+
+    # Queue embeddings from the momentum encoder
+    keys = None
+    if getattr(cls.model_args, "momentum", 0.0) > 0 and getattr(cls.model_args, "queue_size", 0) > 0 and cls.training:
+        cl_momentum_update(cls)
+        with torch.no_grad():
+            keys = cl_embed(cls, cls.momentum_encoder,
+                input_ids=input_ids[:, 1:2],
+                attention_mask=attention_mask[:, 1:2],
+                token_type_ids=token_type_ids[:, 1:2] if token_type_ids is not None else None,
+                mlp=getattr(cls, "momentum_mlp", None),
+            )[0][:, 0]
+
+    loss, cos_sim = cl_loss(cls, pooler_output, keys=keys)
 
     # Calculate loss for MLM
     if mlm_outputs is not None and mlm_labels is not None:
-        mlm_labels = mlm_labels.view(-1, mlm_labels.size(-1))
-        prediction_scores = cls.lm_head(mlm_outputs.last_hidden_state)
-        masked_lm_loss = loss_fct(prediction_scores.view(-1, cls.config.vocab_size), mlm_labels.view(-1))
+        loss_fct = nn.CrossEntropyLoss()
+        mlm_labels = mlm_labels.view(-1)
+        # Run the LM head only on the positions that have a label (others are ignored by the loss anyway)
+        masked = mlm_labels != -100
+        sequence_output = mlm_outputs.last_hidden_state.reshape(-1, mlm_outputs.last_hidden_state.size(-1))[masked]
+        prediction_scores = cls.lm_head(sequence_output)
+        masked_lm_loss = loss_fct(prediction_scores, mlm_labels[masked])
         loss = loss + cls.model_args.mlm_weight * masked_lm_loss
 
     if not return_dict:
@@ -250,19 +441,20 @@ def sentemb_forward(
 
     return_dict = return_dict if return_dict is not None else cls.config.use_return_dict
 
-    outputs = encoder(
-        input_ids,
-        attention_mask=attention_mask,
-        token_type_ids=token_type_ids,
-        position_ids=position_ids,
-        head_mask=head_mask,
-        inputs_embeds=inputs_embeds,
-        output_attentions=output_attentions,
-        output_hidden_states=True if cls.pooler_type in ['avg_top2', 'avg_first_last'] else False,
-        return_dict=True,
-    )
+    with LayerCapture(encoder, cls.pooler.hidden_state_indices) as hidden_states:
+        outputs = encoder(
+            input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            position_ids=position_ids,
+            head_mask=head_mask,
+            inputs_embeds=inputs_embeds,
+            output_attentions=output_attentions,
+            output_hidden_states=output_hidden_states,
+            return_dict=True,
+        )
 
-    pooler_output = cls.pooler(attention_mask, outputs)
+    pooler_output = cls.pooler(attention_mask, outputs, hidden_states=hidden_states)
     if cls.pooler_type == "cls" and not cls.model_args.mlp_only_train:
         pooler_output = cls.mlp(pooler_output)
 
@@ -277,7 +469,7 @@ def sentemb_forward(
 
 
 class BertForCL(BertPreTrainedModel):
-    _keys_to_ignore_on_load_missing = [r"position_ids"]
+    _keys_to_ignore_on_load_missing = [r"position_ids", r"momentum_"]
 
     def __init__(self, config, *model_args, **model_kargs):
         super().__init__(config)
@@ -303,7 +495,21 @@ class BertForCL(BertPreTrainedModel):
         sent_emb=False,
         mlm_input_ids=None,
         mlm_labels=None,
+        embed_only=False,
+        sent_ids=None,
     ):
+        if embed_only:
+            # Only the (bs, num_sent, hidden) representations, e.g. for gradient caching
+            return cl_embed(self, self.bert,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+                position_ids=position_ids,
+                head_mask=head_mask,
+                inputs_embeds=inputs_embeds,
+                output_attentions=output_attentions,
+                sent_ids=sent_ids,
+            )[0]
         if sent_emb:
             return sentemb_forward(self, self.bert,
                 input_ids=input_ids,
@@ -331,12 +537,13 @@ class BertForCL(BertPreTrainedModel):
                 return_dict=return_dict,
                 mlm_input_ids=mlm_input_ids,
                 mlm_labels=mlm_labels,
+                sent_ids=sent_ids,
             )
 
 
 
 class RobertaForCL(RobertaPreTrainedModel):
-    _keys_to_ignore_on_load_missing = [r"position_ids"]
+    _keys_to_ignore_on_load_missing = [r"position_ids", r"momentum_"]
 
     def __init__(self, config, *model_args, **model_kargs):
         super().__init__(config)
@@ -362,7 +569,21 @@ class RobertaForCL(RobertaPreTrainedModel):
         sent_emb=False,
         mlm_input_ids=None,
         mlm_labels=None,
+        embed_only=False,
+        sent_ids=None,
     ):
+        if embed_only:
+            # Only the (bs, num_sent, hidden) representations, e.g. for gradient caching
+            return cl_embed(self, self.roberta,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+                position_ids=position_ids,
+                head_mask=head_mask,
+                inputs_embeds=inputs_embeds,
+                output_attentions=output_attentions,
+                sent_ids=sent_ids,
+            )[0]
         if sent_emb:
             return sentemb_forward(self, self.roberta,
                 input_ids=input_ids,
@@ -390,4 +611,5 @@ class RobertaForCL(RobertaPreTrainedModel):
                 return_dict=return_dict,
                 mlm_input_ids=mlm_input_ids,
                 mlm_labels=mlm_labels,
+                sent_ids=sent_ids,
             )
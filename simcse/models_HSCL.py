@@ -18,6 +18,8 @@ from transformers.file_utils import (
 )
 from transformers.modeling_outputs import SequenceClassifierOutput, BaseModelOutputWithPoolingAndCrossAttentions
 
+from .gather import gather_views
+
 class MLPLayer(nn.Module):
     """
     Head for getting sentence representations over RoBERTa/BERT's CLS representation.
@@ -47,6 +49,16 @@ class Similarity(nn.Module):
     def forward(self, x, y):
         return self.cos(x, y) / self.temp
 
+    def pairwise(self, x, y):
+        """
+        Similarity of every row of x (n, hidden) with every row of y (m, hidden), as an (n, m) matrix.
+        Same as forward(x.unsqueeze(1), y.unsqueeze(0)), but normalizes each row once and uses a single
+        matmul instead of materializing an (n, m, hidden) tensor.
+        """
+        x = F.normalize(x, dim=-1, eps=self.cos.eps)
+        y = F.normalize(y, dim=-1, eps=self.cos.eps)
+        return torch.matmul(x, y.t()) / self.temp
+
 
 class Pooler(nn.Module):
     """
@@ -171,29 +183,14 @@ def cl_forward(cls,
 
     # Gather all embeddings if using distributed training
     if dist.is_initialized() and cls.training:
-        # Gather hard negative
-        if num_sent >= 3:
-            z3_list = [torch.zeros_like(z3) for _ in range(dist.get_world_size())]
-            dist.all_gather(tensor_list=z3_list, tensor=z3.contiguous())
-            z3_list[dist.get_rank()] = z3
-            z3 = torch.cat(z3_list, 0)
-
-        # Dummy vectors for allgather
-        z1_list = [torch.zeros_like(z1) for _ in range(dist.get_world_size())]
-        z2_list = [torch.zeros_like(z2) for _ in range(dist.get_world_size())]
-        # Allgather
-        dist.all_gather(tensor_list=z1_list, tensor=z1.contiguous())
-        dist.all_gather(tensor_list=z2_list, tensor=z2.contiguous())
-
-        # Since allgather results do not have gradients, we replace the
-        # current process's corresponding embeddings with original tensors
-        z1_list[dist.get_rank()] = z1
-        z2_list[dist.get_rank()] = z2
+        # One collective for all views; gradients flow back to the rank that produced each slice.
         # Get full batch embeddings: (bs x N, hidden)
-        z1 = torch.cat(z1_list, 0)
-        z2 = torch.cat(z2_list, 0)
+        if num_sent >= 3:
+            z1, z2, z3 = gather_views(z1, z2, z3)
+        else:
+            z1, z2 = gather_views(z1, z2)
 
-    cos_sim = cls.sim(z1.unsqueeze(1), z2.unsqueeze(0))
+    cos_sim = cls.sim.pairwise(z1, z2)
     # Hard negative
     if num_sent >= 3:
 
@@ -215,9 +212,12 @@ def cl_forward(cls,
 
     # Calculate loss for MLM
     if mlm_outputs is not None and mlm_labels is not None:
-        mlm_labels = mlm_labels.view(-1, mlm_labels.size(-1))
-        prediction_scores = cls.lm_head(mlm_outputs.last_hidden_state)
-        masked_lm_loss = loss_fct(prediction_scores.view(-1, cls.config.vocab_size), mlm_labels.view(-1))
+        mlm_labels = mlm_labels.view(-1)
+        # Run the LM head only on the positions that have a label (others are ignored by the loss anyway)
+        masked = mlm_labels != -100
+        sequence_output = mlm_outputs.last_hidden_state.reshape(-1, mlm_outputs.last_hidden_state.size(-1))[masked]
+        prediction_scores = cls.lm_head(sequence_output)
+        masked_lm_loss = loss_fct(prediction_scores, mlm_labels[masked])
         loss = loss + cls.model_args.mlm_weight * masked_lm_loss
 
     if not return_dict:
@@ -18,6 +18,8 @@ from transformers.file_utils import (
 )
 from transformers.modeling_outputs import SequenceClassifierOutput, BaseModelOutputWithPoolingAndCrossAttentions
 
+from .gather import gather_views
+
 class MLPLayer(nn.Module):
     """
     Head for getting sentence representations over RoBERTa/BERT's CLS representation.
@@ -47,6 +49,16 @@ class Similarity(nn.Module):
     def forward(self, x, y):
         return self.cos(x, y) / self.temp
 
+    def pairwise(self, x, y):
+        """
+        Similarity of every row of x (n, hidden) with every row of y (m, hidden), as an (n, m) matrix.
+        Same as forward(x.unsqueeze(1), y.unsqueeze(0)), but normalizes each row once and uses a single
+        matmul instead of materializing an (n, m, hidden) tensor.
+        """
+        x = F.normalize(x, dim=-1, eps=self.cos.eps)
+        y = F.normalize(y, dim=-1, eps=self.cos.eps)
+        return torch.matmul(x, y.t()) / self.temp
+
 
 class Pooler(nn.Module):
     """
@@ -173,46 +185,22 @@ def cl_forward(cls,
 
     # Gather all embeddings if using distributed training
     if dist.is_initialized() and cls.training:
-        # Gather hard negative
-        if num_sent >= 3:
-            z3_list = [torch.zeros_like(z3) for _ in range(dist.get_world_size())]
-            dist.all_gather(tensor_list=z3_list, tensor=z3.contiguous())
-            z3_list[dist.get_rank()] = z3
-            z3 = torch.cat(z3_list, 0)
-
-            z4_list = [torch.zeros_like(z4) for _ in range(dist.get_world_size())]
-            dist.all_gather(tensor_list=z4_list, tensor=z4.contiguous())
-            z4_list[dist.get_rank()] = z4
-            z4 = torch.cat(z4_list, 0)
-
-            z5_list = [torch.zeros_like(z5) for _ in range(dist.get_world_size())]
-            dist.all_gather(tensor_list=z5_list, tensor=z5.contiguous())
-            z5_list[dist.get_rank()] = z5
-            z5 = torch.cat(z5_list, 0)
-
-        # Dummy vectors for allgather
-        z1_list = [torch.zeros_like(z1) for _ in range(dist.get_world_size())]
-        z2_list = [torch.zeros_like(z2) for _ in range(dist.get_world_size())]
-        # Allgather
-        dist.all_gather(tensor_list=z1_list, tensor=z1.contiguous())
-        dist.all_gather(tensor_list=z2_list, tensor=z2.contiguous())
-
-        # Since allgather results do not have gradients, we replace the
-        # current process's corresponding embeddings with original tensors
-        z1_list[dist.get_rank()] = z1
-        z2_list[dist.get_rank()] = z2
+        # One collective for all views; gradients flow back to the rank that produced each slice.
         # Get full batch embeddings: (bs x N, hidden)
-        z1 = torch.cat(z1_list, 0)
-        z2 = torch.cat(z2_list, 0)
-
-    cos_sim = cls.sim(z1.unsqueeze(1), z2.unsqueeze(0))
+        if num_sent >= 3:
+            z1, z2, z3, z4, z5 = gather_views(z1, z2, z3, z4, z5)
+        else:
+            z1, z2 = gather_views(z1, z2)
 
     # Hard negative
     if num_sent >= 3:
-        z1_z3_cos = cls.sim(z1.unsqueeze(1), z5.unsqueeze(0))
+        # In-batch and z5 logits side by side, from one matmul over [z2; z5]
+        cos_sim = cls.sim.pairwise(z1, torch.cat([z2, z5], 0))
         z1_z4_cos = cls.sim(z1, z4)
        # z1_z5_cos = cls.sim(z1, z4)
-        cos_sim = torch.cat([cos_sim, z1_z3_cos, z1_z4_cos.unsqueeze(1)], 1)
+        cos_sim = torch.cat([cos_sim, z1_z4_cos.unsqueeze(1)], 1)
+    else:
+        cos_sim = cls.sim.pairwise(z1, z2)
 
     labels = torch.arange(cos_sim.size(0)).long().to(cls.device)
     loss_fct = nn.CrossEntropyLoss()
@@ -222,16 +210,19 @@ def cl_forward(cls,
         # Note that weights are actually logits of weights
         z3_weight = cls.model_args.hard_negative_weight
         weights = torch.tensor(
-            [[0.0] * (cos_sim.size(-1) - z1_z3_cos.size(-1) -1) + [0.0] * i + [z3_weight] + [0.0] * (z1_z3_cos.size(-1) - i - 1) + [z3_weight]  for i in range(z1_z3_cos.size(-1))]
+            [[0.0] * (cos_sim.size(-1) - z5.size(0) -1) + [0.0] * i + [z3_weight] + [0.0] * (z5.size(0) - i - 1) + [z3_weight]  for i in range(z5.size(0))]
         ).to(cls.device)
         cos_sim = cos_sim + weights
     loss = loss_fct(cos_sim, labels)
 
     # Calculate loss for MLM
     if mlm_outputs is not None and mlm_labels is not None:
-        mlm_labels = mlm_labels.view(-1, mlm_labels.size(-1))
-        prediction_scores = cls.lm_head(mlm_outputs.last_hidden_state)
-        masked_lm_loss = loss_fct(prediction_scores.view(-1, cls.config.vocab_size), mlm_labels.view(-1))
+        mlm_labels = mlm_labels.view(-1)
+        # Run the LM head only on the positions that have a label (others are ignored by the loss anyway)
+        masked = mlm_labels != -100
+        sequence_output = mlm_outputs.last_hidden_state.reshape(-1, mlm_outputs.last_hidden_state.size(-1))[masked]
+        prediction_scores = cls.lm_head(sequence_output)
+        masked_lm_loss = loss_fct(prediction_scores, mlm_labels[masked])
         loss = loss + cls.model_args.mlm_weight * masked_lm_loss
 
     if not return_dict:
@@ -0,0 +1,101 @@
+"""
+Packed execution of the contrastive encoder.
+
+`cl_forward` encodes bs x num_sent sentences as one matrix padded to the longest of them, so with short
+summaries next to long source sentences much of the attention and FFN work is spent on padding.
+Here the sentences are packed several to a row (first-fit decreasing, rows as long as the padded
+batch), attention is masked block-diagonally so each sentence only sees its own tokens, and position
+ids restart at every sentence. The token outputs (and any captured layers) are then scattered back to
+the padded layout, so the poolers are unchanged and the representations match the padded computation
+up to float rounding.
+"""
+import numpy as np
+import torch
+from torch import Tensor
+from typing import List, Tuple
+from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
+
+from .capture import LayerCapture
+
+
+def plan_packing(lengths: List[int], capacity: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Assign sentences of the given token `lengths` to rows of `capacity` tokens, first-fit in order of
+    decreasing length. Returns the row and the column offset of every sentence and the number of rows.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rows = np.zeros(len(lengths), dtype=np.int64)
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    free = np.zeros(len(lengths), dtype=np.int64)
+    num_rows = 0
+    for i in np.argsort(-lengths, kind="stable"):
+        fits = np.flatnonzero(free[:num_rows] >= lengths[i])
+        if len(fits) > 0:
+            row = fits[0]
+        else:
+            row = num_rows
+            free[row] = capacity
+            num_rows += 1
+        rows[i] = row
+        offsets[i] = capacity - free[row]
+        free[row] -= lengths[i]
+    return rows, offsets, num_rows
+
+
+def packed_encode(encoder,
+                  input_ids: Tensor,
+                  attention_mask: Tensor,
+                  token_type_ids: Tensor = None,
+                  head_mask: Tensor = None,
+                  capture: LayerCapture = None) -> BaseModelOutputWithPoolingAndCrossAttentions:
+    """
+    Run a BERT/RoBERTa `encoder` on (n, len) padded inputs packed into block-diagonal rows and return
+    `last_hidden_state` in the padded (n, len, hidden) layout, zero at padding. Layers captured by an
+    active `capture` are unpacked to the same layout.
+    """
+    n, seq_len = input_ids.shape
+    device = input_ids.device
+    mask = attention_mask.bool()
+    rows, offsets, num_rows = plan_packing(mask.sum(1).tolist(), seq_len)
+
+    # Where every real token goes: sentence i, token t -> packed row, column
+    sent_idx, tok_idx = mask.nonzero(as_tuple=True)
+    rank = (mask.long().cumsum(1) - 1)[sent_idx, tok_idx]
+    packed_rows = torch.as_tensor(rows, device=device)[sent_idx]
+    packed_cols = torch.as_tensor(offsets, device=device)[sent_idx] + rank
+
+    pad_token_id = encoder.config.pad_token_id if encoder.config.pad_token_id is not None else 0
+    packed_ids = input_ids.new_full((num_rows, seq_len), pad_token_id)
+    packed_ids[packed_rows, packed_cols] = input_ids[sent_idx, tok_idx]
+    packed_token_type_ids = None
+    if token_type_ids is not None:
+        packed_token_type_ids = token_type_ids.new_zeros((num_rows, seq_len))
+        packed_token_type_ids[packed_rows, packed_cols] = token_type_ids[sent_idx, tok_idx]
+
+    # RoBERTa's positions start after the padding index
+    padding_idx = getattr(encoder.embeddings, "padding_idx", None)
+    position_ids = input_ids.new_zeros((num_rows, seq_len))
+    position_ids[packed_rows, packed_cols] = rank + (padding_idx + 1 if padding_idx is not None else 0)
+
+    # Block-diagonal attention: a token attends to the tokens of its own sentence only
+    segments = input_ids.new_zeros((num_rows, seq_len))
+    segments[packed_rows, packed_cols] = sent_idx + 1
+    block_mask = (segments[:, :, None] == segments[:, None, :]) & (segments[:, None, :] > 0)
+
+    outputs = encoder(
+        packed_ids,
+        attention_mask=block_mask.long(),
+        token_type_ids=packed_token_type_ids,
+        position_ids=position_ids,
+        head_mask=head_mask,
+        return_dict=True,
+    )
+
+    def unpack(hidden):
+        padded = hidden.new_zeros((n, seq_len, hidden.size(-1)))
+        padded[sent_idx, tok_idx] = hidden[packed_rows, packed_cols]
+        return padded
+
+    if capture is not None:
+        capture.apply(unpack)
+    return BaseModelOutputWithPoolingAndCrossAttentions(last_hidden_state=unpack(outputs.last_hidden_state))
@@ -0,0 +1,91 @@
+"""
+Multi-process CPU encoding for `SimCSE.encode(..., num_workers=N)`.
+
+The model weights are moved to shared memory once and mapped by every worker instead of being
+copied, and each worker writes its embeddings straight into a shared output tensor at the rows of
+the original input order, so no tensors are pickled on the way back. Workers receive exactly the
+batches that single-process `encode` would run (same rows, same padding), so every row is computed by
+the same forward pass; with the same per-process thread count the result matches single-process
+`encode` bit for bit. (BLAS kernels may reduce in a different order for different thread counts.)
+"""
+import os
+import logging
+import torch
+from torch import Tensor
+from typing import List, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_cpus(rank: int, threads_per_worker: int) -> List[int]:
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    cpus = sorted(os.sched_getaffinity(0))
+    start = rank * threads_per_worker
+    # Only pin when every worker can get its own cores
+    if start + threads_per_worker > len(cpus):
+        return []
+    return cpus[start:start + threads_per_worker]
+
+
+def _encode_worker(rank: int,
+                    model: torch.nn.Module,
+                    tokenizer,
+                    pooler: str,
+                    batches: List[Sequence[int]],
+                    sentences: List[List[str]],
+                    output: Tensor,
+                    threads_per_worker: int,
+                    max_length: int,
+                    normalize_to_unit: bool,
+                    pin: bool):
+    from .tool import SimCSE
+
+    torch.set_num_threads(threads_per_worker)
+    cpus = _worker_cpus(rank, threads_per_worker) if pin else []
+    if len(cpus) > 0:
+        os.sched_setaffinity(0, cpus)
+    with torch.no_grad():
+        for ids, batch in zip(batches, sentences):
+            inputs = tokenizer(batch, padding=True, truncation=True, max_length=max_length, return_tensors="pt")
+            output[torch.as_tensor(list(ids), dtype=torch.long)] = SimCSE._embed_batch(model, pooler, inputs, normalize_to_unit)
+
+
+def encode_in_processes(model: torch.nn.Module,
+                        tokenizer,
+                        pooler: str,
+                        sentences: List[str],
+                        batches: List[Sequence[int]],
+                        num_workers: int,
+                        threads_per_worker: int = None,
+                        max_length: int = 128,
+                        normalize_to_unit: bool = True,
+                        pin: bool = True) -> Tensor:
+    """
+    Run `batches` (lists of row ids into `sentences`) on `num_workers` spawned processes with
+    `threads_per_worker` threads each, pinned to disjoint cores when there are enough of them.
+    Batches are dealt round-robin, which balances the work when they are sorted by length.
+    Returns the (len(sentences), hidden) embeddings in input order.
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    model = model.cpu().eval()
+    model.share_memory()
+    output = torch.zeros(len(sentences), model.config.hidden_size).share_memory_()
+
+    logger.info("Encoding %d sentences with %d workers x %d threads" % (len(sentences), num_workers, threads_per_worker))
+    ctx = torch.multiprocessing.get_context("spawn")
+    processes = []
+    for rank in range(num_workers):
+        shard = batches[rank::num_workers]
+        shard_sentences = [[sentences[i] for i in ids] for ids in shard]
+        p = ctx.Process(target=_encode_worker, args=(rank, model, tokenizer, pooler, [list(ids) for ids in shard], shard_sentences,
+                                                     output, threads_per_worker, max_length, normalize_to_unit, pin))
+        p.start()
+        processes.append(p)
+    for p in processes:
+        p.join()
+    failed = [rank for rank, p in enumerate(processes) if p.exitcode != 0]
+    if len(failed) > 0:
+        raise RuntimeError("Encoding workers %s failed" % failed)
+    return output
@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+from numpy import ndarray
+from typing import Tuple
+
+from .index import AppendableNpy, topk_inner_product
+
+class QuantizedIndex(object):
+    """
+    Brute-force index over compressed vectors: int8 codes with one scale per dimension, or float16.
+    Search scores every vector in compressed form, keeps `rescore_factor * top_k` candidates per
+    query, and rescores them with the full-precision vectors kept in a memory-mapped side file
+    (`full_vectors_path`), which is only touched for those candidates.
+    It implements the part of the faiss index API that `SimCSE` uses (`train`, `add`, `search`).
+    """
+    def __init__(self, full_vectors_path: str,
+                dim: int,
+                quantization: str = "int8",
+                num_full_vectors: int = 0,
+                rescore_factor: int = 4):
+        assert quantization in ["int8", "float16"], "unrecognized quantization %s" % quantization
+        self.dim = dim
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.scales = None
+        self.codes = np.zeros((0, dim), dtype=np.int8 if quantization == "int8" else np.float16)
+        # Only the first `num_full_vectors` rows of an existing side file belong to the index. The file
+        # is opened for writing on the first `add`, so a loaded index can be shared read-only.
+        self.full_vectors_path = full_vectors_path
+        self.num_full_vectors = num_full_vectors
+        self._writer = None
+        self._full_view = None
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.codes)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.quantization == "float16" or self.scales is not None
+
+    def train(self, x: ndarray):
+        if self.quantization == "int8":
+            # Symmetric per-dimension scales; values beyond the training range are clipped
+            self.scales = np.maximum(np.abs(x).max(axis=0), 1e-12).astype(np.float32) / 127.0
+
+    def _quantize(self, x: ndarray) -> ndarray:
+        if self.quantization == "int8":
+            return np.clip(np.rint(x / self.scales), -127, 127).astype(np.int8)
+        return x.astype(np.float16)
+
+    def add(self, x: ndarray):
+        assert self.is_trained, "train the index before adding vectors"
+        x = np.asarray(x, dtype=np.float32)
+        if self._writer is None:
+            self._writer = AppendableNpy(self.full_vectors_path, np.float32, (self.dim,), rows=self.num_full_vectors)
+        self.codes = np.concatenate([self.codes, self._quantize(x)])
+        self._writer.append(x)
+        self._writer.flush()
+        self.num_full_vectors = self._writer.rows
+
+    def add_stored(self, chunk_size: int = 100000):
+        """
+        Quantize the rows already in the side file that have no codes yet (e.g., after a streaming build).
+        """
+        stored = self._full()
+        codes = [self.codes]
+        for start in range(self.ntotal, self.num_full_vectors, chunk_size):
+            codes.append(self._quantize(np.asarray(stored[start:start + chunk_size])))
+        self.codes = np.concatenate(codes)
+
+    def _full(self) -> ndarray:
+        if self._full_view is None or len(self._full_view) != self.num_full_vectors:
+            self._full_view = np.load(self.full_vectors_path, mmap_mode="r")[:self.num_full_vectors]
+        return self._full_view
+
+    def search(self, queries: ndarray, top_k: int, chunk_size: int = 65536) -> Tuple[ndarray, ndarray]:
+        queries = np.asarray(queries, dtype=np.float32)
+        num_candidates = min(self.rescore_factor * top_k, self.ntotal)
+        # (q * s) . c == q . (c * s), so int8 codes are scored without dequantizing them
+        scaled_queries = queries * self.scales if self.quantization == "int8" else queries
+        _, candidates = topk_inner_product(scaled_queries, self.codes, num_candidates, chunk_size=chunk_size)
+
+        # Exact rescoring of the candidates with the full-precision vectors
+        unique_ids, rows = np.unique(candidates, return_inverse=True)
+        full = np.asarray(self._full()[unique_ids], dtype=np.float32)
+        exact = np.einsum("qd,qcd->qc", queries, full[rows.reshape(candidates.shape)])
+        k = min(top_k, num_candidates)
+        order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(exact, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+    def save(self, path: str, final_path: str = None):
+        """
+        Write the index to `path`. When the files are staged there on their way to `final_path`, the
+        side file is not copied if it already is `final_path`'s `embeddings.npy`.
+        """
+        final_path = path if final_path is None else final_path
+        np.save(os.path.join(path, "quantized_codes.npy"), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(path, "quantized_scales.npy"), self.scales)
+        if os.path.abspath(self.full_vectors_path) != os.path.abspath(os.path.join(final_path, "embeddings.npy")):
+            np.save(os.path.join(path, "embeddings.npy"), self._full())
+        with open(os.path.join(path, "quantized.json"), "w") as f:
+            json.dump({"dim": self.dim, "quantization": self.quantization, "rescore_factor": self.rescore_factor}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        with open(os.path.join(path, "quantized.json")) as f:
+            config = json.load(f)
+        codes = np.load(os.path.join(path, "quantized_codes.npy"), mmap_mode="r" if mmap else None)
+        index = cls(os.path.join(path, "embeddings.npy"), config["dim"], quantization=config["quantization"],
+                    num_full_vectors=len(codes), rescore_factor=config["rescore_factor"])
+        index.codes = codes
+        if config["quantization"] == "int8":
+            index.scales = np.load(os.path.join(path, "quantized_scales.npy"))
+        return index
@@ -0,0 +1,348 @@
+"""
+A local HTTP server around `SimCSE` that merges concurrent requests into micro-batches.
+
+    python -m simcse.serve --model_name_or_path princeton-nlp/sup-simcse-bert-base-uncased --index_path my_index/
+
+    POST /encode  {"sentences": ["a man is playing guitar"]}            -> {"embeddings": [[...]]}
+    POST /search  {"queries": ["a man is playing guitar"], "top_k": 5,
+                   "threshold": 0.6}                                    -> {"results": [[["...", 0.83], ...]]}
+    GET  /health                                                        -> queue and batch statistics
+
+Requests wait in a bounded queue; a batch is closed when `max_wait_ms` has passed since its first
+request or when adding the next request would exceed `max_batch_tokens` padded tokens. Each batch is
+encoded with one forward pass (and searched with one call) in a worker thread, while the event loop
+keeps accepting requests. A malformed body or parameter answers 400, a full queue answers 503, and a
+request that is not answered within its deadline (`timeout` in the body, or `--default_timeout`
+seconds) answers 504.
+"""
+import copy
+import json
+import math
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from .tool import SimCSE
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+HTTP_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class ServerError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class PendingRequest(object):
+    def __init__(self, sentences: List[str], num_tokens: int, deadline: float, future: asyncio.Future,
+                search: bool = False, top_k: int = 5, threshold: float = 0.6):
+        self.sentences = sentences
+        self.num_tokens = num_tokens
+        self.max_tokens = max(num_tokens) if len(num_tokens) > 0 else 0
+        self.deadline = deadline
+        self.future = future
+        self.search = search
+        self.top_k = top_k
+        self.threshold = threshold
+
+
+class MicroBatcher(object):
+    """
+    Collects encode / search requests from the event loop into batches and runs them on a single
+    worker thread, so that the model sees one large forward pass instead of many small ones.
+    """
+    def __init__(self, model: SimCSE,
+                max_wait_ms: float = 5.0,
+                max_batch_tokens: int = 8192,
+                max_queue: int = 1024,
+                max_length: int = 128):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Token counting has its own thread and tokenizer copy, so a new request is counted while a
+        # batch is being encoded, without sharing tokenizer state with the encoding thread
+        self.count_executor = ThreadPoolExecutor(max_workers=1)
+        self.count_tokenizer = copy.deepcopy(model.tokenizer)
+        self.stats = {"requests": 0, "batches": 0, "sentences": 0, "rejected": 0, "timed_out": 0}
+        self._carry = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, sentences: List[str], deadline: float, **kwargs) -> asyncio.Future:
+        """
+        Queue a request and return the future of its result; raises `ServerError(503)` when the
+        queue is full and `ServerError(504)` when the deadline passes before the request is queued.
+        """
+        if self.queue.full():
+            self.stats["rejected"] += 1
+            raise ServerError(503, "server is overloaded, retry later")
+        # Token counts decide how requests are batched; counting off the event loop keeps a large
+        # request from stalling it
+        loop = asyncio.get_running_loop()
+        num_tokens = await loop.run_in_executor(self.count_executor, self._count_tokens, sentences)
+        if time.monotonic() >= deadline:
+            self.stats["timed_out"] += 1
+            raise ServerError(504, "deadline exceeded before queueing")
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait(PendingRequest(sentences, num_tokens, deadline, future, **kwargs))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise ServerError(503, "server is overloaded, retry later")
+        self.stats["requests"] += 1
+        return future
+
+    def _count_tokens(self, sentences: List[str]) -> List[int]:
+        return [len(ids) for ids in self.count_tokenizer(sentences, truncation=True, max_length=self.max_length)["input_ids"]]
+
+    def _padded_tokens(self, batch: List[PendingRequest]) -> int:
+        return sum(len(r.sentences) for r in batch) * max(r.max_tokens for r in batch)
+
+    def _expired(self, request: PendingRequest) -> bool:
+        if request.future.done():
+            # The caller gave up (deadline or disconnect)
+            return True
+        if time.monotonic() >= request.deadline:
+            self.stats["timed_out"] += 1
+            request.future.set_exception(ServerError(504, "deadline exceeded before processing"))
+            return True
+        return False
+
+    async def _next_batch(self) -> List[PendingRequest]:
+        first = self._carry
+        self._carry = None
+        while first is None or self._expired(first):
+            first = await self.queue.get()
+        batch = [first]
+        close_at = time.monotonic() + self.max_wait
+        while True:
+            remaining = close_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if self._expired(request):
+                continue
+            if self._padded_tokens(batch + [request]) > self.max_batch_tokens:
+                # Starts the next batch
+                self._carry = request
+                break
+            batch.append(request)
+        return batch
+
+    def _process(self, batch: List[PendingRequest]):
+        sentences = [s for r in batch for s in r.sentences]
+        # A batch fits in `max_batch_tokens` by construction, so this is a single forward pass unless
+        # one request alone exceeds the budget
+        embeddings = self.model.encode(sentences, batch_size=len(sentences), max_length=self.max_length,
+                                       max_tokens=self.max_batch_tokens, normalize_to_unit=True,
+                                       keepdim=True, return_numpy=True)
+        searches = [i for i, r in enumerate(batch) if r.search]
+        search_results = None
+        if len(searches) > 0:
+            # One search with the largest top_k; each request applies its own top_k and threshold
+            offsets = [0]
+            for r in batch:
+                offsets.append(offsets[-1] + len(r.sentences))
+            rows = [row for i in searches for row in range(offsets[i], offsets[i + 1])]
+            top_k = max(batch[i].top_k for i in searches)
+            search_results = self.model.search_vectors(embeddings[rows], threshold=float("-inf"), top_k=top_k)
+
+        outputs = []
+        start, search_start = 0, 0
+        for r in batch:
+            end = start + len(r.sentences)
+            if r.search:
+                results = search_results[search_start:search_start + len(r.sentences)]
+                search_start += len(r.sentences)
+                outputs.append([[pair for pair in result[:r.top_k] if pair[1] >= r.threshold] for result in results])
+            else:
+                outputs.append(embeddings[start:end].tolist())
+            start = end
+        return outputs
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self.stats["batches"] += 1
+            self.stats["sentences"] += sum(len(r.sentences) for r in batch)
+            try:
+                outputs = await loop.run_in_executor(self.executor, self._process, batch)
+            except Exception as e:
+                logger.exception("Batch failed")
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                continue
+            for r, output in zip(batch, outputs):
+                if not r.future.done():
+                    r.future.set_result(output)
+
+
+class Server(object):
+    def __init__(self, batcher: MicroBatcher, default_timeout: float = 10.0):
+        self.batcher = batcher
+        self.default_timeout = default_timeout
+
+    @staticmethod
+    def _number(request: dict, key: str, default, cast):
+        value = request.get(key, default)
+        # JSON booleans are ints in Python, but never a meaningful timeout, top_k or threshold
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ServerError(400, "`%s` must be a number" % key)
+        if cast is int and isinstance(value, float) and not value.is_integer():
+            raise ServerError(400, "`%s` must be an integer" % key)
+        try:
+            return cast(value)
+        except (OverflowError, ValueError):
+            raise ServerError(400, "`%s` must be a finite number" % key)
+
+    async def _handle(self, method: str, path: str, body: bytes):
+        if path == "/health":
+            stats = dict(self.batcher.stats, queued=self.batcher.queue.qsize())
+            return {"status": "ok", "stats": stats}
+        if path not in ["/encode", "/search"]:
+            raise ServerError(404, "unknown path %s" % path)
+        if method != "POST":
+            raise ServerError(405, "use POST")
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            raise ServerError(400, "body is not valid JSON")
+        if not isinstance(request, dict):
+            raise ServerError(400, "body must be a JSON object")
+
+        key = "sentences" if path == "/encode" else "queries"
+        sentences = request.get(key)
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        if not isinstance(sentences, list) or len(sentences) == 0 or not all(isinstance(s, str) for s in sentences):
+            raise ServerError(400, "`%s` must be a non-empty list of strings" % key)
+        timeout = self._number(request, "timeout", self.default_timeout, float)
+        if not (timeout > 0 and math.isfinite(timeout)):
+            raise ServerError(400, "`timeout` must be a positive number of seconds")
+        deadline = time.monotonic() + timeout
+
+        if path == "/search":
+            if self.batcher.model.index is None:
+                raise ServerError(400, "the server was started without an index")
+            top_k = self._number(request, "top_k", 5, int)
+            num_indexed = len(self.batcher.model.index["sentences"])
+            if not 1 <= top_k <= num_indexed:
+                raise ServerError(400, "`top_k` must be between 1 and the index size (%d)" % num_indexed)
+            threshold = self._number(request, "threshold", 0.6, float)
+            future = await self.batcher.submit(sentences, deadline, search=True, top_k=top_k, threshold=threshold)
+        else:
+            future = await self.batcher.submit(sentences, deadline)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.batcher.stats["timed_out"] += 1
+            raise ServerError(504, "deadline exceeded")
+        return {"embeddings": result} if path == "/encode" else {"results": result}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    try:
+                        length = int(headers.get("content-length", 0))
+                    except ValueError:
+                        length = -1
+                    if length < 0:
+                        # The body cannot be framed, so the connection cannot be reused
+                        keep_alive = False
+                        raise ServerError(400, "invalid Content-Length")
+                    if length > MAX_BODY_BYTES:
+                        keep_alive = False
+                        raise ServerError(413, "body larger than %d bytes" % MAX_BODY_BYTES)
+                    body = await reader.readexactly(length) if length > 0 else b""
+                    status, response = 200, await self._handle(method, path.split("?")[0], body)
+                except ServerError as e:
+                    status, response = e.status, {"error": str(e)}
+                except Exception as e:
+                    logger.exception("Request failed")
+                    status, response = 500, {"error": str(e)}
+
+                data = json.dumps(response).encode("utf-8")
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n" % (
+                    status, HTTP_STATUS.get(status, "Internal Server Error"), len(data),
+                    "" if keep_alive else "Connection: close\r\n")).encode("latin1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SimCSE encode / search requests with micro-batching.")
+    parser.add_argument("--model_name_or_path", type=str, required=True)
+    parser.add_argument("--pooler", type=str, default=None)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--index_path", type=str, default=None, help="An index saved with `SimCSE.save_index`")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_wait_ms", type=float, default=5.0, help="Longest time a request waits for others to batch with")
+    parser.add_argument("--max_batch_tokens", type=int, default=8192, help="Padded-token budget of one batch")
+    parser.add_argument("--max_queue", type=int, default=1024, help="Queued requests beyond which the server answers 503")
+    parser.add_argument("--max_length", type=int, default=128)
+    parser.add_argument("--default_timeout", type=float, default=10.0, help="Deadline in seconds of requests without `timeout`")
+    args = parser.parse_args()
+
+    model = SimCSE(args.model_name_or_path, device=args.device, pooler=args.pooler)
+    if args.index_path is not None:
+        model.load_index(args.index_path)
+    try:
+        asyncio.run(serve(model, args))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve(model: SimCSE, args: argparse.Namespace):
+    batcher = MicroBatcher(model, max_wait_ms=args.max_wait_ms, max_batch_tokens=args.max_batch_tokens,
+                           max_queue=args.max_queue, max_length=args.max_length)
+    batcher.start()
+    server = Server(batcher, default_timeout=args.default_timeout)
+    tcp_server = await asyncio.start_server(server.handle_connection, args.host, args.port)
+    logger.info("Serving on http://%s:%d" % (args.host, args.port))
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,11 @@
+import os
+import json
 import logging
+import itertools
+import shutil
+import tempfile
+import hashlib
+import weakref
 from tqdm import tqdm
 import numpy as np
 from numpy import ndarray
@@ -8,7 +15,12 @@ import transformers
 from transformers import AutoModel, AutoTokenizer
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import normalize
-from typing import List, Dict, Tuple, Type, Union
+from typing import Iterable, List, Dict, Tuple, Type, Union
+from .cache import EmbeddingCache
+from .ivf import IVFIndex
+from .hnsw import HNSWIndex
+from .quantization import QuantizedIndex
+from .index import SentenceStore, SentenceWriter, AppendableNpy, save_sentences, topk_inner_product
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s', datefmt='%m/%d/%Y %H:%M:%S',
                     level=logging.INFO)
@@ -22,7 +34,12 @@ class SimCSE(object):
                 device: str = None,
                 num_cells: int = 100,
                 num_cells_in_search: int = 10,
-                pooler = None):
+                pooler = None,
+                cache_dir: str = None,
+                cache_size: int = 1000000,
+                num_neighbors: int = 32,
+                ef_search: int = 64,
+                dim: int = None):
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
         self.model = AutoModel.from_pretrained(model_name_or_path)
@@ -34,6 +51,10 @@ class SimCSE(object):
         self.is_faiss_index = False
         self.num_cells = num_cells
         self.num_cells_in_search = num_cells_in_search
+        self.num_neighbors = num_neighbors
+        self.ef_search = ef_search
+        # Default embedding size for `encode` (and so for indexing and search), see `encode`
+        self.dim = dim
 
         if pooler is not None:
             self.pooler = pooler
@@ -42,6 +63,24 @@ class SimCSE(object):
             self.pooler = "cls_before_pooler"
         else:
             self.pooler = "cls"
+
+        # Optional on-disk embedding cache; only cache misses reach the model
+        self._fingerprint = None
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = EmbeddingCache(cache_dir, dim=self.model.config.hidden_size, max_entries=cache_size)
+
+    def model_fingerprint(self) -> str:
+        """
+        A digest of the model config and weights, used to key cached embeddings.
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1(self.model.config.to_json_string().encode("utf-8"))
+            for name, param in self.model.state_dict().items():
+                h.update(name.encode("utf-8"))
+                h.update(param.detach().cpu().contiguous().numpy().tobytes())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
     
     def encode(self, sentence: Union[str, List[str]], 
                 device: str = None, 
@@ -49,39 +88,61 @@ class SimCSE(object):
                 normalize_to_unit: bool = True,
                 keepdim: bool = False,
                 batch_size: int = 64,
-                max_length: int = 128) -> Union[ndarray, Tensor]:
+                max_length: int = 128,
+                sort_by_length: bool = False,
+                max_tokens: int = None,
+                num_workers: int = None,
+                threads_per_worker: int = None,
+                dim: int = None) -> Union[ndarray, Tensor]:
+        """
+        Encode sentences into embeddings. By default sentences are batched in arrival order with
+        `batch_size` rows per batch. With `sort_by_length` (or `max_tokens`), sentences are sorted
+        by token length so each batch pads to a similar length; `max_tokens` additionally sizes the
+        batches by a budget of padded tokens (rows x longest row) instead of a fixed row count.
+        The output is always returned in the original input order.
+        If the model was created with `cache_dir`, cached embeddings are reused and only the
+        sentences missing from the cache are run through the model.
+        With `num_workers` (CPU only), the batches are spread over that many worker processes with
+        `threads_per_worker` threads each (default: CPU count / `num_workers`), see `simcse.pool`.
+        With `dim` (default: the `dim` given to the constructor), embeddings are truncated to their
+        first `dim` coordinates (then normalized), for models trained with `--matryoshka_dims`.
+        """
+        dim = self.dim if dim is None else dim
+        if dim is not None and not 0 < dim <= self.model.config.hidden_size:
+            raise ValueError("`dim` must be between 1 and the hidden size (%d)." % self.model.config.hidden_size)
 
-        target_device = self.device if device is None else device
-        self.model = self.model.to(target_device)
-        
         single_sentence = False
         if isinstance(sentence, str):
             sentence = [sentence]
             single_sentence = True
 
-        embedding_list = [] 
-        with torch.no_grad():
-            total_batch = len(sentence) // batch_size + (1 if len(sentence) % batch_size > 0 else 0)
-            for batch_id in tqdm(range(total_batch)):
-                inputs = self.tokenizer(
-                    sentence[batch_id*batch_size:(batch_id+1)*batch_size], 
-                    padding=True, 
-                    truncation=True, 
-                    max_length=max_length, 
-                    return_tensors="pt"
-                )
-                inputs = {k: v.to(target_device) for k, v in inputs.items()}
-                outputs = self.model(**inputs, return_dict=True)
-                if self.pooler == "cls":
-                    embeddings = outputs.pooler_output
-                elif self.pooler == "cls_before_pooler":
-                    embeddings = outputs.last_hidden_state[:, 0]
-                else:
-                    raise NotImplementedError
-                if normalize_to_unit:
-                    embeddings = embeddings / embeddings.norm(dim=1, keepdim=True)
-                embedding_list.append(embeddings.cpu())
-        embeddings = torch.cat(embedding_list, 0)
+        encode_kwargs = {"device": device, "normalize_to_unit": normalize_to_unit, "batch_size": batch_size,
+                         "max_length": max_length, "sort_by_length": sort_by_length, "max_tokens": max_tokens,
+                         "num_workers": num_workers, "threads_per_worker": threads_per_worker}
+        if self.cache is not None:
+            prefix = "%s|%s|%d|%s" % (self.model_fingerprint(), self.pooler, max_length, normalize_to_unit)
+            keys = [self.cache.key(prefix, s) for s in sentence]
+            vectors, missing = self.cache.lookup(keys)
+            if len(missing) > 0:
+                # Encode each distinct missing sentence once
+                unique = {}
+                for i in missing:
+                    unique.setdefault(keys[i], sentence[i])
+                new_vectors = self._encode(list(unique.values()), **encode_kwargs).numpy()
+                self.cache.insert(list(unique.keys()), new_vectors)
+                row = {k: j for j, k in enumerate(unique)}
+                for i in missing:
+                    vectors[i] = new_vectors[row[keys[i]]]
+            embeddings = torch.from_numpy(vectors)
+        else:
+            embeddings = self._encode(sentence, **encode_kwargs)
+
+        if dim is not None:
+            # Full embeddings are computed (and cached); truncating and renormalizing a unit vector
+            # gives the same result as normalizing the truncated embedding
+            embeddings = embeddings[:, :dim]
+            if normalize_to_unit:
+                embeddings = embeddings / embeddings.norm(dim=1, keepdim=True)
         
         if single_sentence and not keepdim:
             embeddings = embeddings[0]
@@ -89,6 +150,102 @@ class SimCSE(object):
         if return_numpy and not isinstance(embeddings, ndarray):
             return embeddings.numpy()
         return embeddings
+
+    def _encode(self, sentence: List[str], 
+                device: str = None, 
+                normalize_to_unit: bool = True,
+                batch_size: int = 64,
+                max_length: int = 128,
+                sort_by_length: bool = False,
+                max_tokens: int = None,
+                num_workers: int = None,
+                threads_per_worker: int = None) -> Tensor:
+
+        target_device = self.device if device is None else device
+        if num_workers is not None and num_workers > 1 and target_device != "cpu":
+            raise ValueError("Multi-process encoding runs on CPU; use device=\"cpu\" with `num_workers`.")
+        self.model = self.model.to(target_device)
+
+        length_sorted = sort_by_length or max_tokens is not None
+        if length_sorted:
+            features = self.tokenizer(sentence, truncation=True, max_length=max_length)
+            lengths = [len(ids) for ids in features["input_ids"]]
+            order = sorted(range(len(sentence)), key=lambda i: lengths[i], reverse=True)
+            batches = self._length_sorted_batches(order, lengths, batch_size, max_tokens)
+        else:
+            batches = [range(start, min(start + batch_size, len(sentence))) for start in range(0, len(sentence), batch_size)]
+
+        if num_workers is not None and num_workers > 1:
+            from .pool import encode_in_processes
+            return encode_in_processes(self.model, self.tokenizer, self.pooler, sentence, batches, 
+                                       num_workers, threads_per_worker, max_length, normalize_to_unit)
+
+        embedding_list = [] 
+        with torch.no_grad():
+            for batch in tqdm(batches):
+                if length_sorted:
+                    inputs = self.tokenizer.pad(
+                        [{k: features[k][i] for k in features} for i in batch],
+                        padding=True,
+                        return_tensors="pt"
+                    )
+                else:
+                    inputs = self.tokenizer(
+                        sentence[batch.start:batch.stop], 
+                        padding=True, 
+                        truncation=True, 
+                        max_length=max_length, 
+                        return_tensors="pt"
+                    )
+                inputs = {k: v.to(target_device) for k, v in inputs.items()}
+                embeddings = self._embed_batch(self.model, self.pooler, inputs, normalize_to_unit)
+                embedding_list.append(embeddings.cpu())
+        embeddings = torch.cat(embedding_list, 0)
+
+        if length_sorted:
+            # Restore the original input order
+            restored = torch.empty_like(embeddings)
+            restored[torch.tensor(order, dtype=torch.long)] = embeddings
+            embeddings = restored
+        return embeddings
+
+    @staticmethod
+    def _embed_batch(model: torch.nn.Module, pooler: str, inputs: Dict[str, Tensor], normalize_to_unit: bool) -> Tensor:
+        outputs = model(**inputs, return_dict=True)
+        if pooler == "cls":
+            embeddings = outputs.pooler_output
+        elif pooler == "cls_before_pooler":
+            embeddings = outputs.last_hidden_state[:, 0]
+        else:
+            raise NotImplementedError
+        if normalize_to_unit:
+            embeddings = embeddings / embeddings.norm(dim=1, keepdim=True)
+        return embeddings
+
+    @staticmethod
+    def _length_sorted_batches(order: List[int], 
+                                lengths: List[int], 
+                                batch_size: int, 
+                                max_tokens: int = None) -> List[List[int]]:
+        """
+        Cut sentence ids sorted by decreasing length into batches. Without `max_tokens` every batch
+        has `batch_size` rows; otherwise a batch grows while rows x longest row fits in `max_tokens`.
+        """
+        if max_tokens is None:
+            return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+        batches = []
+        batch = []
+        for idx in order:
+            # Sentences come in decreasing length, so the first one sets the padded width
+            width = lengths[batch[0]] if len(batch) > 0 else lengths[idx]
+            if len(batch) > 0 and (len(batch) + 1) * width > max_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(idx)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
     
     def similarity(self, queries: Union[str, List[str]], 
                     keys: Union[str, List[str], ndarray], 
@@ -122,7 +279,33 @@ class SimCSE(object):
                         use_faiss: bool = None,
                         faiss_fast: bool = False,
                         device: str = None,
-                        batch_size: int = 64):
+                        batch_size: int = 64,
+                        streaming: bool = False,
+                        index_dir: str = None,
+                        chunk_size: int = 100000,
+                        quantization: str = None,
+                        hnsw: bool = False):
+        """
+        Build an index over sentences (a list, or the path of a file with one sentence per line).
+        With `faiss_fast`, an IVF index with `num_cells` cells is built (faiss's, or `IVFIndex` written in
+        NumPy when faiss is not used), searching `num_cells_in_search` cells per query.
+        With `streaming`, the file is read lazily and encoded `chunk_size` lines at a time; each chunk
+        is appended to a growable memory-mapped matrix in `index_dir` (and added to the faiss index),
+        and progress is checkpointed so that a crashed build resumes at the last finished chunk.
+        `index_dir` ends up in the `save_index` layout and can be reopened with `load_index`.
+        With `quantization` ("int8" or "float16"), brute-force search runs over compressed vectors and
+        rescores the best candidates with full-precision vectors memory-mapped from `index_dir` (or a
+        temporary directory, deleted with the index), see `QuantizedIndex`.
+        With `hnsw`, a graph index with `num_neighbors` links per node is built (faiss's, or `HNSWIndex`
+        written in NumPy when faiss is not used), searching with a beam of `ef_search` nodes per query.
+        """
+
+        if hnsw and faiss_fast:
+            raise ValueError("Choose one approximate index: `hnsw` or `faiss_fast`.")
+        if quantization is not None:
+            if use_faiss or faiss_fast or hnsw:
+                raise ValueError("Quantized storage is only available for brute-force search (use_faiss=False, faiss_fast=False, hnsw=False).")
+            use_faiss = False
 
         if use_faiss is None or use_faiss:
             try:
@@ -130,8 +313,19 @@ class SimCSE(object):
                 assert hasattr(faiss, "IndexFlatIP")
                 use_faiss = True 
             except:
-                logger.warning("Fail to import faiss. If you want to use faiss, install faiss through PyPI. Now the program continues with brute force search.")
+                if faiss_fast:
+                    logger.warning("Fail to import faiss. If you want to use faiss, install faiss through PyPI. Now the program continues with the NumPy IVF index.")
+                elif hnsw:
+                    logger.warning("Fail to import faiss. If you want to use faiss, install faiss through PyPI. Now the program continues with the NumPy HNSW index.")
+                else:
+                    logger.warning("Fail to import faiss. If you want to use faiss, install faiss through PyPI. Now the program continues with brute force search.")
                 use_faiss = False
+
+        if streaming:
+            if not isinstance(sentences_or_file_path, str) or index_dir is None:
+                raise ValueError("Streaming mode needs the path of a sentence file and an `index_dir`.")
+            self._build_index_streaming(sentences_or_file_path, index_dir, use_faiss, faiss_fast, device, batch_size, chunk_size, quantization, hnsw)
+            return
         
         # if the input sentence is a string, we assume it's the path of file that stores various sentences
         if isinstance(sentences_or_file_path, str):
@@ -146,100 +340,330 @@ class SimCSE(object):
         embeddings = self.encode(sentences_or_file_path, device=device, batch_size=batch_size, normalize_to_unit=True, return_numpy=True)
 
         logger.info("Building index...")
-        self.index = {"sentences": sentences_or_file_path}
+        # A copy, so that `add_to_index` does not extend the caller's list
+        self.index = {"sentences": list(sentences_or_file_path)}
         
-        if use_faiss:
-            quantizer = faiss.IndexFlatIP(embeddings.shape[1])  
-            if faiss_fast:
-                index = faiss.IndexIVFFlat(quantizer, embeddings.shape[1], min(self.num_cells, len(sentences_or_file_path)), faiss.METRIC_INNER_PRODUCT) 
+        index = self._new_index(embeddings, use_faiss, faiss_fast, device, quantization, index_dir, hnsw)
+        if index is None:
+            index = embeddings
+        else:
+            index.add(embeddings.astype(np.float32))
+        self.is_faiss_index = use_faiss
+        self.index["index"] = index
+        logger.info("Finished")
+
+    def _new_index(self, train_embeddings: ndarray, 
+                    use_faiss: bool, 
+                    faiss_fast: bool, 
+                    device: str = None, 
+                    quantization: str = None, 
+                    index_dir: str = None,
+                    hnsw: bool = False):
+        """
+        Create an empty search index, trained on `train_embeddings` for the IVF and quantized variants.
+        Returns None for brute-force search, where the embedding matrix itself is the index.
+        """
+        if quantization is not None:
+            temp_dir = None
+            if index_dir is None:
+                index_dir = temp_dir = tempfile.mkdtemp(prefix="simcse_index_")
+            os.makedirs(index_dir, exist_ok=True)
+            index = QuantizedIndex(os.path.join(index_dir, "embeddings.npy"), train_embeddings.shape[1], quantization=quantization)
+            if temp_dir is not None:
+                # The side file only lives as long as the index (replaced, garbage collected, or at exit)
+                weakref.finalize(index, shutil.rmtree, temp_dir, True)
+            index.train(train_embeddings)
+            return index
+
+        if not use_faiss:
+            if hnsw:
+                return HNSWIndex(train_embeddings.shape[1], num_neighbors=self.num_neighbors, ef_search=self.ef_search)
+            if not faiss_fast:
+                return None
+            index = IVFIndex(train_embeddings.shape[1], num_cells=self.num_cells, nprobe=self.num_cells_in_search)
+            index.train(train_embeddings)
+            return index
+
+        import faiss
+        dim = train_embeddings.shape[1]
+        if hnsw:
+            # faiss has no GPU version of HNSW
+            index = faiss.IndexHNSWFlat(dim, self.num_neighbors, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = self.ef_search
+            return index
+        quantizer = faiss.IndexFlatIP(dim)  
+        if faiss_fast:
+            index = faiss.IndexIVFFlat(quantizer, dim, min(self.num_cells, len(train_embeddings)), faiss.METRIC_INNER_PRODUCT) 
+        else:
+            index = quantizer
+
+        index = self._faiss_to_device(index, device)
+
+        if faiss_fast:            
+            index.train(np.asarray(train_embeddings, dtype=np.float32))
+            index.nprobe = min(self.num_cells_in_search, len(train_embeddings))
+        return index
+
+    def _build_index_streaming(self, file_path: str, 
+                                index_dir: str, 
+                                use_faiss: bool, 
+                                faiss_fast: bool, 
+                                device: str, 
+                                batch_size: int, 
+                                chunk_size: int,
+                                quantization: str = None,
+                                hnsw: bool = False):
+        os.makedirs(index_dir, exist_ok=True)
+        progress_path = os.path.join(index_dir, "progress.json")
+        num_done = 0
+        if os.path.exists(progress_path):
+            with open(progress_path) as f:
+                progress = json.load(f)
+            if progress["source"] != os.path.abspath(file_path) or progress["use_faiss"] != use_faiss or progress["faiss_fast"] != faiss_fast \
+                    or progress.get("hnsw", False) != hnsw or progress.get("dim") != self.dim:
+                raise ValueError("%s holds a build with different settings (%s); use another `index_dir`." % (index_dir, progress))
+            num_done = progress["num_sentences"]
+            logger.info("Resuming index build from sentence %d" % (num_done))
+
+        embeddings = AppendableNpy(os.path.join(index_dir, "embeddings.npy"), np.float32, (self.dim or self.model.config.hidden_size,), rows=num_done)
+        sentences = SentenceWriter(index_dir, num_sentences=num_done)
+
+        # Vectors also go to a separate faiss / IVF / HNSW index unless the memory-mapped matrix is searched directly
+        separate_index = use_faiss or faiss_fast or hnsw
+        index = None
+        if separate_index and num_done > 0:
+            # Rebuild the index from the checkpointed vectors (IVF is trained on the first chunk, as before)
+            stored = np.load(embeddings.path, mmap_mode="r")
+            index = self._new_index(stored[:chunk_size], use_faiss, faiss_fast, device, hnsw=hnsw)
+            for start in range(0, num_done, chunk_size):
+                index.add(np.asarray(stored[start:start + chunk_size], dtype=np.float32))
+
+        logger.info("Encoding and indexing sentences from %s ..." % (file_path))
+        with open(file_path, "r") as f:
+            lines = (line.rstrip() for line in itertools.islice(f, num_done, None))
+            while True:
+                chunk = list(itertools.islice(lines, chunk_size))
+                if len(chunk) == 0:
+                    break
+                chunk_embeddings = self.encode(chunk, device=device, batch_size=batch_size, normalize_to_unit=True, return_numpy=True)
+                if separate_index:
+                    if index is None:
+                        index = self._new_index(chunk_embeddings, use_faiss, faiss_fast, device, hnsw=hnsw)
+                    index.add(chunk_embeddings.astype(np.float32))
+                embeddings.append(chunk_embeddings)
+                sentences.append(chunk)
+
+                # Checkpoint: data first, then the progress marker
+                embeddings.flush()
+                sentences.flush()
+                num_done += len(chunk)
+                tmp_path = progress_path + ".tmp"
+                with open(tmp_path, "w") as pf:
+                    json.dump({"source": os.path.abspath(file_path), "num_sentences": num_done,
+                               "use_faiss": use_faiss, "faiss_fast": faiss_fast, "hnsw": hnsw, "dim": self.dim}, pf)
+                os.replace(tmp_path, progress_path)
+                logger.info("Indexed %d sentences" % (num_done))
+        embeddings.close()
+        sentences.close()
+
+        if quantization is not None:
+            # Quantize the streamed vectors, which stay in place as the full-precision side file
+            stored = np.load(embeddings.path, mmap_mode="r")
+            index = QuantizedIndex(embeddings.path, stored.shape[1], quantization=quantization, num_full_vectors=num_done)
+            index.train(np.asarray(stored[:chunk_size]))
+            index.add_stored(chunk_size)
+            separate_index = True
+
+        self.index = {"sentences": SentenceStore.load(index_dir)}
+        self.index["index"] = index if separate_index else np.load(embeddings.path, mmap_mode="r")
+        self.is_faiss_index = use_faiss
+        self._write_index_files(index_dir)
+        logger.info("Finished")
+
+    def _faiss_to_device(self, index, device: str = None):
+        import faiss
+        if (self.device == "cuda" and device != "cpu") or device == "cuda":
+            if hasattr(faiss, "StandardGpuResources"):
+                logger.info("Use GPU-version faiss")
+                res = faiss.StandardGpuResources()
+                res.setTempMemory(20 * 1024 * 1024 * 1024)
+                index = faiss.index_cpu_to_gpu(res, 0, index)
             else:
-                index = quantizer
-
-            if (self.device == "cuda" and device != "cpu") or device == "cuda":
-                if hasattr(faiss, "StandardGpuResources"):
-                    logger.info("Use GPU-version faiss")
-                    res = faiss.StandardGpuResources()
-                    res.setTempMemory(20 * 1024 * 1024 * 1024)
-                    index = faiss.index_cpu_to_gpu(res, 0, index)
-                else:
-                    logger.info("Use CPU-version faiss")
-            else: 
                 logger.info("Use CPU-version faiss")
+        else: 
+            logger.info("Use CPU-version faiss")
+        return index
 
-            if faiss_fast:            
-                index.train(embeddings.astype(np.float32))
-            index.add(embeddings.astype(np.float32))
-            index.nprobe = min(self.num_cells_in_search, len(sentences_or_file_path))
-            self.is_faiss_index = True
+    def save_index(self, path: str):
+        """
+        Save the current index to directory `path`: sentences as an offset-indexed UTF-8 blob, plus
+        the embeddings as a .npy file (brute force), the faiss index file, or the IVF lists.
+        """
+        if self.index is None:
+            raise ValueError("No index to save. Call `build_index` first.")
+        os.makedirs(path, exist_ok=True)
+        logger.info("Saving index to %s ..." % (path))
+        # The index may be memory-mapped from `path` (e.g., after `load_index(path)`), so the files are
+        # written next to it first and then moved over the old ones, which mappings keep alive.
+        staging = tempfile.mkdtemp(prefix=".saving_", dir=path)
+        try:
+            save_sentences(self.index["sentences"], staging)
+            self._write_index_files(staging, final_path=path)
+            for name in os.listdir(staging):
+                os.replace(os.path.join(staging, name), os.path.join(path, name))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info("Finished")
+
+    def _write_index_files(self, path: str, final_path: str = None):
+        """
+        Write the index and meta.json to `path`. Files staged there for `final_path` are not copied
+        if the index already lives in `final_path` (a memory-mapped or streamed `embeddings.npy`).
+        """
+        final_path = path if final_path is None else final_path
+        index = self.index["index"]
+        if self.is_faiss_index:
+            import faiss
+            if hasattr(faiss, "GpuIndex") and isinstance(index, faiss.GpuIndex):
+                index = faiss.index_gpu_to_cpu(index)
+            faiss.write_index(index, os.path.join(path, "faiss.index"))
+            backend = "faiss"
+        elif isinstance(index, IVFIndex):
+            index.save(path)
+            backend = "ivf"
+        elif isinstance(index, QuantizedIndex):
+            index.save(path, final_path=final_path)
+            backend = "quantized"
+        elif isinstance(index, HNSWIndex):
+            index.save(path)
+            backend = "hnsw"
         else:
-            index = embeddings
+            # A streamed (or memory-mapped, unchanged) index already lives in `embeddings.npy`
+            in_place = os.path.abspath(os.path.join(final_path, "embeddings.npy"))
+            if not (isinstance(index, np.memmap) and os.path.abspath(index.filename) == in_place):
+                np.save(os.path.join(path, "embeddings.npy"), index)
+            backend = "flat"
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"backend": backend, "num_sentences": len(self.index["sentences"])}, f)
+
+    def load_index(self, path: str, 
+                        mmap: bool = True,
+                        device: str = None):
+        """
+        Load an index saved by `save_index`. With `mmap`, sentences and vectors are memory-mapped
+        rather than read into memory, so the index opens quickly and its pages are shared between
+        processes that load the same files. A memory-mapped faiss IVF or HNSW index is read-only;
+        load it with `mmap=False` to keep calling `add_to_index`.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        logger.info("Loading index from %s ..." % (path))
+        sentences = SentenceStore.load(path, mmap=mmap)
+
+        if meta["backend"] == "faiss":
+            import faiss
+            index = faiss.read_index(os.path.join(path, "faiss.index"), faiss.IO_FLAG_MMAP if mmap else 0)
+            if hasattr(index, "hnsw"):
+                index.hnsw.efSearch = self.ef_search
+            else:
+                index = self._faiss_to_device(index, device)
+            if hasattr(index, "nprobe"):
+                index.nprobe = min(self.num_cells_in_search, len(sentences))
+            self.is_faiss_index = True
+        elif meta["backend"] == "ivf":
+            index = IVFIndex.load(path, mmap=mmap)
+            index.nprobe = self.num_cells_in_search
             self.is_faiss_index = False
-        self.index["index"] = index
+        elif meta["backend"] == "hnsw":
+            index = HNSWIndex.load(path, mmap=mmap)
+            index.ef_search = self.ef_search
+            self.is_faiss_index = False
+        elif meta["backend"] == "quantized":
+            index = QuantizedIndex.load(path, mmap=mmap)
+            self.is_faiss_index = False
+        elif meta["backend"] == "flat":
+            index = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r" if mmap else None)
+            self.is_faiss_index = False
+        else:
+            raise ValueError("Unknown index backend %s" % meta["backend"])
+
+        self.index = {"sentences": sentences, "index": index}
         logger.info("Finished")
 
     def add_to_index(self, sentences_or_file_path: Union[str, List[str]],
                         device: str = None,
-                        batch_size: int = 64):
-        
-        # if the input sentence is a string, we assume it's the path of file that stores various sentences
+                        batch_size: int = 64,
+                        chunk_size: int = 100000):
+        """
+        Encode sentences (a list, or the path of a file with one sentence per line) and add them to
+        the current index. As with `build_index(..., streaming=True)`, a file is read lazily and
+        encoded `chunk_size` lines at a time, each chunk going to the faiss / IVF / HNSW / quantized
+        index before the next is read. A brute-force index is one matrix, so its chunks are
+        concatenated to it once, after the last chunk.
+        """
         if isinstance(sentences_or_file_path, str):
-            sentences = []
+            logger.info("Encoding and indexing sentences from %s ..." % (sentences_or_file_path))
             with open(sentences_or_file_path, "r") as f:
-                logging.info("Loading sentences from %s ..." % (sentences_or_file_path))
-                for line in tqdm(f):
-                    sentences.append(line.rstrip())
-            sentences_or_file_path = sentences
-        
-        logger.info("Encoding embeddings for sentences...")
-        embeddings = self.encode(sentences_or_file_path, device=device, batch_size=batch_size, normalize_to_unit=True, return_numpy=True)
-        
-        if self.is_faiss_index:
-            self.index["index"].add(embeddings.astype(np.float32))
+                lines = (line.rstrip() for line in f)
+                self._add_chunks(iter(lambda: list(itertools.islice(lines, chunk_size)), []), device, batch_size)
         else:
-            self.index["index"] = np.concatenate((self.index["index"], embeddings))
-        self.index["sentences"] += sentences_or_file_path
+            logger.info("Encoding embeddings for sentences...")
+            self._add_chunks([sentences_or_file_path], device, batch_size)
         logger.info("Finished")
 
+    def _add_chunks(self, chunks: Iterable[List[str]], device: str, batch_size: int):
+        flat_embeddings, flat_sentences = [], []
+        for chunk in chunks:
+            embeddings = self.encode(chunk, device=device, batch_size=batch_size, normalize_to_unit=True, keepdim=True, return_numpy=True)
+            if isinstance(self.index["index"], ndarray):
+                flat_embeddings.append(embeddings)
+                flat_sentences.extend(chunk)
+            else:
+                self.index["index"].add(embeddings.astype(np.float32))
+                self.index["sentences"] += chunk
+        if len(flat_embeddings) > 0:
+            self.index["index"] = np.concatenate([self.index["index"]] + flat_embeddings)
+            self.index["sentences"] += flat_sentences
+
 
     
     def search(self, queries: Union[str, List[str]], 
                 device: str = None, 
                 threshold: float = 0.6,
-                top_k: int = 5) -> Union[List[Tuple[str, float]], List[List[Tuple[str, float]]]]:
-        
-        if not self.is_faiss_index:
-            if isinstance(queries, list):
-                combined_results = []
-                for query in queries:
-                    results = self.search(query, device, threshold, top_k)
-                    combined_results.append(results)
-                return combined_results
-            
-            similarities = self.similarity(queries, self.index["index"]).tolist()
-            id_and_score = []
-            for i, s in enumerate(similarities):
-                if s >= threshold:
-                    id_and_score.append((i, s))
-            id_and_score = sorted(id_and_score, key=lambda x: x[1], reverse=True)[:top_k]
-            results = [(self.index["sentences"][idx], score) for idx, score in id_and_score]
-            return results
+                top_k: int = 5,
+                chunk_size: int = 65536) -> Union[List[Tuple[str, float]], List[List[Tuple[str, float]]]]:
+        """
+        Retrieve the `top_k` most similar indexed sentences (with cosine similarity >= `threshold`)
+        for each query. All queries are encoded in one call. Without faiss, the corpus matrix is
+        scanned in chunks of `chunk_size` rows with a running top-k per query; faiss and `IVFIndex`
+        indexes are searched through their own `search`.
+        """
+        query_vecs = self.encode(queries, device=device, normalize_to_unit=True, keepdim=True, return_numpy=True)
+        combined_results = self.search_vectors(query_vecs, threshold=threshold, top_k=top_k, chunk_size=chunk_size)
+        if isinstance(queries, list):
+            return combined_results
         else:
-            query_vecs = self.encode(queries, device=device, normalize_to_unit=True, keepdim=True, return_numpy=True)
+            return combined_results[0]
 
+    def search_vectors(self, query_vecs: ndarray, 
+                        threshold: float = 0.6,
+                        top_k: int = 5,
+                        chunk_size: int = 65536) -> List[List[Tuple[str, float]]]:
+        """
+        Same as `search`, for an (N, hidden) array of already encoded, unit-normalized queries.
+        """
+        if isinstance(self.index["index"], ndarray):
+            # Index vectors are unit-normalized, so the inner product is the cosine similarity
+            distance, idx = topk_inner_product(query_vecs, self.index["index"], top_k, chunk_size=chunk_size)
+        else:
             distance, idx = self.index["index"].search(query_vecs.astype(np.float32), top_k)
-            
-            def pack_single_result(dist, idx):
-                results = [(self.index["sentences"][i], s) for i, s in zip(idx, dist) if s >= threshold]
-                return results
-            
-            if isinstance(queries, list):
-                combined_results = []
-                for i in range(len(queries)):
-                    results = pack_single_result(distance[i], idx[i])
-                    combined_results.append(results)
-                return combined_results
-            else:
-                return pack_single_result(distance[0], idx[0])
+
+        def pack_single_result(dist, idx):
+            results = [(self.index["sentences"][i], float(s)) for i, s in zip(idx, dist) if i >= 0 and s >= threshold]
+            return results
+
+        return [pack_single_result(distance[i], idx[i]) for i in range(len(query_vecs))]
 
 if __name__=="__main__":
     example_sentences = [
@@ -75,6 +75,11 @@ if is_datasets_available():
 from transformers.trainer import _model_unwrap
 from transformers.optimization import Adafactor, AdamW, get_scheduler
 import copy
+import contextlib
+
+from .models import cl_loss
+from .grad_cache import grad_cache_step
+from .data import LengthGroupedSampler, example_lengths
 
 # Set path to SentEval
 PATH_TO_SENTEVAL = './SentEval'
@@ -92,6 +97,61 @@ logger = logging.get_logger(__name__)
 
 class CLTrainer(Trainer):
 
+    def _get_train_sampler(self) -> Optional[torch.utils.data.sampler.Sampler]:
+        """
+        With `--length_group_size`, group examples of similar length into batches (see
+        `simcse.data.LengthGroupedSampler`); otherwise the Trainer's random sampler.
+        """
+        if self.args.length_group_size <= 0 or not isinstance(self.train_dataset, collections.abc.Sized):
+            return super()._get_train_sampler()
+        if self.args.local_rank != -1:
+            num_replicas, rank = torch.distributed.get_world_size(), torch.distributed.get_rank()
+        else:
+            num_replicas, rank = 1, 0
+        return LengthGroupedSampler(example_lengths(self.train_dataset), self.args.train_batch_size,
+                                    group_size=self.args.length_group_size, num_replicas=num_replicas, rank=rank,
+                                    seed=self.args.seed)
+
+    def training_step(self, model: nn.Module, inputs: Dict[str, Union[torch.Tensor, Any]]) -> torch.Tensor:
+        """
+        With `grad_cache_chunk_size`, run the step with gradient caching (see `simcse.grad_cache`);
+        otherwise the default training step. With `mlm_masking` set (`--mlm_on_device`), the MLM
+        inputs and labels are drawn here, on the training device, rather than by the collator.
+        """
+        mlm_masking = getattr(self, "mlm_masking", None)
+        if mlm_masking is not None and "mlm_input_ids" not in inputs:
+            inputs = self._prepare_inputs(inputs)
+            inputs["mlm_input_ids"], inputs["mlm_labels"] = mlm_masking(inputs["input_ids"])
+
+        chunk_size = getattr(self.args, "grad_cache_chunk_size", 0)
+        if chunk_size <= 0:
+            return super().training_step(model, inputs)
+        if self.use_apex or self.deepspeed:
+            raise NotImplementedError("Gradient caching supports fp32 and native AMP training only.")
+        if "mlm_input_ids" in inputs:
+            raise NotImplementedError("Gradient caching does not support the MLM auxiliary objective.")
+        if getattr(_model_unwrap(model).model_args, "momentum", 0.0) > 0:
+            raise NotImplementedError("Gradient caching does not support the momentum encoder.")
+
+        model.train()
+        inputs = self._prepare_inputs(inputs)
+        cl_model = _model_unwrap(model)
+
+        def loss_fn(reps):
+            loss, _ = cl_loss(cl_model, reps)
+            if self.args.gradient_accumulation_steps > 1:
+                loss = loss / self.args.gradient_accumulation_steps
+            return loss
+
+        def backward(loss):
+            if self.use_amp:
+                self.scaler.scale(loss).backward()
+            else:
+                loss.backward()
+
+        return grad_cache_step(model, inputs, chunk_size, loss_fn, backward=backward,
+                               forward_context=autocast if self.use_amp else contextlib.nullcontext)
+
     def evaluate(
             self,
             eval_dataset: Optional[Dataset] = None,
@@ -114,7 +174,7 @@ class CLTrainer(Trainer):
             for k in batch:
                 batch[k] = batch[k].to(self.args.device)
             with torch.no_grad():
-                outputs = self.model(**batch, output_hidden_states=True, return_dict=True, sent_emb=True)
+                outputs = self.model(**batch, return_dict=True, sent_emb=True)
                 pooler_output = outputs.pooler_output
             return pooler_output.cpu()
 
@@ -434,7 +494,7 @@ class CLTrainer(Trainer):
                 for _ in train_dataloader:
                     break
         for epoch in range(epochs_trained, num_train_epochs):
-            if isinstance(train_dataloader, DataLoader) and isinstance(train_dataloader.sampler, DistributedSampler):
+            if isinstance(train_dataloader, DataLoader) and isinstance(train_dataloader.sampler, (DistributedSampler, LengthGroupedSampler)):
                 train_dataloader.sampler.set_epoch(epoch)
             epoch_iterator = train_dataloader
 
@@ -442,11 +502,14 @@ class CLTrainer(Trainer):
             if self.args.past_index >= 0:
                 self._past = None
 
-            steps_in_epoch = len(train_dataloader) if train_dataset_is_sized else self.args.max_steps
+            # Without a length (streaming), the single "epoch" lasts max_steps optimizer steps
+            steps_in_epoch = (
+                len(train_dataloader)
+                if train_dataset_is_sized
+                else self.args.max_steps * self.args.gradient_accumulation_steps
+            )
             self.control = self.callback_handler.on_epoch_begin(self.args, self.state, self.control)
 
-            assert train_dataset_is_sized, "currently we only support sized dataloader!"
-
             inputs = None
             last_inputs = None
             for step, inputs in enumerate(epoch_iterator):
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ["the", "cat", "sat", "on", "a", "mat", "dog", "ran", "far", "away", "man", "is", "playing", "guitar"]
+
+
+@pytest.fixture(scope="session")
+def model_dir(tmp_path_factory):
+    """
+    A randomly initialized small BERT and a toy word-level vocabulary, saved as a checkpoint.
+    """
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizer
+    path = str(tmp_path_factory.mktemp("model"))
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+    BertTokenizer(os.path.join(path, "vocab.txt")).save_pretrained(path)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=32, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=64)
+    BertModel(config).save_pretrained(path)
+    return path
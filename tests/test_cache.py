@@ -0,0 +1,77 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pytest
+
+from simcse.cache import EmbeddingCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def vector(i, dim=4):
+    return np.full(dim, i, dtype=np.float32)
+
+
+def run_and_die(cache_dir, body):
+    """
+    Run `body` against the cache in a child process that exits without running atexit (as a crash would).
+    """
+    code = "\n".join([
+        "import os, sys, numpy as np",
+        "sys.path.insert(0, %r)" % ROOT,
+        "from simcse.cache import EmbeddingCache",
+        "cache = EmbeddingCache(%r, dim=4, max_entries=2)" % cache_dir,
+        "key = lambda s: EmbeddingCache.key('', s)",
+        "vec = lambda i: np.full(4, i, dtype=np.float32)",
+        body,
+        "os._exit(0)",
+    ])
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, max_entries=3)
+    keys = [EmbeddingCache.key("", s) for s in "abc"]
+    cache.insert(keys, np.stack([vector(i) for i in range(3)]))
+    cache.flush()
+    reloaded = EmbeddingCache(str(tmp_path), dim=4, max_entries=3)
+    vectors, missing = reloaded.lookup(keys)
+    assert missing == []
+    np.testing.assert_array_equal(vectors, np.stack([vector(i) for i in range(3)]))
+
+
+def test_lru_eviction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), dim=4, max_entries=2)
+    a, b, c = [EmbeddingCache.key("", s) for s in "abc"]
+    cache.insert([a, b], np.stack([vector(1), vector(2)]))
+    cache.lookup([a])
+    cache.insert([c], vector(3)[None])
+    vectors, missing = cache.lookup([a, b, c])
+    assert missing == [1]
+    np.testing.assert_array_equal(vectors[[0, 2]], np.stack([vector(1), vector(3)]))
+
+
+@pytest.mark.parametrize("body", [
+    # A row reused for another sentence after the last flush
+    "cache.insert([key('c')], vec(3)[None])",
+    # Both rows reused
+    "cache.insert([key('c'), key('d')], np.stack([vec(3), vec(4)]))",
+])
+def test_crash_after_reusing_rows(tmp_path, body):
+    cache_dir = str(tmp_path)
+    run_and_die(cache_dir, "cache.insert([key('a'), key('b')], np.stack([vec(1), vec(2)]))\ncache.flush()\n" + body)
+    cache = EmbeddingCache(cache_dir, dim=4, max_entries=2)
+    keys = [EmbeddingCache.key("", s) for s in "ab"]
+    vectors, missing = cache.lookup(keys)
+    # Whatever survived is the sentence's own vector; the rest are misses
+    for i, expected in enumerate([vector(1), vector(2)]):
+        if i not in missing:
+            np.testing.assert_array_equal(vectors[i], expected)
+    assert 0 in missing
+    # Refilling a stale entry makes it a hit again
+    cache.insert([keys[0]], vector(1)[None])
+    vectors, missing = cache.lookup(keys[:1])
+    assert missing == []
+    np.testing.assert_array_equal(vectors[0], vector(1))
@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+from transformers import BertTokenizer
+
+from simcse.data import (PretokenizedDataset, collate_views, feature_columns, load_train_dataset, mask_tokens, pretokenize,
+                         special_token_ids, tokenize_examples)
+
+ROWS = [("the cat sat on a mat", "cat sat", "a dog ran far away"),
+        ("a man is playing guitar", "man playing", "the dog sat"),
+        ("the dog ran", "dog ran", "a mat"),
+        ("cat", "the cat", "a man is playing guitar on a mat")]
+
+
+def test_pretokenized_batches(model_dir, tmp_path):
+    """
+    Collated batches of the pre-tokenized dataset equal those of the `datasets` path of train.py.
+    """
+    tokenizer = BertTokenizer.from_pretrained(model_dir)
+    csv_path = str(tmp_path / "train.csv")
+    with open(csv_path, "w") as f:
+        f.write("sent0,sent1,hard_neg\n" + "".join(",".join(row) + "\n" for row in ROWS))
+    pretokenize(csv_path, tokenizer, 8, str(tmp_path / "pretokenized"))
+    dataset = PretokenizedDataset(str(tmp_path / "pretokenized"))
+    assert all(isinstance(view, np.ndarray) for view in dataset[0]["input_ids"])
+
+    reference = load_train_dataset(csv_path, cache_dir=str(tmp_path / "cache"))["train"]
+    columns = feature_columns(reference.column_names)
+    reference = reference.map(lambda examples: tokenize_examples(examples, tokenizer, columns, 8),
+                              batched=True, remove_columns=reference.column_names)
+    dataset.add_column("sent_ids", [[3 * i, 3 * i + 1, 3 * i + 2] for i in range(len(dataset))])
+    reference = reference.add_column("sent_ids", [[3 * i, 3 * i + 1, 3 * i + 2] for i in range(len(reference))])
+    for padding_side in ["right", "left"]:
+        expected = collate_views([reference[i] for i in range(len(reference))], tokenizer.pad_token_id, padding_side=padding_side)
+        got = collate_views([dataset[i] for i in range(len(dataset))], tokenizer.pad_token_id, padding_side=padding_side,
+                            return_token_type_ids=True)
+        assert sorted(expected) == sorted(got) == ["attention_mask", "input_ids", "sent_ids", "token_type_ids"]
+        for key in expected:
+            assert torch.equal(expected[key], got[key]), key
+
+
+def test_mask_tokens_any_shape(model_dir):
+    """
+    With --mlm_on_device the training step masks the (bs, num_sent, len) input ids that the collator
+    would have masked as (bs * num_sent, len): same seed, same result.
+    """
+    tokenizer = BertTokenizer.from_pretrained(model_dir)
+    special_ids = special_token_ids(tokenizer)
+    input_ids = torch.randint(5, len(tokenizer), (8, 3, 10), generator=torch.Generator().manual_seed(0))
+    input_ids[:, :, 0] = tokenizer.cls_token_id
+    input_ids[:, :, -1] = tokenizer.sep_token_id
+    torch.manual_seed(0)
+    flat = mask_tokens(input_ids.view(-1, 10), tokenizer.mask_token_id, len(tokenizer), special_ids)
+    torch.manual_seed(0)
+    views = mask_tokens(input_ids, tokenizer.mask_token_id, len(tokenizer), special_ids)
+    for a, b in zip(flat, views):
+        assert torch.equal(a.view(8, 3, 10), b)
+    assert (views[1][:, :, [0, -1]] == -100).all()
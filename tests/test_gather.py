@@ -0,0 +1,75 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from simcse.gather import gather_views
+from simcse.models import Similarity, cl_loss
+
+WORLD_SIZE = 2
+BATCH_SIZE = 4
+INPUT_DIM = 8
+HIDDEN = 16
+
+
+def make_problem(num_sent):
+    torch.manual_seed(0)
+    encoder = nn.Linear(INPUT_DIM, HIDDEN)
+    inputs = torch.randn(BATCH_SIZE * WORLD_SIZE, num_sent, INPUT_DIM)
+    cls = SimpleNamespace(training=True, sim=Similarity(temp=0.05), device=torch.device("cpu"),
+                          model_args=SimpleNamespace(hard_negative_weight=1.0))
+    return encoder, inputs, cls
+
+
+def worker(rank, init_file, num_sent, results):
+    dist.init_process_group("gloo", init_method="file://" + init_file, rank=rank, world_size=WORLD_SIZE)
+    torch.set_num_threads(1)
+    encoder, inputs, cls = make_problem(num_sent)
+    local = inputs[rank * BATCH_SIZE:(rank + 1) * BATCH_SIZE]
+
+    # The per-view all_gather that gather_views replaces
+    views = list(local.unbind(1))
+    expected = []
+    for z in views:
+        z_list = [torch.zeros_like(z) for _ in range(WORLD_SIZE)]
+        dist.all_gather(z_list, z.contiguous())
+        expected.append(torch.cat(z_list, 0))
+    same_views = all(torch.equal(a, b) for a, b in zip(gather_views(*views), expected))
+
+    model = nn.parallel.DistributedDataParallel(encoder)
+    loss, _ = cl_loss(cls, model(local))
+    loss.backward()
+    results.put((rank, same_views, loss.item(), {n: p.grad.clone() for n, p in encoder.named_parameters()}))
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize("num_sent", [2, 3])
+def test_fused_gather_matches_single_process(tmp_path, num_sent):
+    """
+    With gloo on CPU, each rank's loss is the single-process loss over the global batch, and the DDP
+    gradients are the single-process gradients.
+    """
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(rank, os.path.join(str(tmp_path), "init"), num_sent, results))
+                 for rank in range(WORLD_SIZE)]
+    for p in processes:
+        p.start()
+    outputs = [results.get(timeout=120) for _ in range(WORLD_SIZE)]
+    for p in processes:
+        p.join(timeout=60)
+    assert all(p.exitcode == 0 for p in processes)
+
+    encoder, inputs, cls = make_problem(num_sent)
+    ref_loss, _ = cl_loss(cls, encoder(inputs))
+    ref_loss.backward()
+    for rank, same_views, loss, grads in outputs:
+        assert same_views, "rank %d" % rank
+        assert loss == pytest.approx(ref_loss.item(), rel=1e-5)
+        for n, p in encoder.named_parameters():
+            torch.testing.assert_close(grads[n], p.grad, rtol=1e-4, atol=1e-6)
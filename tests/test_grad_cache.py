@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers import BertConfig
+
+from simcse.grad_cache import grad_cache_step, split_inputs
+from simcse.models import BertForCL, cl_loss
+
+
+def make_model(dropout, seed=0):
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=100, hidden_size=32, num_hidden_layers=2, num_attention_heads=4, intermediate_size=64,
+                        hidden_dropout_prob=dropout, attention_probs_dropout_prob=dropout)
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1, mlp_only_train=False)
+    return BertForCL(config, model_args=model_args).train()
+
+
+def make_inputs(batch_size, num_sent, seq_len, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(5, 100, (batch_size, num_sent, seq_len), generator=generator)
+    lengths = torch.randint(4, seq_len + 1, (batch_size, num_sent, 1), generator=generator)
+    attention_mask = (torch.arange(seq_len).view(1, 1, -1) < lengths).long()
+    return {"input_ids": input_ids * attention_mask, "attention_mask": attention_mask, "token_type_ids": torch.zeros_like(input_ids)}
+
+
+def grads(model):
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+def assert_same(loss, ref_loss, g, ref_g):
+    torch.testing.assert_close(loss, ref_loss.detach(), rtol=1e-5, atol=1e-6)
+    assert set(g) == set(ref_g)
+    scale = max(max(v.abs().max().item() for v in ref_g.values()), 1.0)
+    for n in ref_g:
+        torch.testing.assert_close(g[n], ref_g[n], rtol=0, atol=1e-4 * scale)
+
+
+@pytest.mark.parametrize("num_sent", [2, 3])
+@pytest.mark.parametrize("chunk_size", [4, 5, 16])
+def test_matches_full_batch(num_sent, chunk_size):
+    """
+    Without dropout, chunking must not change the loss or the gradients.
+    """
+    inputs = make_inputs(16, num_sent, 12)
+    model = make_model(0.0)
+    ref_loss = model(**inputs).loss
+    ref_loss.backward()
+    ref_g = grads(model)
+
+    model.zero_grad()
+    loss = grad_cache_step(model, inputs, chunk_size, lambda reps: cl_loss(model, reps)[0])
+    assert_same(loss, ref_loss, grads(model), ref_g)
+
+
+@pytest.mark.parametrize("num_sent", [2, 3])
+def test_replays_dropout(num_sent):
+    """
+    With dropout, the re-encoded chunks draw the masks of the first pass: compare against one graph
+    over the same chunks in the same order.
+    """
+    inputs = make_inputs(16, num_sent, 12)
+    model = make_model(0.1)
+    torch.manual_seed(1)
+    reps = torch.cat([model(**chunk, embed_only=True) for chunk in split_inputs(inputs, 4)])
+    ref_loss = cl_loss(model, reps)[0]
+    ref_loss.backward()
+    ref_g = grads(model)
+
+    model.zero_grad()
+    torch.manual_seed(1)
+    loss = grad_cache_step(model, inputs, 4, lambda reps: cl_loss(model, reps)[0])
+    assert_same(loss, ref_loss, grads(model), ref_g)
@@ -0,0 +1,87 @@
+import os
+import gc
+
+import numpy as np
+import pytest
+
+from simcse.tool import SimCSE
+
+SENTENCES = ["the cat sat on a mat", "a dog ran far away", "the dog sat", "cat", "a man is playing guitar", "the man ran"]
+MORE = ["the cat ran away", "a mat", "dog"]
+QUERIES = ["the cat sat", "a man is playing"]
+
+BACKENDS = {
+    "flat": {"use_faiss": False},
+    "ivf": {"use_faiss": False, "faiss_fast": True},
+    "hnsw": {"use_faiss": False, "hnsw": True},
+    "int8": {"quantization": "int8"},
+}
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_save_over_loaded_index(model_dir, tmp_path, backend):
+    """
+    load_index(d) memory-maps d; adding to it and saving back to d must not truncate the mapped files.
+    """
+    simcse = SimCSE(model_dir, device="cpu", num_cells=2, num_cells_in_search=2)
+    simcse.build_index(SENTENCES, index_dir=str(tmp_path / "side") if backend == "int8" else None, **BACKENDS[backend])
+    simcse.save_index(str(tmp_path / "index"))
+
+    simcse.load_index(str(tmp_path / "index"))
+    simcse.add_to_index(MORE)
+    expected = simcse.search(QUERIES, threshold=-1, top_k=len(SENTENCES + MORE))
+    simcse.save_index(str(tmp_path / "index"))
+    # The loaded (mapped) index still reads correctly after being saved over
+    assert list(simcse.index["sentences"]) == SENTENCES + MORE
+    assert simcse.search(QUERIES, threshold=-1, top_k=len(SENTENCES + MORE)) == expected
+
+    reloaded = SimCSE(model_dir, device="cpu", num_cells=2, num_cells_in_search=2)
+    reloaded.load_index(str(tmp_path / "index"))
+    assert list(reloaded.index["sentences"]) == SENTENCES + MORE
+    got = reloaded.search(QUERIES, threshold=-1, top_k=len(SENTENCES + MORE))
+    for got_results, expected_results in zip(got, expected):
+        assert [s for s, _ in got_results] == [s for s, _ in expected_results]
+        np.testing.assert_allclose([x for _, x in got_results], [x for _, x in expected_results], atol=1e-5)
+    assert [name for name in (tmp_path / "index").iterdir() if name.name.startswith(".saving_")] == []
+
+
+def test_quantized_temp_dir_removed(model_dir):
+    """
+    A quantized index built without `index_dir` keeps its side file in a temporary directory that
+    goes away with the index.
+    """
+    simcse = SimCSE(model_dir, device="cpu")
+    simcse.build_index(SENTENCES, quantization="int8")
+    first_dir = os.path.dirname(simcse.index["index"].full_vectors_path)
+    assert os.path.exists(first_dir)
+    simcse.build_index(SENTENCES, quantization="int8")
+    second_dir = os.path.dirname(simcse.index["index"].full_vectors_path)
+    gc.collect()
+    assert not os.path.exists(first_dir) and os.path.exists(second_dir)
+    assert len(simcse.search(QUERIES, threshold=-1)) == len(QUERIES)
+    del simcse
+    gc.collect()
+    assert not os.path.exists(second_dir)
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_add_file_in_chunks(model_dir, tmp_path, backend):
+    """
+    Adding the sentences of a file `chunk_size` lines at a time gives the index that adding the list does.
+    """
+    path = tmp_path / "more.txt"
+    path.write_text("".join(s + "\n" for s in MORE))
+    results = []
+    for source in [MORE, str(path)]:
+        simcse = SimCSE(model_dir, device="cpu", num_cells=2, num_cells_in_search=2)
+        simcse.build_index(SENTENCES, **BACKENDS[backend])
+        encoded = []
+        encode = simcse.encode
+        simcse.encode = lambda sentences, **kwargs: encoded.append(len(sentences)) or encode(sentences, **kwargs)
+        simcse.add_to_index(source, chunk_size=2)
+        assert encoded == ([len(MORE)] if isinstance(source, list) else [2, 1])
+        assert list(simcse.index["sentences"]) == SENTENCES + MORE
+        results.append(simcse.search(QUERIES, threshold=-1, top_k=len(SENTENCES + MORE)))
+    for got_results, expected_results in zip(*results):
+        assert [s for s, _ in got_results] == [s for s, _ in expected_results]
+        np.testing.assert_allclose([x for _, x in got_results], [x for _, x in expected_results], atol=1e-5)
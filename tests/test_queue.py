@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn.functional as F
+from transformers import BertConfig, BertModel
+
+from simcse.models import BertForCL, cl_embed
+
+
+def make_model(queue_size, momentum, seed=0):
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=100, hidden_size=32, num_hidden_layers=2, num_attention_heads=4, intermediate_size=64,
+                        hidden_dropout_prob=0.0, attention_probs_dropout_prob=0.0)
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=False, mlm_weight=0.1,
+                                 mlp_only_train=False, queue_size=queue_size, momentum=momentum)
+    return BertForCL(config, model_args=model_args).train()
+
+
+def make_inputs(batch_size, seq_len, generator):
+    input_ids = torch.randint(5, 100, (batch_size, 2, seq_len), generator=generator)
+    return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+
+def rows(x):
+    # Queue order is an implementation detail; compare the sets of rows
+    return torch.tensor(sorted(x.tolist())).view(-1, 32)
+
+
+@pytest.mark.parametrize("momentum", [0.0, 0.9])
+def test_queue_negatives(momentum):
+    """
+    Over a few optimizer steps: the logits have the in-batch columns followed by one column per queued
+    embedding, the loss is the cross entropy over [in-batch negatives; queue], the queue holds the
+    most recent positives (or momentum-encoder embeddings), and the momentum encoder starts as a copy
+    of the encoder and then follows m * copy + (1 - m) * encoder.
+    """
+    batch_size, queue_size = 4, 10
+    model = make_model(queue_size, momentum)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1.0)
+    generator = torch.Generator().manual_seed(0)
+    history = []
+    for step in range(4):
+        inputs = make_inputs(batch_size, 6, generator)
+        expected_queue = torch.cat(history)[-queue_size:] if len(history) > 0 else torch.zeros(0, 32)
+        queued = model.queue[:model.queue_len].clone()
+        before = {n: p.detach().clone() for n, p in model.bert.named_parameters()}
+        key_before = {n: p.detach().clone() for n, p in model.momentum_encoder.named_parameters()} if momentum > 0 else None
+
+        output = model(**inputs)
+        z = cl_embed(model, model.bert, **inputs)[0].detach()
+
+        assert output.logits.shape == (batch_size, batch_size + len(expected_queue))
+        assert queued.shape == expected_queue.shape
+        torch.testing.assert_close(rows(queued), rows(expected_queue), rtol=0, atol=1e-6)
+        z1 = F.normalize(z[:, 0], dim=-1)
+        negatives = F.normalize(torch.cat([z[:, 1], expected_queue]), dim=-1)
+        ref_loss = F.cross_entropy(z1 @ negatives.t() / 0.05, torch.arange(batch_size))
+        torch.testing.assert_close(output.loss, ref_loss, rtol=1e-5, atol=1e-5)
+
+        if momentum > 0:
+            m = momentum if step > 0 else 0.0
+            for n, p in model.momentum_encoder.named_parameters():
+                torch.testing.assert_close(p, m * key_before[n] + (1 - m) * before[n], rtol=0, atol=1e-6)
+            with torch.no_grad():
+                keys = cl_embed(model, model.momentum_encoder, input_ids=inputs["input_ids"][:, 1:2],
+                                attention_mask=inputs["attention_mask"][:, 1:2], mlp=model.momentum_mlp)[0][:, 0]
+        else:
+            keys = z[:, 1]
+        history.append(keys)
+
+        optimizer.zero_grad()
+        output.loss.backward()
+        optimizer.step()
+
+
+def test_momentum_encoder_not_saved(tmp_path):
+    model = make_model(queue_size=8, momentum=0.9)
+    model(**make_inputs(4, 6, torch.Generator().manual_seed(0)))
+    assert not any("momentum_" in k for k in model.state_dict())
+    assert len(model.state_dict()) == len(make_model(queue_size=0, momentum=0.0).state_dict())
+
+    model.save_pretrained(str(tmp_path))
+    encoder, loading_info = BertModel.from_pretrained(str(tmp_path), output_loading_info=True)
+    assert not any("momentum_" in k for k in loading_info["unexpected_keys"])
+    reloaded = BertForCL.from_pretrained(str(tmp_path), model_args=model.model_args)
+    for name, param in model.bert.named_parameters():
+        assert torch.equal(param, dict(reloaded.bert.named_parameters())[name])
@@ -0,0 +1,176 @@
+import json
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from simcse.serve import MicroBatcher, Server, ServerError
+from simcse.tool import SimCSE
+
+SENTENCES = ["the cat sat on a mat", "a dog ran far away", "a man is playing guitar"]
+
+
+@pytest.fixture(scope="module")
+def simcse(model_dir):
+    simcse = SimCSE(model_dir, device="cpu")
+    simcse.build_index(SENTENCES, use_faiss=False)
+    return simcse
+
+
+def handle(simcse, requests):
+    """
+    Send (path, body) requests concurrently to a fresh server; returns the response or the `ServerError` of each.
+    """
+    async def run():
+        batcher = MicroBatcher(simcse, max_wait_ms=20)
+        batcher.start()
+        server = Server(batcher)
+        bodies = [request if isinstance(request, bytes) else json.dumps(request).encode("utf-8") for _, request in requests]
+        return await asyncio.gather(*[server._handle("POST", path, body) for (path, _), body in zip(requests, bodies)],
+                                    return_exceptions=True)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("path,body", [
+    ("/encode", b"[]"),
+    ("/encode", b"\"the cat\""),
+    ("/encode", {"sentences": ["the cat"], "timeout": "soon"}),
+    ("/encode", {"sentences": ["the cat"], "timeout": 0}),
+    ("/encode", {"sentences": ["the cat"], "timeout": -1}),
+    ("/search", {"queries": ["the cat"], "top_k": "five"}),
+    ("/search", {"queries": ["the cat"], "top_k": 0}),
+    ("/search", {"queries": ["the cat"], "top_k": None}),
+    ("/search", {"queries": ["the cat"], "top_k": 2.5}),
+    ("/search", {"queries": ["the cat"], "top_k": len(SENTENCES) + 1}),
+    ("/search", {"queries": ["the cat"], "threshold": [0.5]}),
+])
+def test_bad_request(simcse, path, body):
+    error, = handle(simcse, [(path, body)])
+    assert isinstance(error, ServerError) and error.status == 400
+
+
+def test_bad_request_does_not_fail_batch(simcse):
+    """
+    A rejected request never joins a batch, so requests sent alongside it are answered.
+    """
+    responses = handle(simcse, [("/search", {"queries": ["the cat sat"], "top_k": 2}),
+                                ("/search", {"queries": ["a dog"], "top_k": -3}),
+                                ("/encode", {"sentences": ["a man is playing guitar"]})])
+    assert isinstance(responses[1], ServerError) and responses[1].status == 400
+    expected = simcse.search(["the cat sat"], threshold=0.6, top_k=2)
+    assert [[s for s, _ in result] for result in responses[0]["results"]] == [[s for s, _ in result] for result in expected]
+    np.testing.assert_allclose(responses[2]["embeddings"], simcse.encode(["a man is playing guitar"], return_numpy=True),
+                               rtol=1e-4, atol=1e-5)
+
+
+class StubTokenizer(object):
+    def __call__(self, sentences, truncation=True, max_length=None):
+        return {"input_ids": [s.split()[:max_length] for s in sentences]}
+
+
+class StubModel(object):
+    """
+    Records the size of every forward batch; `encode` blocks until `release` is set.
+    """
+    def __init__(self):
+        self.tokenizer = StubTokenizer()
+        self.index = {"sentences": SENTENCES}
+        self.batch_sizes = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def encode(self, sentences, **kwargs):
+        self.release.wait()
+        self.batch_sizes.append(len(sentences))
+        return np.ones((len(sentences), 4), dtype=np.float32)
+
+    def search_vectors(self, query_vecs, threshold=0.6, top_k=5):
+        return [[(s, 1.0) for s in SENTENCES[:top_k]] for _ in query_vecs]
+
+
+def encode_request(server, sentences, timeout=10.0):
+    return server._handle("POST", "/encode", json.dumps({"sentences": sentences, "timeout": timeout}).encode("utf-8"))
+
+
+def test_concurrent_requests_share_batch():
+    model = StubModel()
+
+    async def run():
+        batcher = MicroBatcher(model, max_wait_ms=200)
+        batcher.start()
+        server = Server(batcher)
+        return await asyncio.gather(encode_request(server, ["the cat"]), encode_request(server, ["a dog", "a man"]),
+                                    server._handle("POST", "/search", json.dumps({"queries": ["the mat"], "top_k": 2}).encode("utf-8")))
+    responses = asyncio.run(run())
+    assert model.batch_sizes == [4]
+    assert [len(r["embeddings"]) for r in responses[:2]] == [1, 2]
+    assert responses[2]["results"] == [[(s, 1.0) for s in SENTENCES[:2]]]
+
+
+def test_full_queue_rejected():
+    model = StubModel()
+    model.release.clear()
+
+    async def run():
+        batcher = MicroBatcher(model, max_wait_ms=0, max_queue=1)
+        batcher.start()
+        server = Server(batcher)
+        try:
+            # The first request blocks the worker, the second fills the queue
+            running = asyncio.ensure_future(encode_request(server, ["the cat"]))
+            await asyncio.sleep(0.2)
+            queued = asyncio.ensure_future(encode_request(server, ["a dog"]))
+            await asyncio.sleep(0.2)
+            with pytest.raises(ServerError) as e:
+                await asyncio.wait_for(encode_request(server, ["a man"]), 5)
+            assert e.value.status == 503 and batcher.stats["rejected"] == 1
+        finally:
+            model.release.set()
+        return await asyncio.gather(running, queued)
+    responses = asyncio.run(run())
+    assert [len(r["embeddings"]) for r in responses] == [1, 1]
+    assert model.batch_sizes == [1, 1]
+
+
+def test_deadline_exceeded():
+    model = StubModel()
+    model.release.clear()
+
+    async def run():
+        batcher = MicroBatcher(model, max_wait_ms=0)
+        batcher.start()
+        server = Server(batcher)
+        try:
+            running = asyncio.ensure_future(encode_request(server, ["the cat"]))
+            await asyncio.sleep(0.2)
+            with pytest.raises(ServerError) as e:
+                await asyncio.wait_for(encode_request(server, ["a dog"], timeout=0.1), 5)
+            assert e.value.status == 504 and batcher.stats["timed_out"] >= 1
+        finally:
+            model.release.set()
+        await running
+        # The expired request is dropped instead of being encoded
+        await encode_request(server, ["a man"])
+    asyncio.run(run())
+    assert model.batch_sizes == [1, 1]
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-5"])
+def test_bad_content_length(content_length):
+    async def run():
+        batcher = MicroBatcher(StubModel())
+        batcher.start()
+        tcp_server = await asyncio.start_server(Server(batcher).handle_connection, "127.0.0.1", 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(("POST /encode HTTP/1.1\r\nContent-Length: %s\r\n\r\n" % content_length).encode("latin1"))
+        await writer.drain()
+        # The server closes the connection after the response
+        response = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+        tcp_server.close()
+        await tcp_server.wait_closed()
+        return response
+    response = asyncio.run(run())
+    assert response.startswith(b"HTTP/1.1 400 ") and b"Connection: close" in response
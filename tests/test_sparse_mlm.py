@@ -0,0 +1,61 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn as nn
+from transformers import BertConfig
+
+# Module and number of sentences per instance it expects
+VARIANTS = [("simcse.models", 3), ("simcse.models_hard", 5), ("simcse.models_aug", 5), ("simcse.models_HSCL", 3), ("simcse.model_mp", 4)]
+
+
+def make_inputs(batch_size, num_sent, seq_len, vocab_size, generator, mlm_probability=0.15):
+    input_ids = torch.randint(5, vocab_size, (batch_size, num_sent, seq_len), generator=generator)
+    masked = torch.rand(input_ids.shape, generator=generator) < mlm_probability
+    return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids), "token_type_ids": torch.zeros_like(input_ids),
+            "mlm_input_ids": torch.where(masked, torch.full_like(input_ids, 4), input_ids),
+            "mlm_labels": torch.where(masked, input_ids, torch.full_like(input_ids, -100))}
+
+
+def dense_mlm_loss(model, inputs):
+    seq_len = inputs["mlm_input_ids"].size(-1)
+    outputs = model.bert(inputs["mlm_input_ids"].view(-1, seq_len), attention_mask=inputs["attention_mask"].view(-1, seq_len),
+                         token_type_ids=inputs["token_type_ids"].view(-1, seq_len), return_dict=True)
+    prediction_scores = model.lm_head(outputs.last_hidden_state)
+    return nn.CrossEntropyLoss()(prediction_scores.view(-1, model.config.vocab_size), inputs["mlm_labels"].view(-1))
+
+
+def grads(model):
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+@pytest.mark.parametrize("module_name,num_sent", VARIANTS)
+def test_sparse_mlm_matches_dense(module_name, num_sent):
+    """
+    The MLM loss with the LM head run only on labelled positions equals the dense computation (LM head
+    over every token, cross entropy ignoring -100), for the loss and the parameter gradients.
+    """
+    module = importlib.import_module(module_name)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=200, hidden_size=32, num_hidden_layers=2, num_attention_heads=4, intermediate_size=64,
+                        hidden_dropout_prob=0.0, attention_probs_dropout_prob=0.0)
+    model_args = SimpleNamespace(pooler_type="cls", temp=0.05, hard_negative_weight=0.0, do_mlm=True, mlm_weight=0.1, mlp_only_train=False)
+    model = module.BertForCL(config, model_args=model_args).train()
+    inputs = make_inputs(4, num_sent, 10, config.vocab_size, torch.Generator().manual_seed(0))
+
+    loss = model(**inputs).loss
+    loss.backward()
+    sparse_grads = grads(model)
+
+    model.zero_grad()
+    cl_inputs = {k: v for k, v in inputs.items() if not k.startswith("mlm_")}
+    ref_loss = model(**cl_inputs).loss + model_args.mlm_weight * dense_mlm_loss(model, inputs)
+    ref_loss.backward()
+    ref_grads = grads(model)
+
+    torch.testing.assert_close(loss, ref_loss, rtol=1e-5, atol=1e-6)
+    assert set(sparse_grads) == set(ref_grads)
+    scale = max(max(g.abs().max().item() for g in ref_grads.values()), 1.0)
+    for n in ref_grads:
+        torch.testing.assert_close(sparse_grads[n], ref_grads[n], rtol=0, atol=1e-5 * scale)
@@ -7,10 +7,9 @@ from dataclasses import dataclass, field
 from typing import Optional, Union, List, Dict, Tuple
 import torch
 import collections
+import functools
 import random
 
-from datasets import load_dataset
-
 import transformers
 from transformers import (
     CONFIG_MAPPING,
@@ -37,6 +36,9 @@ from transformers.data.data_collator import DataCollatorForLanguageModeling
 from transformers.file_utils import cached_property, torch_required, is_torch_available, is_torch_tpu_available
 from simcse.models import RobertaForCL, BertForCL
 from simcse.trainers import CLTrainer
+from simcse.frozen import FrozenLayerCache, assign_sentence_ids
+from simcse.data import (PretokenizedDataset, StreamingTrainDataset, collate_views, feature_columns, load_train_dataset,
+                         mask_tokens, special_token_ids, tokenize_examples)
 
 logger = logging.getLogger(__name__)
 MODEL_CONFIG_CLASSES = list(MODEL_FOR_MASKED_LM_MAPPING.keys())
@@ -123,6 +125,60 @@ class ModelArguments:
             "help": "Use MLP only during training"
         }
     )
+    queue_size: int = field(
+        default=0,
+        metadata={
+            "help": "Number of embeddings from previous steps kept in a FIFO queue and used as extra negatives (0 disables the queue)."
+        }
+    )
+    momentum: float = field(
+        default=0.0,
+        metadata={
+            "help": "If > 0, fill the queue with a momentum copy of the encoder updated as momentum * copy + (1 - momentum) * encoder "
+            "(e.g., 0.999); otherwise queue the detached positives of the encoder itself. Only effective with queue_size > 0."
+        }
+    )
+    pack_sequences: bool = field(
+        default=False,
+        metadata={
+            "help": "Pack several sentences into each row with block-diagonal attention when encoding for the contrastive loss, "
+            "so the encoder skips most of the padding."
+        }
+    )
+    activation_checkpointing: bool = field(
+        default=False,
+        metadata={
+            "help": "Checkpoint every encoder layer: recompute its activations in the backward pass instead of storing them, "
+            "trading about one extra forward pass for a much larger batch. Dropout masks are reproduced exactly."
+        }
+    )
+    freeze_layers: int = field(
+        default=0,
+        metadata={
+            "help": "Freeze the embeddings and this many bottom encoder layers (run in eval mode), and cache their outputs "
+            "for every training sentence in a memory-mapped file in the output directory, so later epochs only run the upper layers."
+        }
+    )
+    frozen_cache_fp16: bool = field(
+        default=False,
+        metadata={
+            "help": "Store the cached outputs of the frozen layers in float16, halving the cache file (only effective with --freeze_layers)."
+        }
+    )
+    matryoshka_dims: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Comma-separated embedding sizes (e.g., 64,128,256,512) whose prefixes also get the contrastive loss, "
+            "so that truncated embeddings stay usable."
+        }
+    )
+    matryoshka_weights: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Comma-separated loss weights, one per entry of --matryoshka_dims (default: 1 each). "
+            "The full embedding's loss has weight 1 unless its size is listed."
+        }
+    )
 
 
 @dataclass
@@ -157,6 +213,21 @@ class DataTrainingArguments:
         default=None, 
         metadata={"help": "The training data file (.txt or .csv)."}
     )
+    pretokenized_dir: Optional[str] = field(
+        default=None,
+        metadata={"help": "A training set tokenized ahead of time with `python -m simcse.data`, used instead of --train_file."}
+    )
+    streaming: bool = field(
+        default=False,
+        metadata={
+            "help": "Read --train_file (.csv, .tsv or .jsonl) lazily and tokenize it in the DataLoader workers instead of "
+            "loading it up front. Requires --max_steps."
+        }
+    )
+    shuffle_buffer_size: int = field(
+        default=10000,
+        metadata={"help": "With --streaming, the number of examples each DataLoader worker shuffles at a time."}
+    )
     max_seq_length: Optional[int] = field(
         default=32,
         metadata={
@@ -175,14 +246,21 @@ class DataTrainingArguments:
         default=0.15, 
         metadata={"help": "Ratio of tokens to mask for MLM (only effective if --do_mlm)"}
     )
+    mlm_on_device: bool = field(
+        default=False,
+        metadata={"help": "Mask tokens for MLM in the training step on the training device, instead of in the "
+                  "collator on the CPU of the DataLoader workers (only effective if --do_mlm)"}
+    )
 
     def __post_init__(self):
-        if self.dataset_name is None and self.train_file is None and self.validation_file is None:
-            raise ValueError("Need either a dataset name or a training/validation file.")
+        if self.dataset_name is None and self.train_file is None and self.pretokenized_dir is None:
+            raise ValueError("Need either a dataset name, a training file or a pre-tokenized training set.")
         else:
             if self.train_file is not None:
                 extension = self.train_file.split(".")[-1]
          #      assert extension in ["csv", "json", "txt"], "`train_file` should be a csv, a json or a txt file."
+            if self.streaming and self.train_file is None:
+                raise ValueError("--streaming reads --train_file.")
 
 
 @dataclass
@@ -195,6 +273,23 @@ class OurTrainingArguments(TrainingArguments):
         default=False,
         metadata={"help": "Evaluate transfer task dev sets (in validation)."}
     )
+    # Gradient caching
+    grad_cache_chunk_size: int = field(
+        default=0,
+        metadata={
+            "help": "If > 0, encode each batch in chunks of this many examples with gradient caching, so the "
+            "contrastive loss sees the whole batch as negatives while memory is bounded by the chunk size."
+        }
+    )
+    # Length grouping
+    length_group_size: int = field(
+        default=0,
+        metadata={
+            "help": "If > 0, sort random mega-batches of this many batches by length and cut them into batches (in "
+            "shuffled order), so views are padded less. 1 keeps random batches; larger values pad less but group "
+            "in-batch negatives by length."
+        }
+    )
 
     @cached_property
     @torch_required
@@ -300,22 +395,19 @@ def main():
     #
     # In distributed training, the load_dataset function guarantee that only one local process can concurrently
     # download the dataset.
-    data_files = {}
-
-    if data_args.train_file is not None:
-        data_files["train"] = data_args.train_file
-    extension = data_args.train_file.split(".")[-1]
-    dataset_cache_prefix = data_args.train_file.split("/")[-1]
-    if extension == "txt":
-        extension = "text"
-    if extension == "csv":
-        dataset_cache_prefix = dataset_cache_prefix.split(".")[-2]
-        datasets = load_dataset(extension, data_files=data_files, cache_dir=f"../DATA/cache/{dataset_cache_prefix}", delimiter="\t" if "tsv" in data_args.train_file else ",")
-    else:
-        print("load huggging face dataset")
-        datasets = load_dataset(data_args.train_file, cache_dir=f"../DATA/cache/{dataset_cache_prefix}")
-
-    datasets = datasets.shuffle(seed=42)
+    #
+    # With --pretokenized_dir, the examples were tokenized ahead of time in this order (see simcse.data).
+    # With --streaming, the file is read while training.
+    if data_args.streaming:
+        if training_args.max_steps <= 0:
+            raise ValueError("A streamed training set has no length: set --max_steps.")
+        if model_args.freeze_layers > 0 or training_args.length_group_size > 0:
+            raise ValueError("--freeze_layers and --length_group_size need the whole training set and do not work with --streaming.")
+    elif data_args.pretokenized_dir is None:
+        dataset_cache_prefix = data_args.train_file.split("/")[-1]
+        if data_args.train_file.split(".")[-1] == "csv":
+            dataset_cache_prefix = dataset_cache_prefix.split(".")[-2]
+        datasets = load_train_dataset(data_args.train_file, cache_dir=f"../DATA/cache/{dataset_cache_prefix}")
     #datasets['train'] = datasets["train"].select(range(275497))
     # See more about loading any type of standard or custom dataset (from files, python dict, pandas DataFrame, etc) at
     # https://huggingface.co/docs/datasets/loading_datasets.html.
@@ -387,73 +479,44 @@ def main():
     model.resize_token_embeddings(len(tokenizer))
 
     # Prepare features
-    column_names = datasets["train"].column_names
-    sent2_cname = None
-    if len(column_names) == 2:
-        # Pair datasets
-        sent0_cname = column_names[0]
-        sent1_cname = column_names[1]
-    elif len(column_names) == 3:
-        # Pair datasets with hard negatives
-        sent0_cname = column_names[0]
-        sent1_cname = column_names[1]
-        sent2_cname = column_names[2]
-    elif len(column_names) == 1:
-        # Unsupervised datasets
-        sent0_cname = column_names[0]
-        sent1_cname = column_names[0]
-    else:
-        sent0_cname = column_names[0]
-        sent1_cname = column_names[1]
-        sent2_cname = column_names[3]
+    if data_args.pretokenized_dir is None and not data_args.streaming:
+        column_names = datasets["train"].column_names
+        columns = feature_columns(column_names)
+
     def prepare_features(examples):
-        # padding = longest (default)
-        #   If no sentence in the batch exceed the max length, then use
-        #   the max sentence length in the batch, otherwise use the 
-        #   max sentence length in the argument and truncate those that
-        #   exceed the max length.
-        # padding = max_length (when pad_to_max_length, for pressure test)
-        #   All sentences are padded/truncated to data_args.max_seq_length.
-        SUP=True
-        total = len(examples[sent0_cname])
-        # Avoid "None" fields 
-        for idx in range(total):
-            if examples[sent0_cname][idx] is None:
-                examples[sent0_cname][idx] = " "
-            if examples[sent1_cname][idx] is None:
-                examples[sent1_cname][idx] = " "
-        sentences = examples[sent0_cname] + examples[sent1_cname]
-        # If hard negative exists
-        if sent2_cname is not None and SUP:
-            for idx in range(total):
-                if examples[sent2_cname][idx] is None:
-                    examples[sent2_cname][idx] = " "
-            sentences += examples[sent2_cname]
-
-        sent_features = tokenizer(
-            sentences,
-            max_length=data_args.max_seq_length,
-            truncation=True,
-            padding="max_length" if data_args.pad_to_max_length else False,
-        )
-        features = {}
-        if sent2_cname is not None and SUP:
-            for key in sent_features:
-                features[key] = [[sent_features[key][i], sent_features[key][i+total], sent_features[key][i+total*2]] for i in range(total)]
-        else:
-            for key in sent_features:
-                features[key] = [[sent_features[key][i], sent_features[key][i+total]] for i in range(total)]
-            
-        return features
+        return tokenize_examples(examples, tokenizer, columns, data_args.max_seq_length, pad_to_max_length=data_args.pad_to_max_length)
 
     if training_args.do_train:
-        train_dataset = datasets["train"].map(
-            prepare_features,
-            batched=True,
-            num_proc=data_args.preprocessing_num_workers,
-            remove_columns=column_names,
-            load_from_cache_file=not data_args.overwrite_cache,
-        )
+        if data_args.pretokenized_dir is not None:
+            train_dataset = PretokenizedDataset(data_args.pretokenized_dir)
+            train_dataset.check_compatible(tokenizer, data_args.max_seq_length)
+        elif data_args.streaming:
+            train_dataset = StreamingTrainDataset(data_args.train_file, tokenizer, data_args.max_seq_length,
+                                                  pad_to_max_length=data_args.pad_to_max_length,
+                                                  buffer_size=data_args.shuffle_buffer_size)
+        else:
+            train_dataset = datasets["train"].map(
+                prepare_features,
+                batched=True,
+                num_proc=data_args.preprocessing_num_workers,
+                remove_columns=column_names,
+                load_from_cache_file=not data_args.overwrite_cache,
+            )
+
+        if model_args.freeze_layers > 0:
+            # Number the unique sentences and cache the frozen layers' output for each of them
+            if isinstance(train_dataset, PretokenizedDataset):
+                sent_ids, lengths = train_dataset.sentence_ids()
+            else:
+                sent_ids, lengths = assign_sentence_ids(train_dataset["input_ids"], train_dataset["attention_mask"])
+            train_dataset = train_dataset.add_column("sent_ids", sent_ids)
+            os.makedirs(training_args.output_dir, exist_ok=True)
+            cache_file = "frozen_layer_cache.bin"
+            if torch.distributed.is_initialized():
+                cache_file = f"frozen_layer_cache.{torch.distributed.get_rank()}.bin"
+            model.frozen_cache = FrozenLayerCache(os.path.join(training_args.output_dir, cache_file), lengths, config.hidden_size,
+                                                  dtype="float16" if model_args.frozen_cache_fp16 else "float32")
+            logger.info(f"Caching frozen layer outputs of {len(lengths)} unique sentences ({lengths.sum()} tokens) in {cache_file}")
 
     # Data collator
     @dataclass
@@ -465,6 +528,7 @@ def main():
         pad_to_multiple_of: Optional[int] = None
         mlm: bool = True
         mlm_probability: float = data_args.mlm_probability
+        special_ids: Optional[torch.Tensor] = None
 
         def __call__(self, features: List[Dict[str, Union[List[int], List[List[int]], torch.Tensor]]]) -> Dict[str, torch.Tensor]:
             special_keys = ['input_ids', 'attention_mask', 'token_type_ids', 'mlm_input_ids', 'mlm_labels']
@@ -473,22 +537,21 @@ def main():
                 num_sent = len(features[0]['input_ids'])
             else:
                 return
-            flat_features = []
-            for feature in features:
-                for i in range(num_sent):
-                    flat_features.append({k: feature[k][i] if k in special_keys else feature[k] for k in feature})
-
-            batch = self.tokenizer.pad(
-                flat_features,
-                padding=self.padding,
-                max_length=self.max_length,
+
+            # Pad all views at once into (bs * num_sent, len) tensors
+            batch = collate_views(
+                features,
+                pad_token_id=self.tokenizer.pad_token_id,
+                pad_token_type_id=self.tokenizer.pad_token_type_id,
+                padding_side=self.tokenizer.padding_side,
+                max_length=self.max_length if self.padding == "max_length" else None,
                 pad_to_multiple_of=self.pad_to_multiple_of,
-                return_tensors="pt",
+                return_token_type_ids="token_type_ids" in self.tokenizer.model_input_names,
             )
-            if model_args.do_mlm:
+            if model_args.do_mlm and not data_args.mlm_on_device:
                 batch["mlm_input_ids"], batch["mlm_labels"] = self.mask_tokens(batch["input_ids"])
 
-            batch = {k: batch[k].view(bs, num_sent, -1) if k in special_keys else batch[k].view(bs, num_sent, -1)[:, 0] for k in batch}
+            batch = {k: batch[k].view(bs, num_sent, -1) if k in special_keys else batch[k] for k in batch}
 
             if "label" in batch:
                 batch["labels"] = batch["label"]
@@ -505,35 +568,16 @@ def main():
             """
             Prepare masked tokens inputs/labels for masked language modeling: 80% MASK, 10% random, 10% original.
             """
-            inputs = inputs.clone()
-            labels = inputs.clone()
-            # We sample a few tokens in each sequence for MLM training (with probability `self.mlm_probability`)
-            probability_matrix = torch.full(labels.shape, self.mlm_probability)
-            if special_tokens_mask is None:
-                special_tokens_mask = [
-                    self.tokenizer.get_special_tokens_mask(val, already_has_special_tokens=True) for val in labels.tolist()
-                ]
-                special_tokens_mask = torch.tensor(special_tokens_mask, dtype=torch.bool)
-            else:
-                special_tokens_mask = special_tokens_mask.bool()
-
-            probability_matrix.masked_fill_(special_tokens_mask, value=0.0)
-            masked_indices = torch.bernoulli(probability_matrix).bool()
-            labels[~masked_indices] = -100  # We only compute loss on masked tokens
-
-            # 80% of the time, we replace masked input tokens with tokenizer.mask_token ([MASK])
-            indices_replaced = torch.bernoulli(torch.full(labels.shape, 0.8)).bool() & masked_indices
-            inputs[indices_replaced] = self.tokenizer.convert_tokens_to_ids(self.tokenizer.mask_token)
-
-            # 10% of the time, we replace masked input tokens with random word
-            indices_random = torch.bernoulli(torch.full(labels.shape, 0.5)).bool() & masked_indices & ~indices_replaced
-            random_words = torch.randint(len(self.tokenizer), labels.shape, dtype=torch.long)
-            inputs[indices_random] = random_words[indices_random]
-
-            # The rest of the time (10% of the time) we keep the masked input tokens unchanged
-            return inputs, labels
-
-    data_collator = default_data_collator if data_args.pad_to_max_length else OurDataCollatorWithPadding(tokenizer)
+            if self.special_ids is None:
+                self.special_ids = special_token_ids(self.tokenizer)
+            return mask_tokens(inputs, self.tokenizer.mask_token_id, len(self.tokenizer), self.special_ids,
+                               mlm_probability=self.mlm_probability, special_tokens_mask=special_tokens_mask)
+
+    if data_args.pad_to_max_length and data_args.pretokenized_dir is not None:
+        # Pre-tokenized examples are stored unpadded
+        data_collator = OurDataCollatorWithPadding(tokenizer, padding="max_length", max_length=data_args.max_seq_length)
+    else:
+        data_collator = default_data_collator if data_args.pad_to_max_length else OurDataCollatorWithPadding(tokenizer)
 
     trainer = CLTrainer(
         model=model,
@@ -543,6 +587,9 @@ def main():
         data_collator=data_collator,
     )
     trainer.model_args = model_args
+    if model_args.do_mlm and data_args.mlm_on_device:
+        trainer.mlm_masking = functools.partial(mask_tokens, mask_token_id=tokenizer.mask_token_id, vocab_size=len(tokenizer),
+                                                special_ids=special_token_ids(tokenizer), mlm_probability=data_args.mlm_probability)
 
     # Training
     if training_args.do_train:
@@ -553,6 +600,8 @@ def main():
         )
         train_result = trainer.train(model_path=model_path)
         trainer.save_model()  # Saves the tokenizer too for easy upload
+        if model_args.freeze_layers > 0:
+            model.frozen_cache.close()
 
         output_train_file = os.path.join(training_args.output_dir, "train_results.txt")
         if trainer.is_world_process_zero():